@@ -7,16 +7,33 @@ export interface BirdDetection {
   label: string;
 }
 
+export interface BirdEvent {
+  startTime: string;
+  endTime: string;
+  start: number;
+  end: number;
+  scientificName: string;
+  commonName: string;
+  maxConfidence: number;
+  meanConfidence: number;
+  segmentCount: number;
+}
+
 export interface AnalysisSummary {
   totalDetections: number;
   speciesCount: number;
   audioDuration: string;
+  audioDurationSeconds?: number;
+  totalEvents?: number | null;
 }
 
 export interface AnalysisData {
+  analysisId?: string;
   fileName: string;
   analysisTime: number;
+  detail?: 'segments' | 'events';
   detections: BirdDetection[];
+  events?: BirdEvent[] | null;
   summary: AnalysisSummary;
 }
 
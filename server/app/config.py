@@ -1,3 +1,4 @@
+import json
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -15,7 +16,11 @@ CORS_ORIGIN = os.getenv("CORS_ORIGIN", "http://localhost:3000")
 BASE_DIR = Path(__file__).parent.parent
 UPLOAD_DIR = BASE_DIR / "uploads"
 OUTPUT_DIR = BASE_DIR / "outputs"
-IMAGE_CACHE_DIR = BASE_DIR / "image_cache"  # 鸟类图片缓存目录
+CACHE_DIR = Path(os.getenv("CACHE_DIR", BASE_DIR / "cache"))  # 本地磁盘缓存目录（鸟类图片、分析结果）
+SCORE_STORE_DIR = BASE_DIR / "scores"  # 分数矩阵磁盘存储目录
+VECTOR_INDEX_DIR = BASE_DIR / "vector_index"  # 片段嵌入向量索引目录（持久化，不参与清理）
+MODELS_DIR = Path(os.getenv("MODELS_DIR", str(BASE_DIR / "models")))  # 自定义分类器目录（xxx.tflite + xxx_Labels.txt）
+DATA_DIR = BASE_DIR / "data"  # 持久化数据目录（检测结果数据库，不参与清理）
 
 # 确保 PYTHON_PATH 是绝对路径（相对于 BASE_DIR）
 _python_path_from_env = os.getenv("PYTHON_PATH", "python")
@@ -26,16 +31,119 @@ else:
 
 ANALYSIS_TIMEOUT = int(os.getenv("ANALYSIS_TIMEOUT", "300"))  # 5分钟
 
+# 推理线程自动调优结果（tune_inference.py 或 AUTOTUNE_ON_STARTUP 生成）
+# 只在 CPU 核数与调优时一致时采用；环境变量显式设置的值优先
+TUNING_FILE = Path(os.getenv("TUNING_FILE", str(BASE_DIR / "tuning.json")))
+AUTOTUNE_ON_STARTUP = os.getenv("AUTOTUNE_ON_STARTUP", "false").lower() == "true"  # 没有可用的调优结果时在启动时校准
+
+
+def _load_tuning() -> dict:
+    try:
+        tuning = json.loads(TUNING_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return tuning if tuning.get("cpuCount") == os.cpu_count() else {}
+
+
+TUNING = _load_tuning()
+
 # 确保目录存在
 UPLOAD_DIR.mkdir(exist_ok=True)
 OUTPUT_DIR.mkdir(exist_ok=True)
-IMAGE_CACHE_DIR.mkdir(exist_ok=True)
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+SCORE_STORE_DIR.mkdir(exist_ok=True)
+VECTOR_INDEX_DIR.mkdir(exist_ok=True)
+MODELS_DIR.mkdir(parents=True, exist_ok=True)
+DATA_DIR.mkdir(exist_ok=True)
 
 # 文件清理配置
 CLEANUP_ENABLED = os.getenv("CLEANUP_ENABLED", "true").lower() == "true"
 CLEANUP_INTERVAL = int(os.getenv("CLEANUP_INTERVAL", "3600"))  # 1小时
 CLEANUP_MAX_AGE = int(os.getenv("CLEANUP_MAX_AGE", "86400"))  # 24小时
 
+# BirdNET 推理配置（默认值与 BirdNET-Analyzer 一致）
+MIN_CONFIDENCE = float(os.getenv("MIN_CONFIDENCE", "0.25"))
+SENSITIVITY = float(os.getenv("SENSITIVITY", "1.0"))
+INFERENCE_BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", "16"))  # 每次送入模型的片段数
+EVENT_MERGE_GAP = float(os.getenv("EVENT_MERGE_GAP", "0"))  # 合并事件时允许的同种片段间隔（秒）
+
+# 分数矩阵保留配置（用于不重新推理的重新筛选）
+SCORE_STORE_BACKEND = os.getenv("SCORE_STORE_BACKEND", "memory")  # memory / disk
+SCORE_STORE_TTL = int(os.getenv("SCORE_STORE_TTL", "3600"))  # 1小时
+SCORE_STORE_MAX_BYTES = int(os.getenv("SCORE_STORE_MAX_BYTES", str(512 * 1024 * 1024)))  # 内存模式上限 512MB
+
+# 波形和频谱图配置（分析时顺带计算，按分析 ID 分瓦片存入缓存后端）
+VISUAL_ENABLED = os.getenv("VISUAL_ENABLED", "true").lower() == "true"
+VISUAL_TTL = int(os.getenv("VISUAL_TTL", str(SCORE_STORE_TTL)))  # 与分数矩阵相同的保留时间
+VISUAL_TILE_COLUMNS = int(os.getenv("VISUAL_TILE_COLUMNS", "1024"))  # 每个瓦片的列数
+WAVEFORM_PEAKS_PER_SECOND = int(os.getenv("WAVEFORM_PEAKS_PER_SECOND", "100"))  # 基础缩放级别每秒的峰值对数
+SPECTROGRAM_FFT_SIZE = int(os.getenv("SPECTROGRAM_FFT_SIZE", "2048"))  # STFT 窗长（不重叠，48 kHz 下每秒约 23 列）
+SPECTROGRAM_BINS = int(os.getenv("SPECTROGRAM_BINS", "128"))  # 频带数
+SPECTROGRAM_MAX_FREQ = float(os.getenv("SPECTROGRAM_MAX_FREQ", "12000"))  # 频谱图上限频率（Hz）
+SPECTROGRAM_DB_RANGE = float(os.getenv("SPECTROGRAM_DB_RANGE", "100"))  # 动态范围（dB）
+
+# 嵌入向量 / 相似度搜索配置
+EMBEDDINGS_ENABLED = os.getenv("EMBEDDINGS_ENABLED", "false").lower() == "true"  # 默认是否提取片段嵌入
+VECTOR_SEARCH_BLOCK_SIZE = int(os.getenv("VECTOR_SEARCH_BLOCK_SIZE", "262144"))  # 暴力搜索每块向量数
+VECTOR_INDEX_IVF_MIN_VECTORS = int(os.getenv("VECTOR_INDEX_IVF_MIN_VECTORS", "1000000"))  # 达到该数量后构建近似索引
+VECTOR_INDEX_IVF_NPROBE = int(os.getenv("VECTOR_INDEX_IVF_NPROBE", "16"))  # 近似搜索扫描的倒排列表数
+
+# 分析调度配置
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", str(TUNING.get("analysisWorkers", 1))))  # 推理工作线程数
+INTERACTIVE_MAX_DURATION = float(os.getenv("INTERACTIVE_MAX_DURATION", "60"))  # 不超过该时长（秒）的录音按交互请求优先调度
+SCHEDULER_BATCH_SEGMENTS = int(os.getenv("SCHEDULER_BATCH_SEGMENTS", "20"))  # 长录音切分的每批片段数（20 段 = 60 秒）
+SCHEDULER_BATCH_SHARE = int(os.getenv("SCHEDULER_BATCH_SHARE", "4"))  # 交互请求积压时，每 N 次调度至少分给批量请求 1 次
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))  # 检测客户端断开的间隔（秒）
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "0"))  # 服务前的可信反向代理层数，客户端 IP 取 X-Forwarded-For 中最外层可信代理添加的一跳
+API_KEYS = {k.strip() for k in os.getenv("API_KEYS", "").split(",") if k.strip()}  # 有效的 X-API-Key（逗号分隔），为空时忽略该请求头
+
+# 分析流水线配置
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", "2"))  # 解码线程数
+POSTPROCESS_WORKERS = int(os.getenv("POSTPROCESS_WORKERS", "2"))  # 后处理（阈值筛选、事件合并、序列化）线程数
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))  # 每个请求最多已解码但未推理完的批次数
+PIPELINE_SPILL_SEGMENTS = int(os.getenv("PIPELINE_SPILL_SEGMENTS", "1200"))  # 推理输出超过该片段数（约 1 小时）后转存到临时文件
+FFMPEG_STREAM_DECODE = os.getenv("FFMPEG_STREAM_DECODE", "true").lower() == "true"  # libsndfile 不支持的格式用 ffmpeg 管道流式解码，不再先转换为 WAV
+
+# 模型注册表配置
+DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "global")  # 请求未指定 model 时使用的模型
+MODEL_CACHE_MAX_BYTES = int(os.getenv("MODEL_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))  # 已加载模型的内存上限 1GB，超出时按 LRU 卸载
+MODEL_INTERPRETERS = int(os.getenv("MODEL_INTERPRETERS", str(ANALYSIS_WORKERS)))  # 每个模型的解释器实例数（并发推理数，加载时全部创建并预热）
+MODEL_PRELOAD = [m.strip() for m in os.getenv("MODEL_PRELOAD", DEFAULT_MODEL).split(",") if m.strip()]  # 启动时加载并预热的模型
+TFLITE_THREADS = int(os.getenv("TFLITE_THREADS", str(TUNING.get("tfliteThreads", 1))))  # 每个解释器的线程数
+
+# 检测结果持久化配置
+DETECTION_STORE_ENABLED = os.getenv("DETECTION_STORE_ENABLED", "false").lower() == "true"  # 是否把每次分析的检测结果写入数据库
+DETECTION_STORE_PATH = Path(os.getenv("DETECTION_STORE_PATH", str(DATA_DIR / "detections.sqlite")))
+
+# 缓存配置（鸟类图片和分析结果；多副本部署时用 shared / redis 在副本间共享）
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "disk")  # memory / disk / shared / redis
+CACHE_SHARED_DIR = Path(os.getenv("CACHE_SHARED_DIR", str(CACHE_DIR)))  # shared: 各副本挂载的同一目录（NFS/EFS 等）
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")  # redis: 需要安装 redis 包
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "bird-echo:")  # redis 键前缀
+CACHE_MEMORY_MAX_BYTES = int(os.getenv("CACHE_MEMORY_MAX_BYTES", str(256 * 1024 * 1024)))  # memory 后端上限 256MB
+CACHE_NEAR_MAX_BYTES = int(os.getenv("CACHE_NEAR_MAX_BYTES", str(32 * 1024 * 1024)))  # 后端前的进程内近端缓存上限 32MB，0 表示不使用
+CACHE_NEAR_TTL = int(os.getenv("CACHE_NEAR_TTL", "60"))  # 近端缓存条目最长保留时间（秒）
+CACHE_NEAR_SKIP_PREFIXES = tuple(p for p in os.getenv("CACHE_NEAR_SKIP_PREFIXES", "visual:").split(",") if p)  # 不进入近端缓存的键前缀（波形/频谱图瓦片）
+IMAGE_CACHE_TTL = int(os.getenv("IMAGE_CACHE_TTL", str(30 * 86400)))  # 鸟类图片缓存 30 天
+IMAGE_MISS_TTL = int(os.getenv("IMAGE_MISS_TTL", "86400"))  # Wikipedia 没有图片的物种 1 天内不再查询
+IMAGE_PACK_PATH = Path(os.getenv("IMAGE_PACK_PATH", str(BASE_DIR / "image_pack.bin")))  # 构建时预下载的物种图片包（build_image_pack.py），不存在时全部在线获取
+WIKIPEDIA_SUMMARY_URL = os.getenv("WIKIPEDIA_SUMMARY_URL", "https://en.wikipedia.org/api/rest_v1/page/summary/")  # Wikipedia 条目摘要 API
+IMAGE_PREFETCH_ENABLED = os.getenv("IMAGE_PREFETCH_ENABLED", "true").lower() == "true"  # 分析完成后在后台预取检测到的物种图片
+IMAGE_PREFETCH_WORKERS = int(os.getenv("IMAGE_PREFETCH_WORKERS", "4"))  # 同时向 Wikipedia 预取的物种数
+IMAGE_PREFETCH_QUEUE_SIZE = int(os.getenv("IMAGE_PREFETCH_QUEUE_SIZE", "512"))  # 预取队列上限，队列满时丢弃
+IMAGE_INLINE_WAIT = float(os.getenv("IMAGE_INLINE_WAIT", "1.0"))  # images=true 时等待图片 URL 的最长时间（秒）
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "true").lower() == "true"  # 相同音频内容 + 模型直接复用分数矩阵
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", str(7 * 86400)))  # 分析结果缓存 7 天
+
+# 准入控制（自适应并发限制）配置
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_INITIAL_LIMIT = int(os.getenv("ADMISSION_INITIAL_LIMIT", "4"))  # 初始并发上限
+ADMISSION_MIN_LIMIT = int(os.getenv("ADMISSION_MIN_LIMIT", "1"))
+ADMISSION_MAX_LIMIT = int(os.getenv("ADMISSION_MAX_LIMIT", "32"))
+ADMISSION_TARGET_QUEUE_DELAY = float(os.getenv("ADMISSION_TARGET_QUEUE_DELAY", "2.0"))  # 目标排队时延（秒）
+ADMISSION_BACKOFF = float(os.getenv("ADMISSION_BACKOFF", "0.7"))  # 拥塞时并发上限的乘性下降系数
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))  # 拒绝时建议的最小重试间隔（秒）
+
 # 支持的音频格式
 ALLOWED_FORMATS = [
     "audio/wav",
@@ -49,5 +157,14 @@ ALLOWED_FORMATS = [
     "audio/ogg",
 ]
 
+# 允许的文件扩展名（content-type 不在 ALLOWED_FORMATS 中时按扩展名判断）
+ALLOWED_EXTENSIONS = [".wav", ".mp3", ".flac", ".wave", ".webm", ".ogg"]
+
 # 文件大小限制 (50MB)
 MAX_FILE_SIZE = 50 * 1024 * 1024
+
+# 断点续传上传配置
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(CLEANUP_MAX_AGE)))  # 没有活动的上传会话保留时长（秒）
+UPLOAD_STREAM_DECODE = os.getenv("UPLOAD_STREAM_DECODE", "true").lower() == "true"  # 上传过程中边接收边解码推理（需要 ffmpeg）
+UPLOAD_STREAM_IDLE_TIMEOUT = int(os.getenv("UPLOAD_STREAM_IDLE_TIMEOUT", "300"))  # 超过该时长没有新数据时停止增量解码（秒）
+UPLOAD_MAX_STREAMS = int(os.getenv("UPLOAD_MAX_STREAMS", "16"))  # 同时增量解码的上传会话数上限
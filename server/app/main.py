@@ -4,8 +4,19 @@ from pathlib import Path
 from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, FileResponse
+from starlette.concurrency import run_in_threadpool
 from . import config
 from .routes.analyze import router as analyze_router
+from .routes.analysis import router as analysis_router
+from .routes.similar import router as similar_router
+from .routes.models import router as models_router
+from .routes.stats import router as stats_router
+from .routes.uploads import router as uploads_router
+from .services.detection_store import detection_store
+from .services.image_prefetcher import image_prefetcher
+from .services.pipeline import analysis_pipeline
+from .services.scheduler import scheduler
+from .services.upload_service import upload_manager
 from .utils.temp_cleaner import cleaner
 
 # 配置日志
@@ -34,6 +45,11 @@ app.add_middleware(
 
 # 注册路由
 app.include_router(analyze_router, prefix="/api", tags=["analyze"])
+app.include_router(analysis_router, prefix="/api", tags=["analysis"])
+app.include_router(similar_router, prefix="/api", tags=["similar"])
+app.include_router(models_router, prefix="/api", tags=["models"])
+app.include_router(stats_router, prefix="/api", tags=["stats"])
+app.include_router(uploads_router, prefix="/api", tags=["uploads"])
 
 
 # 启动事件
@@ -45,35 +61,30 @@ async def startup_event():
     # 启动临时文件清理器
     cleaner.start()
 
-    # 预加载 BirdNET 模型（预热，让首次用户请求也很快）
-    logger.info("Preloading BirdNET model...")
+    # 没有适用于本机的调优结果时校准推理线程布局（需在创建解释器和工作线程之前）
+    if config.AUTOTUNE_ON_STARTUP and not config.TUNING:
+        try:
+            from .services import autotune
+            tuning = await run_in_threadpool(autotune.calibrate)
+            autotune.save(tuning)
+            autotune.apply(tuning)
+        except Exception as e:
+            logger.warning(f"Inference auto-tuning failed (non-critical): {e}")
+    logger.info(f"Inference layout: {config.TFLITE_THREADS} threads x {config.ANALYSIS_WORKERS} workers")
+
+    # 启动分析调度器和流水线
+    scheduler.start()
+    analysis_pipeline.start()
+    upload_manager.start()
+    if config.IMAGE_PREFETCH_ENABLED:
+        image_prefetcher.start()
+
+    # 预加载并预热模型（让首次用户请求也很快），其他模型在首次使用时加载
+    logger.info(f"Preloading models: {', '.join(config.MODEL_PRELOAD)}")
     try:
-        from .services.birdnet_service import birdnet_service
-        
-        # 预热音频路径
-        test_audio = config.BASE_DIR / "preload.wav"
-        
-        # 如果文件不存在（比如在 Docker 容器中），动态生成一个 3 秒的静音文件
-        if not test_audio.exists():
-            import wave
-            import struct
-            logger.info("Generating dummy audio for model preload using wave module...")
-            with wave.open(str(test_audio), 'wb') as f:
-                f.setnchannels(1)
-                f.setsampwidth(2)
-                f.setframerate(22050)
-                # 生成 3 秒静音数据
-                silence = struct.pack('<h', 0) * (22050 * 3)
-                f.writeframes(silence)
-            
-        if test_audio.exists():
-            logger.info(f"Using audio file for model preload: {test_audio}")
-            birdnet_service.analyze_audio(str(test_audio), "preload")
-            logger.info("BirdNET model preloaded successfully")
-            
-            # 预热完可以删掉临时文件
-            if test_audio.name == "preload.wav":
-                test_audio.unlink()
+        from .services.model_registry import model_registry
+        await run_in_threadpool(model_registry.preload, config.MODEL_PRELOAD)
+        logger.info("Model preload finished")
     except Exception as e:
         logger.warning(f"Model preload failed (non-critical): {e}")
         logger.info("Server will continue, but first analysis request may be slower")
@@ -87,6 +98,11 @@ async def startup_event():
 async def shutdown_event():
     """应用关闭时的清理"""
     logger.info("Shutting down Bird Echo API server...")
+    upload_manager.stop()
+    await image_prefetcher.stop()
+    analysis_pipeline.stop()
+    scheduler.stop()
+    detection_store.close()
     cleaner.stop()
 
 
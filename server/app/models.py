@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 
 class Detection(BaseModel):
@@ -12,19 +12,38 @@ class Detection(BaseModel):
     label: str
 
 
+class Event(BaseModel):
+    """鸟鸣事件（同一物种相邻或重叠的片段合并而成）"""
+    startTime: str
+    endTime: str
+    start: float
+    end: float
+    scientificName: str
+    commonName: str
+    maxConfidence: float
+    meanConfidence: float
+    segmentCount: int
+
+
 class Summary(BaseModel):
     """汇总信息"""
     totalDetections: int
     speciesCount: int
     audioDuration: str
+    audioDurationSeconds: Optional[float] = None
+    totalEvents: Optional[int] = None
 
 
 class AnalysisData(BaseModel):
     """分析数据"""
+    analysisId: Optional[str] = None
     fileName: str
     analysisTime: float
-    detections: List[Detection]
+    detail: str = "segments"
+    detections: List[Detection] = []
+    events: Optional[List[Event]] = None
     summary: Summary
+    images: Optional[Dict[str, Optional[str]]] = None  # 学名 -> 图片 URL（images=true 时）
 
 
 class AnalysisResponse(BaseModel):
@@ -45,3 +64,20 @@ class HealthResponse(BaseModel):
     status: str
     timestamp: str
     service: str
+
+
+class SimilarSegment(BaseModel):
+    """相似片段"""
+    analysisId: str
+    fileName: str
+    segment: int
+    start: float
+    end: float
+    score: float
+
+
+class SimilarResponse(BaseModel):
+    """相似片段搜索响应"""
+    success: bool
+    query: Optional[SimilarSegment] = None
+    results: List[SimilarSegment] = []
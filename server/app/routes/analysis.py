@@ -0,0 +1,162 @@
+import logging
+import time
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response
+from .. import config
+from ..models import AnalysisResponse
+from ..services.score_store import score_store
+from ..services.visual_store import SPECTROGRAM, WAVEFORM, visual_store
+from ..utils import serializer
+from ..utils.postprocess import DETAIL_SEGMENTS, SUPPORTED_DETAILS, postprocess
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+@router.get("/analysis/{analysis_id}", response_model=AnalysisResponse)
+def get_analysis(
+    request: Request,
+    analysis_id: str,
+    min_conf: float = Query(config.MIN_CONFIDENCE, ge=0.01, le=0.99, description="最小置信度"),
+    sensitivity: float = Query(config.SENSITIVITY, ge=0.5, le=1.5, description="检测灵敏度"),
+    species: Optional[List[str]] = Query(None, description="只保留的物种学名（可重复或逗号分隔）"),
+    format: Optional[str] = Query(None, description="响应格式: rows / columnar / msgpack"),
+    detail: str = Query(DETAIL_SEGMENTS, description="结果粒度: segments / events")
+):
+    """
+    根据保留的分数矩阵重新筛选检测结果（无需重新上传和推理）
+
+    Args:
+        analysis_id: /api/analyze 返回的 analysisId
+        min_conf: 最小置信度
+        sensitivity: 检测灵敏度
+        species: 物种过滤
+        format: 响应格式
+        detail: 结果粒度
+
+    Returns:
+        与 /api/analyze 相同结构的响应
+    """
+    try:
+        response_format = serializer.negotiate_format(request.headers.get("accept"), format)
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的响应格式。支持的格式: {', '.join(serializer.SUPPORTED_FORMATS)}"
+        )
+    if detail not in SUPPORTED_DETAILS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的结果粒度。支持的粒度: {', '.join(SUPPORTED_DETAILS)}"
+        )
+
+    start_time = time.time()
+    scores = _get_scores(analysis_id)
+
+    species_filter = None
+    if species:
+        names = [n for item in species for n in item.split(",") if n.strip()]
+        try:
+            species_filter = scores.species_indices(names)
+        except KeyError as e:
+            raise HTTPException(status_code=400, detail=f"未知的物种: {e.args[0]}")
+
+    table = scores.to_table(min_conf, sensitivity, species_filter)
+    logger.info(
+        f"[{analysis_id}] Re-thresholded (min_conf={min_conf}, sensitivity={sensitivity}): "
+        f"{len(table)} detections in {(time.time() - start_time) * 1000:.1f}ms"
+    )
+
+    summary, events = postprocess(table, scores.duration, detail)
+    return serializer.render_analysis(
+        response_format,
+        analysis_id,
+        scores.file_name,
+        round(time.time() - start_time, 4),
+        table,
+        summary,
+        events
+    )
+
+
+@router.get("/analysis/{analysis_id}/scores.npz")
+def export_scores(
+    analysis_id: str,
+    sensitivity: float = Query(config.SENSITIVITY, ge=0.5, le=1.5, description="检测灵敏度（写入导出文件）")
+):
+    """
+    导出完整的 片段×物种 分数矩阵
+
+    .npz 包含 logits (float16)、start / end（秒）、scientific_names / common_names、
+    duration、file_name、model 和 sensitivity。logits 是未经灵敏度调整的模型输出，
+    接口返回的置信度为 sigmoid(logits + (sensitivity - 1) × 10)（与 BirdNET-Analyzer 一致，
+    见 flat_sigmoid），即 1 / (1 + exp(-(logits + (sensitivity - 1) × 10)))。
+    """
+    scores = _get_scores(analysis_id)
+    return Response(
+        content=scores.to_npz(sensitivity),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="{analysis_id}.npz"'}
+    )
+
+
+@router.get("/analysis/{analysis_id}/waveform")
+def get_waveform(analysis_id: str):
+    """
+    波形峰值的元数据（各缩放级别的列数、瓦片数和每秒列数）
+
+    瓦片通过 /api/analysis/{id}/waveform/{zoom}/{tile} 获取，每列 2 个 int8（最小值、最大值）。
+    """
+    return _get_visual_meta(analysis_id, WAVEFORM)
+
+
+@router.get("/analysis/{analysis_id}/waveform/{zoom}/{tile}")
+def get_waveform_tile(analysis_id: str, zoom: int, tile: int):
+    """波形峰值瓦片（原始字节，最后一个瓦片可能不足 tileColumns 列）"""
+    return _get_visual_tile(analysis_id, WAVEFORM, zoom, tile)
+
+
+@router.get("/analysis/{analysis_id}/spectrogram")
+def get_spectrogram(analysis_id: str):
+    """
+    频谱图的元数据（各缩放级别的列数、瓦片数、每秒列数、频带数、上限频率和动态范围）
+
+    瓦片通过 /api/analysis/{id}/spectrogram/{zoom}/{tile} 获取，每列 valuesPerColumn 个 uint8（低频在前）。
+    """
+    return _get_visual_meta(analysis_id, SPECTROGRAM)
+
+
+@router.get("/analysis/{analysis_id}/spectrogram/{zoom}/{tile}")
+def get_spectrogram_tile(analysis_id: str, zoom: int, tile: int):
+    """频谱图瓦片（原始字节，按列存放）"""
+    return _get_visual_tile(analysis_id, SPECTROGRAM, zoom, tile)
+
+
+def _get_visual_meta(analysis_id: str, kind: str) -> dict:
+    """获取视图元数据，不存在时返回 404"""
+    meta = visual_store.meta(analysis_id, kind)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="分析结果不存在或已过期")
+    return meta
+
+
+def _get_visual_tile(analysis_id: str, kind: str, zoom: int, tile: int) -> Response:
+    """获取视图瓦片，不存在时返回 404（同一分析 ID 的瓦片不会变化，允许客户端缓存）"""
+    data = visual_store.tile(analysis_id, kind, zoom, tile)
+    if data is None:
+        raise HTTPException(status_code=404, detail="瓦片不存在或已过期")
+    return Response(
+        content=data,
+        media_type="application/octet-stream",
+        headers={"Cache-Control": f"private, max-age={config.VISUAL_TTL}, immutable"}
+    )
+
+
+def _get_scores(analysis_id: str):
+    """获取分数矩阵，不存在时返回 404"""
+    scores = score_store.get(analysis_id)
+    if scores is None:
+        raise HTTPException(status_code=404, detail="分析结果不存在或已过期")
+    return scores
@@ -1,107 +1,208 @@
+import asyncio
 import logging
 import uuid
 import shutil
 from pathlib import Path
-from fastapi import APIRouter, UploadFile, File, HTTPException, Query
-from fastapi.responses import JSONResponse
+from typing import Optional
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 from datetime import datetime
 import httpx
 from .. import config
-from ..models import AnalysisResponse, Detection, Summary, AnalysisData, HealthResponse
+from ..models import AnalysisResponse, HealthResponse
+from ..services.admission import admission
+from ..services.analysis_cache import analysis_cache
+from ..services.bird_image_service import bird_image_service
 from ..services.birdnet_service import birdnet_service
+from ..services.detection_store import detection_store, to_timestamp
+from ..services.image_prefetcher import image_prefetcher
+from ..services.model_registry import model_registry
+from ..services.pipeline import analysis_pipeline
+from ..services.scheduler import scheduler
+from ..services.score_store import score_store
+from ..services.vector_index import vector_index
+from ..services.visual_store import visual_store
 from ..utils.audio_converter import convert_to_wav
+from ..utils.audio_stream import PCM_ENCODINGS, pcm_frames
+from ..utils.cancellation import AnalysisCancelled, CancelToken, cancel_on_disconnect
+from ..utils.client_identity import client_key
+from ..utils.detection_table import DetectionTable, format_seconds
+from ..utils import serializer
+from ..utils.postprocess import DETAIL_SEGMENTS, SUPPORTED_DETAILS, postprocess
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# BirdNET-Analyzer 原生支持的格式，无需转换
+BIRDNET_SUPPORTED = {".wav", ".wave", ".mp3", ".flac", ".ogg", ".opus"}
+
 
 @router.post("/analyze", response_model=AnalysisResponse)
-async def analyze_audio(audio: UploadFile = File(...)):
+async def analyze_audio(
+    request: Request,
+    audio: Optional[UploadFile] = File(None),
+    format: Optional[str] = Query(None, description="响应格式: rows / columnar / msgpack（默认按 Accept 头协商）"),
+    embeddings: bool = Query(config.EMBEDDINGS_ENABLED, description="是否提取片段嵌入并加入相似度索引"),
+    detail: str = Query(DETAIL_SEGMENTS, description="结果粒度: segments（逐片段）/ events（合并后的事件）"),
+    model: Optional[str] = Query(None, description="模型ID（见 /api/models），默认使用 DEFAULT_MODEL"),
+    recorded_at: Optional[datetime] = Query(None, description="录音开始时间（ISO 8601），用于检测结果统计"),
+    encoding: Optional[str] = Query(None, description="原始 PCM 编码: pcm_s16le / pcm_f32le（不指定时按音频文件解码）"),
+    sample_rate: Optional[int] = Query(None, ge=1000, le=384000, description="原始 PCM 的采样率，默认 48000"),
+    channels: int = Query(1, ge=1, le=32, description="原始 PCM 的声道数（交错排列）"),
+    images: bool = Query(False, description="是否在响应中附带检测到的物种的图片 URL")
+):
     """
     分析音频文件并返回鸟类识别结果
 
+    响应格式通过 format 参数或 Accept 头协商：
+    - application/json: 逐行 Detection 列表（默认，兼容旧版）
+    - application/vnd.bird-echo.columnar+json: 列式 JSON
+    - application/x-msgpack: 列式 MessagePack
+
+    也可以直接上传浏览器 Web Audio 已解码的原始 PCM（指定 encoding）：作为 audio 文件字段，
+    或以 application/octet-stream 请求体发送。PCM 直接进入解码阶段，不经过 ffmpeg 和临时文件；
+    48 kHz 单声道 pcm_f32le 不做任何转换。
+
     Args:
-        audio: 上传的音频文件
+        request: 请求对象（用于读取 Accept 头）
+        audio: 上传的音频文件（请求体为原始 PCM 时省略）
+        format: 显式指定的响应格式
+        embeddings: 是否提取片段嵌入（用于 /api/similar）
+        detail: 结果粒度，events 会把同一物种相邻的片段合并为事件
+        model: 模型ID（全球模型、精度变体或自定义分类器）
+        recorded_at: 录音开始时间，未提供时由文件名时间戳或当前时间推断
+        encoding: 原始 PCM 编码（小端）
+        sample_rate: 原始 PCM 的采样率
+        channels: 原始 PCM 的声道数
+        images: 是否附带物种图片 URL（未在 IMAGE_INLINE_WAIT 内取到的物种省略）
 
     Returns:
         包含检测结果的响应
     """
     session_id = str(uuid.uuid4())
+    token = CancelToken()
+
+    # 原始 PCM 请求体需要在开始监视连接之前读完
+    file_path: Optional[Path] = None
+    analysis_file: Optional[Path] = None
+    pcm_body = None
+    if encoding is not None and audio is None:
+        pcm_body = await _read_body(request, config.MAX_FILE_SIZE)
 
     try:
-        # 1. 验证文件类型（检查 content-type 或文件扩展名）
-        file_ext = Path(audio.filename).suffix.lower() if audio.filename else ""
-        content_type = audio.content_type or ""
-
-        # 允许的扩展名
-        allowed_exts = {".wav", ".mp3", ".flac", ".wave", ".webm", ".ogg"}
-
-        # 验证：content-type 在允许列表中 或 扩展名在允许列表中
-        if content_type not in config.ALLOWED_FORMATS and file_ext not in allowed_exts:
-            raise HTTPException(
-                status_code=400,
-                detail=f"不支持的音频格式。支持的格式: {', '.join(config.ALLOWED_FORMATS)}"
+        # 请求体已接收完（multipart 由 FastAPI 在调用前解析），此时才占用准入名额
+        async with admission.admit() as ticket, cancel_on_disconnect(request, token, config.DISCONNECT_POLL_INTERVAL):
+            response_format = negotiate_response(request, format, detail)
+            model_id = resolve_model(model, embeddings)
+
+            if encoding is not None:
+                # 原始 PCM：直接按帧视图交给解码阶段，不保存文件、不启动子进程
+                file_name = audio.filename if audio is not None and audio.filename else "pcm"
+                data = await audio.read() if audio is not None else pcm_body
+                try:
+                    frames = pcm_frames(data, encoding, channels)
+                except ValueError as e:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"无效的 PCM 数据（{e}）。支持的编码: {', '.join(PCM_ENCODINGS)}"
+                    )
+                logger.info(f"[{session_id}] Processing raw PCM: {frames.shape[0]} frames, {encoding}, {channels} ch")
+                sample_rate = sample_rate or birdnet_service.sample_rate
+                digest = None
+                if config.ANALYSIS_CACHE_ENABLED:
+                    digest = await run_in_threadpool(analysis_cache.pcm_digest, data, encoding, sample_rate, channels)
+                result = await analysis_cache.get(digest, model_id, embeddings, file_name, session_id)
+                if result is None:
+                    result = await analysis_pipeline.analyze_pcm(
+                        frames,
+                        sample_rate,
+                        session_id,
+                        file_name,
+                        client_key(request),
+                        embeddings,
+                        token,
+                        model_id
+                    )
+                    await analysis_cache.put(digest, model_id, result)
+            else:
+                if audio is None:
+                    raise HTTPException(status_code=400, detail="缺少音频文件（或未指定原始 PCM 的 encoding）")
+                file_name = audio.filename
+
+                # 1. 验证文件类型（检查 content-type 或文件扩展名）
+                file_ext = Path(file_name).suffix.lower() if file_name else ""
+                content_type = audio.content_type or ""
+
+                # 验证：content-type 在允许列表中 或 扩展名在允许列表中
+                if content_type not in config.ALLOWED_FORMATS and file_ext not in config.ALLOWED_EXTENSIONS:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"不支持的音频格式。支持的格式: {', '.join(config.ALLOWED_FORMATS)}"
+                    )
+
+                # 2. 保存上传的文件
+                logger.info(f"[{session_id}] Processing file: {file_name}")
+                file_path = config.UPLOAD_DIR / f"{session_id}_{file_name}"
+
+                with open(file_path, "wb") as f:
+                    shutil.copyfileobj(audio.file, f)
+
+                file_size = file_path.stat().st_size
+                logger.info(f"[{session_id}] File saved: {file_path} ({file_size} bytes)")
+
+                # 3. 相同内容的录音分析过时直接复用分数矩阵
+                digest = None
+                if config.ANALYSIS_CACHE_ENABLED:
+                    digest = await run_in_threadpool(analysis_cache.file_digest, file_path)
+                result = await analysis_cache.get(digest, model_id, embeddings, file_name, session_id)
+
+                if result is None:
+                    # 4. 检查是否需要转换格式
+                    analysis_file = await prepare_analysis_file(session_id, file_path, token)
+
+                    # 5. 调用 BirdNET 分析（由调度器按成本和客户端公平调度）
+                    logger.info(f"[{session_id}] Starting analysis with file: {analysis_file}")
+                    result = await analysis_pipeline.analyze(
+                        analysis_file,
+                        session_id,
+                        file_name,
+                        client_key(request),
+                        embeddings,
+                        token,
+                        model_id
+                    )
+                    await analysis_cache.put(digest, model_id, result)
+            ticket.queue_delay = result["queue_delay"]
+
+            # 6. 构建响应
+            response = await build_analysis_response(
+                session_id,
+                file_name,
+                result,
+                response_format,
+                detail,
+                model_id,
+                client_key(request),
+                recorded_at,
+                images
             )
 
-        # 2. 保存上传的文件
-        logger.info(f"[{session_id}] Processing file: {audio.filename}")
-        file_path = config.UPLOAD_DIR / f"{session_id}_{audio.filename}"
-
-        with open(file_path, "wb") as f:
-            shutil.copyfileobj(audio.file, f)
-
-        file_size = file_path.stat().st_size
-        logger.info(f"[{session_id}] File saved: {file_path} ({file_size} bytes)")
-
-        # 3. 检查是否需要转换格式
-        # BirdNET-Analyzer 原生支持的格式，无需转换
-        BIRDNET_SUPPORTED = {".wav", ".wave", ".mp3", ".flac", ".ogg", ".opus"}
-        
-        analysis_file = file_path
-        if file_ext not in BIRDNET_SUPPORTED:
-            # 只有 WebM 等不支持的格式才需要转换
-            logger.info(f"[{session_id}] Converting {file_ext} to WAV format (not natively supported)")
-            wav_path = config.UPLOAD_DIR / f"{session_id}_converted.wav"
-            try:
-                analysis_file = convert_to_wav(file_path, wav_path)
-                logger.info(f"[{session_id}] Conversion complete: {wav_path}")
-            except RuntimeError as e:
-                # ffmpeg 不可用时的降级处理：尝试直接分析原文件
-                logger.warning(f"[{session_id}] Conversion failed, trying original file: {e}")
-                analysis_file = file_path
-        else:
-            logger.info(f"[{session_id}] File format {file_ext} is natively supported, skipping conversion")
-
-        # 4. 调用 BirdNET 分析
-        logger.info(f"[{session_id}] Starting analysis with file: {analysis_file}")
-        result = birdnet_service.analyze_audio(str(analysis_file), session_id)
-
-        # 4. 构建响应
-        detections = result["detections"]
-        species_set = set(d["scientificName"] for d in detections)
-        audio_duration = detections[-1]["endTime"] if detections else "0:00"
-
-        # 记录检测到的时间范围
-        if detections:
-            logger.info(f"[{session_id}] Detection time range: {detections[0]['startTime']} - {detections[-1]['endTime']}")
-            logger.info(f"[{session_id}] Total detections: {len(detections)}, Species: {len(species_set)}")
-
-        response_data = AnalysisData(
-            fileName=audio.filename,
-            analysisTime=round(result["analysis_time"], 2),
-            detections=detections,
-            summary=Summary(
-                totalDetections=len(detections),
-                speciesCount=len(species_set),
-                audioDuration=audio_duration
-            )
-        )
+            # 7. 异步清理临时文件
+            cleanup_session(session_id, file_path, analysis_file)
 
-        # 5. 异步清理临时文件
-        _cleanup_session(session_id, file_path, analysis_file)
+            return response
 
-        return AnalysisResponse(success=True, data=response_data)
+    except (asyncio.CancelledError, AnalysisCancelled) as e:
+        if not token.cancelled:
+            raise
+        # 客户端已断开：ffmpeg 已被终止、排队中的批次已丢弃，立即清理工作目录
+        if isinstance(e, asyncio.CancelledError):
+            asyncio.current_task().uncancel()
+        logger.info(f"[{session_id}] Client disconnected, analysis cancelled")
+        cleanup_session(session_id, file_path, analysis_file)
+        return Response(status_code=499)
 
     except HTTPException:
         raise
@@ -109,10 +210,7 @@ async def analyze_audio(audio: UploadFile = File(...)):
     except Exception as e:
         logger.error(f"[{session_id}] Analysis failed: {e}")
         # 确保清理
-        if 'analysis_file' in locals():
-            _cleanup_session(session_id, file_path, analysis_file)
-        elif 'file_path' in locals():
-            _cleanup_session(session_id, file_path)
+        cleanup_session(session_id, file_path, analysis_file)
 
         raise HTTPException(
             status_code=500,
@@ -120,6 +218,147 @@ async def analyze_audio(audio: UploadFile = File(...)):
         )
 
 
+def negotiate_response(request: Request, format: Optional[str], detail: str) -> str:
+    """校验响应格式和结果粒度，返回协商后的响应格式"""
+    try:
+        response_format = serializer.negotiate_format(request.headers.get("accept"), format)
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的响应格式。支持的格式: {', '.join(serializer.SUPPORTED_FORMATS)}"
+        )
+    if detail not in SUPPORTED_DETAILS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的结果粒度。支持的粒度: {', '.join(SUPPORTED_DETAILS)}"
+        )
+    return response_format
+
+
+def resolve_model(model: Optional[str], embeddings: bool) -> str:
+    """解析模型ID，未知模型或模型不支持嵌入时返回 400"""
+    try:
+        model_id = model_registry.resolve(model)
+    except KeyError:
+        raise HTTPException(
+            status_code=400,
+            detail=f"未知的模型: {model}。可用的模型: {', '.join(model_registry.specs)}"
+        )
+    if embeddings and not model_registry.spec(model_id).embeddings:
+        raise HTTPException(status_code=400, detail=f"模型 {model_id} 不支持提取片段嵌入")
+    return model_id
+
+
+async def prepare_analysis_file(session_id: str, file_path: Path, token: CancelToken) -> Path:
+    """
+    BirdNET-Analyzer 不支持的格式（WebM 等）先转换为 WAV，返回实际分析的文件
+
+    流水线可以用 ffmpeg 管道流式解码时不转换，直接分析原文件（不落地中间文件）。
+    """
+    file_ext = file_path.suffix.lower()
+    if file_ext in BIRDNET_SUPPORTED:
+        logger.info(f"[{session_id}] File format {file_ext} is natively supported, skipping conversion")
+        return file_path
+    if analysis_pipeline.ffmpeg_decode:
+        logger.info(f"[{session_id}] File format {file_ext} will be streamed through ffmpeg, skipping conversion")
+        return file_path
+
+    logger.info(f"[{session_id}] Converting {file_ext} to WAV format (not natively supported)")
+    wav_path = config.UPLOAD_DIR / f"{session_id}_converted.wav"
+    try:
+        analysis_file = await run_in_threadpool(convert_to_wav, file_path, wav_path, token)
+        logger.info(f"[{session_id}] Conversion complete: {wav_path}")
+        return analysis_file
+    except RuntimeError as e:
+        # ffmpeg 不可用时的降级处理：尝试直接分析原文件
+        logger.warning(f"[{session_id}] Conversion failed, trying original file: {e}")
+        return file_path
+
+
+async def build_analysis_response(
+    session_id: str,
+    file_name: str,
+    result: dict,
+    response_format: str,
+    detail: str,
+    model_id: str,
+    client: str,
+    recorded_at: Optional[datetime] = None,
+    images: bool = False
+) -> Response:
+    """
+    保存分析结果（分数矩阵、波形和频谱图、片段嵌入、检测结果存储）并渲染响应
+
+    Args:
+        session_id: 会话ID（即分析ID）
+        file_name: 原始文件名
+        result: analysis_pipeline.analyze / collect 的返回值
+        response_format: 协商后的响应格式
+        detail: 结果粒度
+        model_id: 模型ID
+        client: 客户端标识
+        recorded_at: 录音开始时间
+        images: 是否在响应中附带物种图片 URL（最多等待 IMAGE_INLINE_WAIT 秒）
+    """
+    # 保留完整分数矩阵，之后可通过 /api/analysis/{id} 重新筛选（disk 模式要压缩写文件，不在事件循环中执行）
+    scores = result["scores"]
+    await analysis_pipeline.postprocess(score_store.put, session_id, scores)
+
+    # 波形和频谱图瓦片，之后通过 /api/analysis/{id}/waveform、/spectrogram 获取
+    if config.VISUAL_ENABLED and "visual" in result:
+        await analysis_pipeline.postprocess(visual_store.put, session_id, result["visual"], scores.duration)
+
+    # 片段嵌入加入相似度索引；缓存命中时指向首次分析已索引的向量，同一段录音不重复索引
+    cached = result.get("cached", False)
+    if "embeddings" in result:
+        aliased = cached and result["origin_id"] is not None and await analysis_pipeline.postprocess(
+            vector_index.alias, session_id, file_name, result["origin_id"]
+        )
+        if not aliased:
+            await analysis_pipeline.postprocess(
+                vector_index.add, session_id, file_name, result["embeddings"], scores.start, scores.end
+            )
+
+    table: DetectionTable = result["table"]
+
+    # 物种已确定：后台预取图片，客户端稍后请求 /api/bird-image 时已在缓存中
+    scientific_names = [s[0] for s in table.species]
+    if config.IMAGE_PREFETCH_ENABLED:
+        image_prefetcher.enqueue(scientific_names)
+
+    # 检测结果写入持久化存储（后台线程，不阻塞响应）；缓存命中的录音首次分析时已写入，不重复计入统计
+    if config.DETECTION_STORE_ENABLED and not cached:
+        detection_store.add_async(
+            session_id,
+            file_name,
+            table,
+            scores.duration,
+            to_timestamp(recorded_at),
+            model_id,
+            client
+        )
+
+    summary, events = await analysis_pipeline.postprocess(postprocess, table, scores.duration, detail)
+    image_urls = await bird_image_service.image_urls(scientific_names, config.IMAGE_INLINE_WAIT) if images else None
+
+    # 记录检测到的时间范围
+    if len(table):
+        logger.info(f"[{session_id}] Detection time range: {format_seconds(table.start.min())} - {format_seconds(table.end.max())}")
+        logger.info(f"[{session_id}] Total detections: {len(table)}, Species: {table.species_count}")
+
+    return await analysis_pipeline.postprocess(
+        serializer.render_analysis,
+        response_format,
+        session_id,
+        file_name,
+        round(result["analysis_time"], 2),
+        table,
+        summary,
+        events,
+        image_urls
+    )
+
+
 @router.get("/health", response_model=HealthResponse)
 async def health_check():
     """健康检查接口"""
@@ -130,168 +369,32 @@ async def health_check():
     )
 
 
+@router.get("/admission")
+async def admission_status():
+    """准入控制和调度器状态（当前并发上限、拒绝次数、排队情况）"""
+    return {
+        "success": True,
+        "enabled": config.ADMISSION_ENABLED,
+        "admission": admission.stats(),
+        "scheduler": scheduler.stats()
+    }
+
+
 @router.get("/bird-image")
 async def get_bird_image(scientific_name: str = Query(..., description="鸟类的学名")):
     """
-    从 Wikipedia API 获取鸟类图片（带磁盘缓存）
-    
-    策略：
-    1. 检查本地缓存文件
-    2. 缓存未命中时，从 Wikipedia API 获取
-    3. 下载图片并保存到缓存目录
-    4. 返回图片 URL（通过后端代理访问）
-    
+    获取鸟类图片（Wikipedia，经缓存后端代理）
+
     Args:
         scientific_name: 鸟类的学名（科学名称）
-    
+
     Returns:
         包含图片 URL 的响应，如果未找到则返回 null
     """
-    # #region agent log
-    import json
-    log_path = Path(__file__).parent.parent.parent.parent / ".cursor" / "debug.log"
     try:
-        with open(log_path, 'a', encoding='utf-8') as f:
-            f.write(json.dumps({"timestamp": __import__('time').time() * 1000, "location": "analyze.py:133", "message": "get_bird_image entry", "data": {"scientific_name": scientific_name}, "sessionId": "debug-session", "runId": "run1", "hypothesisId": "A,B,C"}) + "\n")
-    except: pass
-    # #endregion
-    try:
-        from urllib.parse import quote, unquote, urlparse
-        import hashlib
-        
-        # 先解码（前端可能已经编码了），然后处理空格
-        decoded_name = unquote(scientific_name)
-        # #region agent log
-        try:
-            with open(log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({"timestamp": __import__('time').time() * 1000, "location": "analyze.py:156", "message": "decoded scientific name", "data": {"original": scientific_name, "decoded": decoded_name}, "sessionId": "debug-session", "runId": "run1", "hypothesisId": "C"}) + "\n")
-        except: pass
-        # #endregion
-        
-        # 生成缓存文件名（使用学名的哈希值）
-        cache_key = hashlib.md5(decoded_name.encode()).hexdigest()
-        cache_file = config.IMAGE_CACHE_DIR / f"{cache_key}.json"
-        
-        # 1. 检查本地缓存
-        # 查找匹配的缓存图片文件
-        cache_image_files = list(config.IMAGE_CACHE_DIR.glob(f"{cache_key}.*"))
-        cache_image_file = None
-        if cache_image_files:
-            # 过滤掉 .json 元数据文件
-            cache_image_file = next((f for f in cache_image_files if f.suffix != ".json"), None)
-
-        if cache_image_file and cache_image_file.exists():
-            logger.info(f"Cache hit for: {scientific_name}")
-            # 返回后端代理的图片 URL（包含文件扩展名）
-            ext = cache_image_file.suffix
-            return JSONResponse(content={
-                "success": True,
-                "imageUrl": f"/api/bird-image-file/{cache_key}{ext}"
-            })
-        
-        # 2. 缓存未命中，从 Wikipedia API 获取
-        logger.info(f"Cache miss, fetching from Wikipedia: {scientific_name}")
-        wiki_title = decoded_name.replace(' ', '_')
-        wiki_url = f"https://en.wikipedia.org/api/rest_v1/page/summary/{wiki_title}"
-        # #region agent log
-        try:
-            with open(log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({"timestamp": __import__('time').time() * 1000, "location": "analyze.py:181", "message": "Wikipedia API request", "data": {"wiki_title": wiki_title, "wiki_url": wiki_url}, "sessionId": "debug-session", "runId": "run1", "hypothesisId": "A,B"}) + "\n")
-        except: pass
-        # #endregion
-        
-        # Wikipedia/Wikimedia 要求设置标准 User-Agent
-        # 格式: ApplicationName/version (Contact_info)
-        headers = {
-            "User-Agent": "BirdEcho/1.0 (https://github.com/smalldeng/bird-echo; birds@bird-echo.app)"
-        }
-        async with httpx.AsyncClient(timeout=10.0, headers=headers) as client:
-            response = await client.get(wiki_url)
-            # #region agent log
-            try:
-                with open(log_path, 'a', encoding='utf-8') as f:
-                    f.write(json.dumps({"timestamp": __import__('time').time() * 1000, "location": "analyze.py:185", "message": "Wikipedia API response", "data": {"status_code": response.status_code, "has_content": bool(response.content)}, "sessionId": "debug-session", "runId": "run1", "hypothesisId": "A,B"}) + "\n")
-            except: pass
-            # #endregion
-            
-            if response.status_code == 200:
-                data = response.json()
-                # #region agent log
-                try:
-                    with open(log_path, 'a', encoding='utf-8') as f:
-                        f.write(json.dumps({"timestamp": __import__('time').time() * 1000, "location": "analyze.py:188", "message": "Wikipedia API data parsed", "data": {"has_thumbnail": "thumbnail" in data, "thumbnail_type": type(data.get("thumbnail")).__name__ if "thumbnail" in data else None, "thumbnail_keys": list(data.get("thumbnail").keys()) if isinstance(data.get("thumbnail"), dict) else None}, "sessionId": "debug-session", "runId": "run1", "hypothesisId": "A"}) + "\n")
-                except: pass
-                # #endregion
-                
-                if data.get("thumbnail") and isinstance(data["thumbnail"], dict):
-                    image_url = data["thumbnail"].get("source")
-                    # #region agent log
-                    try:
-                        with open(log_path, 'a', encoding='utf-8') as f:
-                            f.write(json.dumps({"timestamp": __import__('time').time() * 1000, "location": "analyze.py:191", "message": "thumbnail source extracted", "data": {"image_url": image_url, "has_source": bool(image_url)}, "sessionId": "debug-session", "runId": "run1", "hypothesisId": "A"}) + "\n")
-                    except: pass
-                    # #endregion
-                    if image_url:
-                        # 3. 下载图片并保存到缓存
-                        try:
-                            # 确保图片 URL 是 HTTPS
-                            if image_url.startswith("http://"):
-                                image_url = image_url.replace("http://", "https://", 1)
-                            
-                            # 下载图片（Wikimedia URL 会重定向，需要跟随重定向）
-                            img_response = await client.get(image_url, timeout=10.0, follow_redirects=True)
-                            # #region agent log
-                            try:
-                                with open(log_path, 'a', encoding='utf-8') as f:
-                                    f.write(json.dumps({"timestamp": __import__('time').time() * 1000, "location": "analyze.py:199", "message": "image download response", "data": {"status_code": img_response.status_code, "content_length": len(img_response.content) if img_response.content else 0}, "sessionId": "debug-session", "runId": "run1", "hypothesisId": "E"}) + "\n")
-                            except: pass
-                            # #endregion
-                            if img_response.status_code == 200:
-                                # 根据 URL 确定文件扩展名
-                                parsed_url = urlparse(image_url)
-                                ext = Path(parsed_url.path).suffix or ".jpg"
-                                cache_image_file = config.IMAGE_CACHE_DIR / f"{cache_key}{ext}"
-                                
-                                # 保存图片文件
-                                with open(cache_image_file, 'wb') as f:
-                                    f.write(img_response.content)
-                                
-                                # 保存元数据
-                                import json
-                                with open(cache_file, 'w', encoding='utf-8') as f:
-                                    json.dump({
-                                        "scientificName": decoded_name,
-                                        "imageUrl": image_url,
-                                        "cachedAt": datetime.now().isoformat()
-                                    }, f)
-                                
-                                logger.info(f"Cached image for: {scientific_name} -> {cache_image_file}")
-                                
-                                # 返回后端代理的图片 URL
-                                return JSONResponse(content={
-                                    "success": True,
-                                    "imageUrl": f"/api/bird-image-file/{cache_key}{ext}"
-                                })
-                        except Exception as e:
-                            logger.error(f"Failed to cache image: {e}", exc_info=True)
-                            # 缓存失败，返回原始 URL
-                            return JSONResponse(content={
-                                "success": True,
-                                "imageUrl": image_url
-                            })
-            
-            # 如果 Wikipedia 没有图片，返回 null
-            # #region agent log
-            try:
-                with open(log_path, 'a', encoding='utf-8') as f:
-                    f.write(json.dumps({"timestamp": __import__('time').time() * 1000, "location": "analyze.py:235", "message": "returning success=false (no image)", "data": {"status_code": response.status_code if 'response' in locals() else None, "has_thumbnail": "thumbnail" in (data if 'data' in locals() else {})}, "sessionId": "debug-session", "runId": "run1", "hypothesisId": "A,B"}) + "\n")
-            except: pass
-            # #endregion
-            return JSONResponse(content={
-                "success": False,
-                "imageUrl": None
-            })
-            
+        image_url = await bird_image_service.image_url(scientific_name)
+        return JSONResponse(content={"success": image_url is not None, "imageUrl": image_url})
+
     except httpx.TimeoutException:
         logger.error(f"Timeout fetching image for: {scientific_name}")
         return JSONResponse(
@@ -309,53 +412,30 @@ async def get_bird_image(scientific_name: str = Query(..., description="鸟类
 @router.get("/bird-image-file/{cache_key:path}")
 async def get_cached_bird_image(cache_key: str):
     """
-    返回缓存的鸟类图片文件
+    返回缓存的鸟类图片
 
     Args:
         cache_key: 缓存键（学名的 MD5 哈希值，可能包含文件扩展名）
 
     Returns:
-        图片文件响应
+        图片响应
     """
-    from fastapi.responses import FileResponse
-
-    # 如果 cache_key 包含扩展名，直接使用；否则查找所有匹配的文件
-    if '.' in cache_key:
-        # 直接使用传入的文件名（包含扩展名）
-        cache_file = config.IMAGE_CACHE_DIR / cache_key
-    else:
-        # 查找匹配的缓存文件
-        cache_files = list(config.IMAGE_CACHE_DIR.glob(f"{cache_key}.*"))
-        if cache_files:
-            cache_file = cache_files[0]
-        else:
-            cache_file = None
-
-    if cache_file and cache_file.exists():
-        # 根据文件扩展名确定媒体类型
-        ext = cache_file.suffix.lower()
-        media_types = {
-            ".jpg": "image/jpeg",
-            ".jpeg": "image/jpeg",
-            ".png": "image/png",
-            ".webp": "image/webp",
-            ".svg": "image/svg+xml"
-        }
-        media_type = media_types.get(ext, "image/jpeg")
-        
-        return FileResponse(
-            cache_file,
-            media_type=media_type,
-            headers={"Cache-Control": "public, max-age=31536000"}  # 缓存 1 年
+    image = await run_in_threadpool(bird_image_service.image_file, cache_key)
+    if image is None:
+        return JSONResponse(
+            status_code=404,
+            content={"error": "Image not found in cache"}
         )
-    
-    return JSONResponse(
-        status_code=404,
-        content={"error": "Image not found in cache"}
+
+    data, media_type = image
+    return Response(
+        content=data,
+        media_type=media_type,
+        headers={"Cache-Control": "public, max-age=31536000"}  # 缓存 1 年
     )
 
 
-def _cleanup_session(session_id: str, file_path: Path = None, analysis_file: Path = None):
+def cleanup_session(session_id: str, file_path: Path = None, analysis_file: Path = None):
     """清理会话相关的临时文件"""
     import threading
 
@@ -381,3 +461,16 @@ def _cleanup_session(session_id: str, file_path: Path = None, analysis_file: Pat
     # 在后台线程中执行清理
     thread = threading.Thread(target=cleanup, daemon=True)
     thread.start()
+
+
+async def _read_body(request: Request, limit: int) -> bytearray:
+    """读取整个请求体，超过 limit 字节时返回 413"""
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > limit:
+        raise HTTPException(status_code=413, detail=f"文件过大，最大 {limit} 字节")
+    body = bytearray()
+    async for piece in request.stream():
+        body += piece
+        if len(body) > limit:
+            raise HTTPException(status_code=413, detail=f"文件过大，最大 {limit} 字节")
+    return body
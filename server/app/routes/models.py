@@ -0,0 +1,25 @@
+import logging
+from fastapi import APIRouter
+from starlette.concurrency import run_in_threadpool
+from ..services.model_registry import model_registry
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+@router.get("/models")
+async def list_models():
+    """
+    可选的模型列表及状态
+
+    每个模型包含说明、是否默认、是否已加载，
+    以及加载耗时、预热耗时、估算内存、解释器数、请求数、推理片段数和累计推理耗时。
+    """
+    models = await run_in_threadpool(model_registry.stats)
+    return {
+        "success": True,
+        "default": model_registry.default_model,
+        "maxBytes": model_registry.max_bytes,
+        "models": models
+    }
@@ -0,0 +1,55 @@
+import logging
+import time
+from fastapi import APIRouter, HTTPException, Query
+from ..models import SimilarResponse, SimilarSegment
+from ..services.vector_index import vector_index
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+@router.get("/similar", response_model=SimilarResponse)
+def find_similar(
+    analysis_id: str = Query(..., description="查询片段所属的分析ID"),
+    segment: int = Query(..., ge=0, description="查询片段序号（从 0 开始，每段 3 秒）"),
+    k: int = Query(10, ge=1, le=100, description="返回的结果数"),
+    exact: bool = Query(False, description="强制精确搜索（忽略近似索引）")
+):
+    """
+    查找与指定片段声学上最相似的片段
+
+    只能查询以 embeddings=true 分析过的录音。
+
+    Args:
+        analysis_id: 分析ID
+        segment: 片段序号
+        k: 返回的结果数
+        exact: 是否强制精确搜索
+
+    Returns:
+        按余弦相似度降序排列的片段列表
+    """
+    found = vector_index.get_vector(analysis_id, segment)
+    if found is None:
+        raise HTTPException(status_code=404, detail="该分析没有对应的片段嵌入")
+    vector_id, vector = found
+
+    start_time = time.time()
+    results = vector_index.search(vector[None, :], k=k, exact=exact, exclude=[vector_id])[0]
+    logger.info(
+        f"[{analysis_id}] Similarity search for segment {segment}: "
+        f"{len(results)} results in {(time.time() - start_time) * 1000:.1f}ms"
+    )
+
+    return SimilarResponse(
+        success=True,
+        query=SimilarSegment(**vector_index.describe(vector_id, 1.0)),
+        results=[SimilarSegment(**hit) for hit in results]
+    )
+
+
+@router.get("/similar/stats")
+def similar_stats():
+    """相似度索引状态（向量数、分析数、是否已建近似索引）"""
+    return {"success": True, **vector_index.stats()}
@@ -0,0 +1,85 @@
+import logging
+import time
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from .. import config
+from ..services.detection_store import detection_store, to_timestamp
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+@router.get("/stats/summary")
+def stats_summary():
+    """已存储的录音数、音频时长、检测数和物种数"""
+    _ensure_enabled()
+    start_time = time.time()
+    summary = detection_store.summary()
+    return {"success": True, **summary, "queryTime": _elapsed_ms(start_time)}
+
+
+@router.get("/stats/species")
+def species_counts(
+    start: Optional[datetime] = Query(None, description="起始时间（ISO 8601，无时区时按 UTC）"),
+    end: Optional[datetime] = Query(None, description="结束时间（ISO 8601，无时区时按 UTC）"),
+    top: int = Query(50, ge=1, le=10000, description="返回的物种数")
+):
+    """
+    时间段内各物种的检测数，按检测数降序（即物种排行）
+
+    由小时汇总表计算，时间段按整小时对齐。
+    """
+    _ensure_enabled()
+    start_time = time.time()
+    species = detection_store.species_counts(to_timestamp(start), to_timestamp(end), top)
+    return {"success": True, "species": species, "queryTime": _elapsed_ms(start_time)}
+
+
+@router.get("/stats/hourly")
+def hourly_counts(
+    start: Optional[datetime] = Query(None, description="起始时间（ISO 8601，无时区时按 UTC）"),
+    end: Optional[datetime] = Query(None, description="结束时间（ISO 8601，无时区时按 UTC）"),
+    species: Optional[str] = Query(None, description="只统计该物种（学名）"),
+    by: str = Query("hour", description="hour: 逐小时时间序列 / hourOfDay: 按一天中的小时汇总"),
+    utc_offset: int = Query(0, ge=-12, le=14, description="hourOfDay 使用的时区偏移（整小时，汇总表按小时存储）")
+):
+    """每小时的检测数（时间序列或日内分布）"""
+    _ensure_enabled()
+    if by not in ("hour", "hourOfDay"):
+        raise HTTPException(status_code=400, detail="不支持的分组方式。支持: hour, hourOfDay")
+    start_time = time.time()
+    counts = detection_store.hourly_counts(
+        to_timestamp(start),
+        to_timestamp(end),
+        species,
+        hour_of_day=by == "hourOfDay",
+        utc_offset=utc_offset
+    )
+    return {"success": True, "by": by, "counts": counts, "queryTime": _elapsed_ms(start_time)}
+
+
+@router.get("/stats/detections")
+def list_detections(
+    species: str = Query(..., description="物种学名"),
+    start: Optional[datetime] = Query(None, description="起始时间（ISO 8601，无时区时按 UTC）"),
+    end: Optional[datetime] = Query(None, description="结束时间（ISO 8601，无时区时按 UTC）"),
+    min_conf: float = Query(0.0, ge=0.0, le=1.0, description="最小置信度"),
+    limit: int = Query(100, ge=1, le=10000, description="返回的最大条数")
+):
+    """某物种在时间段内的检测明细（最新的在前）"""
+    _ensure_enabled()
+    start_time = time.time()
+    detections = detection_store.detections(species, to_timestamp(start), to_timestamp(end), min_conf, limit)
+    return {"success": True, "detections": detections, "queryTime": _elapsed_ms(start_time)}
+
+
+def _ensure_enabled():
+    """未启用检测结果存储时返回 404"""
+    if not config.DETECTION_STORE_ENABLED:
+        raise HTTPException(status_code=404, detail="未启用检测结果存储（DETECTION_STORE_ENABLED）")
+
+
+def _elapsed_ms(start_time: float) -> float:
+    return round((time.time() - start_time) * 1000, 2)
@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+from .. import config
+from ..services.admission import admission
+from ..services.analysis_cache import analysis_cache
+from ..services.pipeline import analysis_pipeline
+from ..services.upload_service import UploadSession, upload_manager
+from ..utils.cancellation import AnalysisCancelled, CancelToken, cancel_on_disconnect
+from ..utils.client_identity import client_key
+from ..utils.postprocess import DETAIL_SEGMENTS
+from .analyze import build_analysis_response, cleanup_session, negotiate_response, prepare_analysis_file, resolve_model
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# 分块写入磁盘前在内存中累积的字节数
+_WRITE_BUFFER_SIZE = 256 * 1024
+
+
+@router.post("/uploads", status_code=201)
+async def create_upload(
+    request: Request,
+    filename: str = Query(..., description="原始文件名（用于判断音频格式）"),
+    model: Optional[str] = Query(None, description="模型ID（见 /api/models），默认使用 DEFAULT_MODEL"),
+    embeddings: bool = Query(config.EMBEDDINGS_ENABLED, description="是否提取片段嵌入并加入相似度索引"),
+    upload_length: int = Header(..., alias="Upload-Length", ge=1, description="文件总字节数")
+):
+    """
+    创建断点续传上传
+
+    之后用 PATCH /api/uploads/{id} 按偏移量追加分块，HEAD 查询已接收的字节数，
+    全部上传后 POST /api/uploads/{id}/finalize 获取分析结果。分块到达后即开始解码和推理。
+
+    Returns:
+        201，Location 头为上传地址，Upload-Offset 头为 0
+    """
+    if upload_length > config.MAX_FILE_SIZE:
+        raise HTTPException(status_code=413, detail=f"文件过大，最大 {config.MAX_FILE_SIZE} 字节")
+    if Path(filename).suffix.lower() not in config.ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的音频格式。支持的扩展名: {', '.join(config.ALLOWED_EXTENSIONS)}"
+        )
+    model_id = resolve_model(model, embeddings)
+
+    session = await run_in_threadpool(
+        upload_manager.create, filename, upload_length, model_id, embeddings, client_key(request)
+    )
+    location = f"/api/uploads/{session.id}"
+    return JSONResponse(
+        status_code=201,
+        content={
+            "success": True,
+            "uploadId": session.id,
+            "location": location,
+            "offset": 0,
+            "length": upload_length
+        },
+        headers={"Location": location, "Upload-Offset": "0", "Upload-Length": str(upload_length)}
+    )
+
+
+@router.head("/uploads/{upload_id}")
+async def get_upload_offset(upload_id: str):
+    """查询已接收的字节数（断线重连后从 Upload-Offset 继续上传）"""
+    session = _get_session(upload_id)
+    return Response(status_code=200, headers=_offset_headers(session))
+
+
+@router.patch("/uploads/{upload_id}", status_code=204)
+async def append_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset", ge=0, description="本分块在文件中的起始偏移量")
+):
+    """
+    在 Upload-Offset 处追加一个分块（请求体为原始字节）
+
+    偏移量必须等于已接收的字节数，否则返回 409 和当前的 Upload-Offset。
+    连接中途断开时已到达的字节仍然保留。
+    """
+    session = _get_session(upload_id)
+    if session.busy:
+        raise HTTPException(status_code=409, detail="该上传正在写入或分析中", headers=_offset_headers(session))
+    if session.complete:
+        raise HTTPException(status_code=409, detail="上传已完成", headers=_offset_headers(session))
+    if upload_offset != session.offset:
+        raise HTTPException(
+            status_code=409,
+            detail=f"偏移量不匹配，当前已接收 {session.offset} 字节",
+            headers=_offset_headers(session)
+        )
+
+    session.busy = True
+    try:
+        upload_manager.ensure_stream(session)
+        buffer = bytearray()
+        try:
+            async for piece in request.stream():
+                if session.offset + len(buffer) + len(piece) > session.length:
+                    raise HTTPException(status_code=413, detail="分块超出了创建时声明的 Upload-Length")
+                buffer += piece
+                if len(buffer) >= _WRITE_BUFFER_SIZE:
+                    await run_in_threadpool(session.write, bytes(buffer))
+                    buffer.clear()
+        except ClientDisconnect:
+            logger.info(f"[{session.id}] Client disconnected during chunk upload")
+        finally:
+            if buffer:
+                await run_in_threadpool(session.write, bytes(buffer))
+    finally:
+        session.busy = False
+
+    return Response(status_code=204, headers=_offset_headers(session))
+
+
+@router.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(
+    upload_id: str,
+    request: Request,
+    format: Optional[str] = Query(None, description="响应格式: rows / columnar / msgpack（默认按 Accept 头协商）"),
+    detail: str = Query(DETAIL_SEGMENTS, description="结果粒度: segments（逐片段）/ events（合并后的事件）"),
+    recorded_at: Optional[datetime] = Query(None, description="录音开始时间（ISO 8601），用于检测结果统计"),
+    images: bool = Query(False, description="是否在响应中附带检测到的物种的图片 URL")
+):
+    """
+    结束上传并返回分析结果（与 /api/analyze 的响应相同）
+
+    上传过程中已在增量解码时只需等待剩余批次；没有增量解码（ffmpeg 不可用、名额已满、
+    中途空闲超时或服务重启）时按完整文件分析。客户端在此期间断开时上传的数据保留，
+    可以重新调用 finalize。
+    """
+    session = _get_session(upload_id)
+    if session.busy:
+        raise HTTPException(status_code=409, detail="该上传正在写入或分析中", headers=_offset_headers(session))
+    if session.offset < session.length:
+        raise HTTPException(
+            status_code=409,
+            detail=f"上传未完成，已接收 {session.offset}/{session.length} 字节",
+            headers=_offset_headers(session)
+        )
+    response_format = negotiate_response(request, format, detail)
+
+    session.busy = True
+    start_time = time.time()
+    session.mark_complete()
+    stream = session.stream
+    token = CancelToken()
+    if stream is not None:
+        token.add_callback(stream.stop)
+    analysis_file = session.path
+
+    try:
+        async with admission.admit() as ticket, cancel_on_disconnect(request, token, config.DISCONNECT_POLL_INTERVAL):
+            digest = None
+            if config.ANALYSIS_CACHE_ENABLED:
+                digest = await run_in_threadpool(analysis_cache.file_digest, session.path)
+            result = await analysis_cache.get(digest, session.model_id, session.embeddings, session.file_name, session.id)
+            if result is not None:
+                upload_manager.stop_stream(session)
+                stream = None
+            cached = result is not None
+
+            if stream is not None:
+                try:
+                    submitted = await asyncio.wrap_future(stream.future)
+                    logger.info(
+                        f"[{session.id}] Streaming decode finished {time.time() - stream.started_at:.1f}s "
+                        f"after it started, collecting results"
+                    )
+                    result = await analysis_pipeline.collect(
+                        submitted,
+                        session.id,
+                        session.file_name,
+                        session.model_id,
+                        start_time
+                    )
+                except Exception as e:
+                    if token.cancelled:
+                        raise
+                    if not stream.unstreamable:
+                        logger.warning(f"[{session.id}] Streaming analysis failed, analyzing the file instead: {e}")
+                    upload_manager.stop_stream(session)
+
+            if result is None:
+                analysis_file = await prepare_analysis_file(session.id, session.path, token)
+                result = await analysis_pipeline.analyze(
+                    analysis_file,
+                    session.id,
+                    session.file_name,
+                    session.client,
+                    session.embeddings,
+                    token,
+                    session.model_id
+                )
+            if not cached:
+                await analysis_cache.put(digest, session.model_id, result)
+            ticket.queue_delay = result["queue_delay"]
+
+            response = await build_analysis_response(
+                session.id,
+                session.file_name,
+                result,
+                response_format,
+                detail,
+                session.model_id,
+                session.client,
+                recorded_at,
+                images
+            )
+
+        upload_manager.remove(session, delete_file=False)
+        cleanup_session(session.id, session.path, analysis_file)
+        return response
+
+    except (asyncio.CancelledError, AnalysisCancelled) as e:
+        if not token.cancelled:
+            raise
+        # 客户端已断开：停止分析但保留已上传的数据，下次 finalize 时按文件重新分析
+        if isinstance(e, asyncio.CancelledError):
+            asyncio.current_task().uncancel()
+        logger.info(f"[{session.id}] Client disconnected during finalize, upload kept")
+        upload_manager.stop_stream(session)
+        return Response(status_code=499)
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        logger.error(f"[{session.id}] Analysis failed: {e}")
+        upload_manager.stop_stream(session)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    finally:
+        session.busy = False
+
+
+@router.delete("/uploads/{upload_id}", status_code=204)
+async def delete_upload(upload_id: str):
+    """取消上传并删除已接收的数据"""
+    session = _get_session(upload_id)
+    if session.busy:
+        raise HTTPException(status_code=409, detail="该上传正在写入或分析中")
+    await run_in_threadpool(upload_manager.remove, session)
+    logger.info(f"[{session.id}] Upload deleted")
+    return Response(status_code=204)
+
+
+def _get_session(upload_id: str) -> UploadSession:
+    """获取上传会话，不存在或已过期时返回 404"""
+    session = upload_manager.get(upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="上传不存在或已过期")
+    return session
+
+
+def _offset_headers(session: UploadSession) -> dict:
+    return {
+        "Upload-Offset": str(session.offset),
+        "Upload-Length": str(session.length),
+        "Cache-Control": "no-store"
+    }
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+from fastapi import HTTPException
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionTicket:
+    """一次已准入的分析，路由处理函数拿到调度结果后填写 queue_delay"""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.queue_delay: Optional[float] = None
+
+
+class AdmissionController:
+    """
+    自适应并发限制（AIMD）
+
+    以调度器排队时延和超时作为拥塞信号：
+    - 排队时延不超过目标值：并发上限加性增长（每个完成的请求 +1/limit）
+    - 排队时延超过目标值、请求超时或耗时超过 timeout：并发上限乘性下降（每个目标时延窗口最多一次）
+    其他失败（无法解码的文件、模型错误等）与负载无关，不调整上限。
+    超出上限的请求立即以 503 + Retry-After 拒绝，而不是继续排队直到超时或内存耗尽。
+
+    名额在请求体接收完之后、提交分析时才占用（见 admit），上传慢的客户端不会占着名额。
+    """
+
+    def __init__(
+        self,
+        initial_limit: float,
+        min_limit: int,
+        max_limit: int,
+        target_delay: float,
+        backoff: float,
+        retry_after: int,
+        timeout: float,
+        enabled: bool = True,
+    ):
+        self.enabled = enabled
+        self.timeout = timeout
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_delay = target_delay
+        self.backoff = backoff
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._last_decrease = 0.0
+        self._queue_delay_ewma = 0.0
+        self._latency_ewma = 0.0
+        self._stats = {"admitted": 0, "shed": 0, "completed": 0, "timedOut": 0}
+
+    def try_acquire(self) -> bool:
+        """尝试占用一个并发名额，超出上限时返回 False"""
+        with self._lock:
+            if self.in_flight >= math.floor(self.limit):
+                self._stats["shed"] += 1
+                return False
+            self.in_flight += 1
+            self._stats["admitted"] += 1
+            return True
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[AdmissionTicket]:
+        """
+        在请求体接收完之后占用一个名额，分析结束（含失败、取消）时释放
+
+        Raises:
+            HTTPException: 超出并发上限（503 + Retry-After）
+        """
+        ticket = AdmissionTicket()
+        if not self.enabled:
+            yield ticket
+            return
+        if not self.try_acquire():
+            raise HTTPException(
+                status_code=503,
+                detail="服务繁忙，请稍后重试",
+                headers={"Retry-After": str(self.retry_after_seconds())}
+            )
+        timed_out = False
+        try:
+            yield ticket
+        except asyncio.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self.release(time.monotonic() - ticket.started_at, ticket.queue_delay, timed_out)
+
+    def release(self, latency: float, queue_delay: Optional[float] = None, timed_out: bool = False):
+        """
+        释放名额并根据观测结果调整并发上限
+
+        Args:
+            latency: 请求总耗时（秒）
+            queue_delay: 调度器排队时延（秒），没有经过调度器时为 None
+            timed_out: 请求是否超时（耗时超过 timeout 也按超时计）
+        """
+        now = time.monotonic()
+        timed_out = timed_out or latency > self.timeout
+        with self._lock:
+            self.in_flight = max(self.in_flight - 1, 0)
+            self._stats["timedOut" if timed_out else "completed"] += 1
+            self._latency_ewma = 0.8 * self._latency_ewma + 0.2 * latency
+            if queue_delay is not None:
+                self._queue_delay_ewma = 0.8 * self._queue_delay_ewma + 0.2 * queue_delay
+
+            congested = timed_out or (queue_delay is not None and queue_delay > self.target_delay)
+            if congested:
+                if now - self._last_decrease >= self.target_delay:
+                    old_limit = self.limit
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = now
+                    logger.info(
+                        f"Admission limit decreased {old_limit:.1f} -> {self.limit:.1f} "
+                        f"(queue delay: {queue_delay}, timed out: {timed_out})"
+                    )
+            elif queue_delay is not None:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def retry_after_seconds(self) -> int:
+        """建议客户端的重试间隔：按当前平均耗时估算，至少为配置值"""
+        with self._lock:
+            return int(max(self.retry_after, math.ceil(self._latency_ewma)))
+
+    def stats(self) -> dict:
+        """当前并发上限和统计"""
+        with self._lock:
+            return {
+                "limit": round(self.limit, 2),
+                "inFlight": self.in_flight,
+                "minLimit": self.min_limit,
+                "maxLimit": self.max_limit,
+                "targetQueueDelay": self.target_delay,
+                "queueDelayEwma": round(self._queue_delay_ewma, 3),
+                "latencyEwma": round(self._latency_ewma, 3),
+                **self._stats
+            }
+
+
+# 全局准入控制器
+admission = AdmissionController(
+    initial_limit=config.ADMISSION_INITIAL_LIMIT,
+    min_limit=config.ADMISSION_MIN_LIMIT,
+    max_limit=config.ADMISSION_MAX_LIMIT,
+    target_delay=config.ADMISSION_TARGET_QUEUE_DELAY,
+    backoff=config.ADMISSION_BACKOFF,
+    retry_after=config.ADMISSION_RETRY_AFTER,
+    timeout=config.ANALYSIS_TIMEOUT,
+    enabled=config.ADMISSION_ENABLED,
+)
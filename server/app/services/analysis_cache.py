@@ -0,0 +1,154 @@
+import hashlib
+import io
+import logging
+import time
+from pathlib import Path
+from typing import Optional
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+from .. import config
+from ..utils.score_matrix import ScoreMatrix
+from ..utils.visual_summary import VisualSummary
+from .cache import cache
+
+logger = logging.getLogger(__name__)
+
+# 计算文件哈希时每次读取的字节数
+_HASH_READ_SIZE = 1 << 20
+
+
+class AnalysisCache:
+    """
+    按音频内容哈希缓存分析结果
+
+    缓存的是完整分数矩阵（以及可选的片段嵌入、波形和频谱图），命中后按当前阈值重新生成
+    检测结果，不需要解码和推理。同一段录音在任何副本上分析过一次，其他副本都可以直接复用。
+
+    转存到临时文件的长录音（分数矩阵、嵌入或频谱图超过 PIPELINE_SPILL_SEGMENTS 等阈值）不缓存：
+    序列化和命中时加载都要把整个矩阵读进内存，抵消了转存的意义，缓存条目也因此有大小上限。
+
+    命中的结果带有 "cached" 和 "origin_id"（首次分析的ID）：嵌入已经以原分析的名义索引过，
+    检测结果也已写入存储，build_analysis_response 据此不再重复写入。
+    """
+
+    @staticmethod
+    def file_digest(path: Path) -> str:
+        """音频文件内容的 SHA-256（阻塞调用）"""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(_HASH_READ_SIZE):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def pcm_digest(data, encoding: str, sample_rate: int, channels: int) -> str:
+        """原始 PCM 的 SHA-256（编码参数也参与哈希）"""
+        digest = hashlib.sha256(f"{encoding}:{sample_rate}:{channels}:".encode())
+        digest.update(data)
+        return digest.hexdigest()
+
+    async def get(
+        self,
+        digest: Optional[str],
+        model_id: str,
+        embeddings: bool,
+        file_name: str,
+        session_id: str
+    ) -> Optional[dict]:
+        """
+        查找缓存的分析结果
+
+        Args:
+            digest: 音频内容哈希，None 表示不使用缓存
+            embeddings: 是否需要片段嵌入（缓存中没有嵌入时视为未命中）
+
+        Returns:
+            与 analysis_pipeline.analyze 相同结构的字典，另含 "cached" 和 "origin_id"；未命中时返回 None
+        """
+        if digest is None:
+            return None
+        return await run_in_threadpool(self._load, digest, model_id, embeddings, file_name, session_id)
+
+    async def put(self, digest: Optional[str], model_id: str, result: dict):
+        """写入分析结果（digest 为 None 时忽略）"""
+        if digest is None:
+            return
+        await run_in_threadpool(self._store, digest, model_id, result)
+
+    def _load(self, digest: str, model_id: str, embeddings: bool, file_name: str, session_id: str) -> Optional[dict]:
+        start_time = time.time()
+        raw = cache.get(_scores_key(model_id, digest))
+        if raw is None:
+            return None
+        segment_embeddings = None
+        if embeddings:
+            raw_embeddings = cache.get(_embeddings_key(model_id, digest))
+            if raw_embeddings is None:
+                return None
+            segment_embeddings = np.load(io.BytesIO(raw_embeddings), allow_pickle=False)
+
+        scores = ScoreMatrix.from_npz(raw)
+        scores.file_name = file_name
+        table = scores.to_table(config.MIN_CONFIDENCE, config.SENSITIVITY)
+        logger.info(f"[{session_id}] Analysis cache hit ({digest[:12]}, model {model_id}): {len(table)} detections")
+
+        origin = cache.get(_origin_key(model_id, digest))
+        result = {
+            "scores": scores,
+            "table": table,
+            "analysis_time": time.time() - start_time,
+            "session_id": session_id,
+            "queue_delay": 0.0,
+            "cached": True,
+            "origin_id": origin.decode() if origin is not None else None
+        }
+        if segment_embeddings is not None:
+            result["embeddings"] = segment_embeddings
+        # 与未命中时一致：VISUAL_ENABLED=false 时不返回视图
+        if config.VISUAL_ENABLED:
+            raw_visual = cache.get(_visual_key(digest))
+            if raw_visual is not None:
+                result["visual"] = VisualSummary.from_npz(raw_visual)
+        return result
+
+    def _store(self, digest: str, model_id: str, result: dict):
+        if _spilled(result):
+            logger.info(f"[{result['session_id']}] Analysis spilled to disk, not cached")
+            return
+        cache.set(_scores_key(model_id, digest), result["scores"].to_npz(), config.ANALYSIS_CACHE_TTL)
+        cache.set(_origin_key(model_id, digest), result["session_id"].encode(), config.ANALYSIS_CACHE_TTL)
+        if "embeddings" in result:
+            buffer = io.BytesIO()
+            np.save(buffer, np.asarray(result["embeddings"], dtype=np.float32), allow_pickle=False)
+            cache.set(_embeddings_key(model_id, digest), buffer.getvalue(), config.ANALYSIS_CACHE_TTL)
+        # 波形和频谱图与模型无关，命中时为新的分析ID重新生成瓦片
+        if "visual" in result:
+            cache.set(_visual_key(digest), result["visual"].to_npz(), config.ANALYSIS_CACHE_TTL)
+
+
+def _spilled(result: dict) -> bool:
+    """结果中是否有转存到临时文件的数组（内存映射）"""
+    arrays = [result["scores"].logits, result.get("embeddings")]
+    if "visual" in result:
+        arrays.append(result["visual"].spectrogram)
+    return any(isinstance(array, np.memmap) for array in arrays)
+
+
+def _scores_key(model_id: str, digest: str) -> str:
+    return f"analysis:scores:{model_id}:{digest}"
+
+
+def _embeddings_key(model_id: str, digest: str) -> str:
+    return f"analysis:embeddings:{model_id}:{digest}"
+
+
+def _origin_key(model_id: str, digest: str) -> str:
+    return f"analysis:origin:{model_id}:{digest}"
+
+
+def _visual_key(digest: str) -> str:
+    return f"analysis:visual:{digest}"
+
+
+# 全局分析结果缓存实例
+analysis_cache = AnalysisCache()
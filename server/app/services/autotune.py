@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from .. import config
+from .birdnet_service import birdnet_service
+from .model_registry import TFLiteInterpreter, model_registry
+from .scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+# 吞吐量在最优值该比例以内的配置视为相同，取延迟更低的
+_THROUGHPUT_TOLERANCE = 0.05
+
+
+def candidate_layouts(cpu_count: int) -> List[Tuple[int, int]]:
+    """
+    候选的 (每个解释器线程数, 推理工作线程数) 组合
+
+    两者都取 2 的幂（以及 CPU 核数本身），且乘积不超过 CPU 核数
+    """
+    values = sorted({1 << i for i in range(cpu_count.bit_length()) if 1 << i <= cpu_count} | {cpu_count})
+    return [(threads, workers) for threads in values for workers in values if threads * workers <= cpu_count]
+
+
+def reference_chunks(clip: Optional[Path] = None, seconds: float = 60.0) -> np.ndarray:
+    """
+    基准测试用的片段
+
+    Args:
+        clip: 参考录音，None 时使用固定种子的合成噪声
+        seconds: 合成噪声的时长（秒）
+    """
+    if clip is not None:
+        sig = birdnet_service.load_audio(str(clip))
+    else:
+        rng = np.random.default_rng(0)
+        sig = (rng.standard_normal(int(seconds * birdnet_service.sample_rate)) * 0.05).astype(np.float32)
+    chunks, _ = birdnet_service.split_signal(sig)
+    if chunks.shape[0] == 0:
+        raise ValueError("Reference clip is shorter than one segment")
+    return np.ascontiguousarray(chunks, dtype=np.float32)
+
+
+def benchmark_layout(model_path: Path, chunks: np.ndarray, threads: int, workers: int, batch_size: int) -> dict:
+    """
+    测量一种布局：workers 个解释器（各 threads 个线程）并发处理参考片段，每个工作线程处理一遍
+
+    Returns:
+        {"tfliteThreads", "analysisWorkers", "segmentsPerSecond", "latencyP50", "latencyP95"}
+    """
+    interpreters = [TFLiteInterpreter(model_path, threads) for _ in range(workers)]
+    batches = [chunks[i:i + batch_size] for i in range(0, chunks.shape[0], batch_size)]
+    for interpreter in interpreters:
+        interpreter.run(batches[0], interpreter.output_index)  # 预热
+
+    latencies: List[float] = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(workers + 1)
+
+    def work(interpreter: TFLiteInterpreter):
+        barrier.wait()
+        local = []
+        for batch in batches:
+            start = time.perf_counter()
+            interpreter.run(batch, interpreter.output_index)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    threads_list = [threading.Thread(target=work, args=(i,), daemon=True) for i in interpreters]
+    for thread in threads_list:
+        thread.start()
+    barrier.wait()
+    start_time = time.perf_counter()
+    for thread in threads_list:
+        thread.join()
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        "tfliteThreads": threads,
+        "analysisWorkers": workers,
+        "segmentsPerSecond": round(chunks.shape[0] * workers / elapsed, 2),
+        "latencyP50": round(float(np.percentile(latencies, 50)), 4),
+        "latencyP95": round(float(np.percentile(latencies, 95)), 4),
+    }
+
+
+def calibrate(
+    model_id: Optional[str] = None,
+    clip: Optional[Path] = None,
+    layouts: Optional[Sequence[Tuple[int, int]]] = None
+) -> dict:
+    """
+    在 线程数 × 工作线程数 网格上测量推理吞吐量和延迟，选出最优配置
+
+    选择吞吐量最高的配置；吞吐量相差不超过 5% 时选 p95 延迟更低的。
+
+    Args:
+        model_id: 用于测量的模型，None 表示默认模型
+        clip: 参考录音，None 时使用合成噪声
+        layouts: 要测量的 (线程数, 工作线程数) 组合，None 时按 CPU 核数生成
+
+    Returns:
+        可直接写入 TUNING_FILE 的字典
+    """
+    cpu_count = os.cpu_count() or 1
+    spec = model_registry.spec(model_id)
+    chunks = reference_chunks(clip)
+    batch_size = max(config.INFERENCE_BATCH_SIZE, 1)
+    layouts = list(layouts or candidate_layouts(cpu_count))
+    logger.info(f"Calibrating inference layout for {spec.id} on {cpu_count} CPUs ({len(layouts)} layouts)")
+
+    results = []
+    for threads, workers in layouts:
+        result = benchmark_layout(spec.model_path, chunks, threads, workers, batch_size)
+        logger.info(
+            f"threads={threads} workers={workers}: {result['segmentsPerSecond']} segments/s, "
+            f"p50 {result['latencyP50'] * 1000:.0f}ms, p95 {result['latencyP95'] * 1000:.0f}ms"
+        )
+        results.append(result)
+
+    best_throughput = max(r["segmentsPerSecond"] for r in results)
+    candidates = [r for r in results if r["segmentsPerSecond"] >= best_throughput * (1 - _THROUGHPUT_TOLERANCE)]
+    best = min(candidates, key=lambda r: r["latencyP95"])
+    logger.info(f"Best layout: {best['tfliteThreads']} threads x {best['analysisWorkers']} workers")
+
+    return {
+        "tfliteThreads": best["tfliteThreads"],
+        "analysisWorkers": best["analysisWorkers"],
+        "cpuCount": cpu_count,
+        "model": spec.id,
+        "batchSize": batch_size,
+        "referenceSegments": int(chunks.shape[0]),
+        "measuredAt": datetime.now().isoformat(),
+        "results": results,
+    }
+
+
+def save(tuning: dict, path: Path = config.TUNING_FILE):
+    """保存调优结果（之后启动时由 config 读取）"""
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(tuning, indent=2), encoding="utf-8")
+    tmp_path.replace(path)
+    logger.info(f"Tuning saved to {path}")
+
+
+def apply(tuning: dict):
+    """
+    在启动调度器和加载模型之前应用调优结果
+
+    环境变量显式设置的值仍然优先。
+    """
+    if "TFLITE_THREADS" not in os.environ:
+        config.TFLITE_THREADS = tuning["tfliteThreads"]
+    if "ANALYSIS_WORKERS" not in os.environ:
+        config.ANALYSIS_WORKERS = tuning["analysisWorkers"]
+        scheduler.workers = tuning["analysisWorkers"]
+        if "MODEL_INTERPRETERS" not in os.environ:
+            config.MODEL_INTERPRETERS = tuning["analysisWorkers"]
+    config.TUNING = tuning
+    logger.info(
+        f"Inference layout: {config.TFLITE_THREADS} threads x {config.ANALYSIS_WORKERS} workers"
+    )
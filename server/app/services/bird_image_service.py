@@ -0,0 +1,207 @@
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import unquote, urlparse
+import httpx
+from starlette.concurrency import run_in_threadpool
+from .. import config
+from .cache import cache
+from .image_pack import image_pack
+
+logger = logging.getLogger(__name__)
+
+# Wikipedia/Wikimedia 要求设置标准 User-Agent
+# 格式: ApplicationName/version (Contact_info)
+USER_AGENT = "BirdEcho/1.0 (https://github.com/smalldeng/bird-echo; birds@bird-echo.app)"
+
+# 根据文件扩展名确定媒体类型
+MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".svg": "image/svg+xml",
+    ".gif": "image/gif",
+}
+
+
+class BirdImageService:
+    """
+    鸟类图片代理：优先使用构建时打包的图片，其余从 Wikipedia 获取并存入缓存后端
+
+    - bird-image:meta:<key> 保存图片来源和扩展名（没有图片的物种也记录，IMAGE_MISS_TTL 内不再查询）
+    - bird-image:data:<key> 保存图片内容
+
+    key 是学名的 MD5。缓存后端为 shared / redis 时，各副本共用同一份图片。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def cache_key(scientific_name: str) -> str:
+        """学名对应的缓存键（前端可能已经编码了学名，先解码）"""
+        return hashlib.md5(unquote(scientific_name).encode()).hexdigest()
+
+    async def image_url(self, scientific_name: str) -> Optional[str]:
+        """
+        获取物种图片的 URL
+
+        策略：
+        1. 缓存命中时返回后端代理的图片 URL
+        2. 缓存未命中时从 Wikipedia API 获取，下载图片并写入缓存
+        3. 图片下载失败时返回 Wikipedia 的原始 URL
+
+        Returns:
+            图片 URL，Wikipedia 没有该物种的图片时返回 None
+
+        Raises:
+            httpx.TimeoutException: Wikipedia 请求超时
+        """
+        decoded_name = unquote(scientific_name)
+        key = self.cache_key(decoded_name)
+
+        # 同一物种的并发请求（包括后台预取）共用一次查询
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._resolve(decoded_name, key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def image_urls(self, scientific_names: Iterable[str], timeout: float) -> Dict[str, Optional[str]]:
+        """
+        批量获取图片 URL，最多等待 timeout 秒
+
+        Returns:
+            {学名: 图片 URL 或 None}，超时或出错的物种不在结果中（查询在后台继续）
+        """
+        names = list(dict.fromkeys(scientific_names))
+        if not names:
+            return {}
+        tasks = {asyncio.ensure_future(self.image_url(name)): name for name in names}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=timeout)
+        finally:
+            # 超时或调用方被取消时只取消等待，共享的查询不受影响
+            for task in tasks:
+                task.cancel()
+        return {tasks[task]: task.result() for task in done if task.exception() is None}
+
+    async def _resolve(self, decoded_name: str, key: str) -> Optional[str]:
+        """查询图片包和缓存，都未命中时从 Wikipedia 获取（每个物种同时只有一个）"""
+        ext = image_pack.ext(key) if image_pack is not None else None
+        if ext is not None:
+            return _proxy_url(key, ext)
+
+        meta = await self._get_meta(key)
+        if meta is not None:
+            if meta["imageUrl"] is None:
+                logger.info(f"Cache hit (no image) for: {decoded_name}")
+                return None
+            if await run_in_threadpool(cache.get, _data_key(key)) is not None:
+                logger.info(f"Cache hit for: {decoded_name}")
+                return _proxy_url(key, meta["ext"])
+
+        logger.info(f"Cache miss, fetching from Wikipedia: {decoded_name}")
+        async with httpx.AsyncClient(timeout=10.0, headers={"User-Agent": USER_AGENT}) as client:
+            status_code, image_url = await fetch_thumbnail_url(client, decoded_name)
+            if not image_url:
+                # 404 表示没有该条目，同样记为没有图片；其他错误不缓存
+                if status_code in (200, 404):
+                    await self._set_meta(key, {"scientificName": decoded_name, "imageUrl": None}, config.IMAGE_MISS_TTL)
+                return None
+
+            try:
+                # 下载图片（Wikimedia URL 会重定向，需要跟随重定向）
+                img_response = await client.get(image_url, timeout=10.0, follow_redirects=True)
+                if img_response.status_code != 200:
+                    return image_url
+
+                ext = image_extension(image_url)
+                await run_in_threadpool(cache.set, _data_key(key), img_response.content, config.IMAGE_CACHE_TTL)
+                await self._set_meta(key, {
+                    "scientificName": decoded_name,
+                    "imageUrl": image_url,
+                    "ext": ext,
+                    "cachedAt": datetime.now().isoformat()
+                }, config.IMAGE_CACHE_TTL)
+                logger.info(f"Cached image for: {decoded_name} ({len(img_response.content)} bytes)")
+                return _proxy_url(key, ext)
+            except Exception as e:
+                # 缓存失败，返回原始 URL
+                logger.error(f"Failed to cache image: {e}", exc_info=True)
+                return image_url
+
+    def image_file(self, file_name: str) -> Optional[Tuple[bytes, str]]:
+        """
+        读取图片包或缓存中的图片（阻塞调用）
+
+        Args:
+            file_name: 缓存键，可能带文件扩展名
+
+        Returns:
+            (图片内容, 媒体类型)，都不存在时返回 None
+        """
+        path = Path(file_name)
+        data = image_pack.read(path.stem) if image_pack is not None else None
+        if data is None:
+            data = cache.get(_data_key(path.stem))
+        if data is None:
+            return None
+        return data, MEDIA_TYPES.get(path.suffix.lower(), "image/jpeg")
+
+    async def _get_meta(self, key: str) -> Optional[dict]:
+        raw = await run_in_threadpool(cache.get, _meta_key(key))
+        return json.loads(raw) if raw is not None else None
+
+    async def _set_meta(self, key: str, meta: dict, ttl: int):
+        await run_in_threadpool(cache.set, _meta_key(key), json.dumps(meta).encode(), ttl)
+
+
+async def fetch_thumbnail_url(client: httpx.AsyncClient, scientific_name: str) -> Tuple[int, Optional[str]]:
+    """
+    查询物种在 Wikipedia 条目摘要中的缩略图（build_image_pack.py 也使用）
+
+    Args:
+        client: 已设置 User-Agent 的 HTTP 客户端
+        scientific_name: 解码后的学名
+
+    Returns:
+        (摘要接口的状态码, HTTPS 图片 URL)，没有缩略图时 URL 为 None
+    """
+    wiki_title = scientific_name.replace(" ", "_")
+    response = await client.get(f"{config.WIKIPEDIA_SUMMARY_URL}{wiki_title}")
+    thumbnail = response.json().get("thumbnail") if response.status_code == 200 else None
+    image_url = thumbnail.get("source") if isinstance(thumbnail, dict) else None
+
+    # 确保图片 URL 是 HTTPS（本地替身服务器用 http 时不转换）
+    if image_url and image_url.startswith("http://") and config.WIKIPEDIA_SUMMARY_URL.startswith("https://"):
+        image_url = image_url.replace("http://", "https://", 1)
+    return response.status_code, image_url or None
+
+
+def image_extension(image_url: str) -> str:
+    """图片 URL 的文件扩展名（小写，缺省为 .jpg）"""
+    return Path(urlparse(image_url).path).suffix.lower() or ".jpg"
+
+
+def _meta_key(key: str) -> str:
+    return f"bird-image:meta:{key}"
+
+
+def _data_key(key: str) -> str:
+    return f"bird-image:data:{key}"
+
+
+def _proxy_url(key: str, ext: str) -> str:
+    """后端代理的图片 URL（包含文件扩展名）"""
+    return f"/api/bird-image-file/{key}{ext}"
+
+
+# 全局图片服务实例
+bird_image_service = BirdImageService()
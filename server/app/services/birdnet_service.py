@@ -1,11 +1,14 @@
 import logging
 import time
 from pathlib import Path
-from typing import List
-from birdnet_analyzer import analyze as birdnet_analyze
+from typing import List, Optional, Tuple
+import numpy as np
+from birdnet_analyzer import audio as birdnet_audio
+from birdnet_analyzer import config as birdnet_cfg
 from .. import config
-from ..models import Detection
-from ..utils.csv_parser import parse_results_csv
+from ..utils.audio_stream import Segmenter
+from ..utils.score_matrix import ScoreMatrix
+from .model_registry import model_registry
 
 logger = logging.getLogger(__name__)
 
@@ -13,76 +16,217 @@ logger = logging.getLogger(__name__)
 class BirdNetService:
     """BirdNET 分析服务"""
 
-    def analyze_audio(self, input_path: str, session_id: str) -> dict:
+    @property
+    def sample_rate(self) -> int:
+        """模型输入采样率（48 kHz）"""
+        return birdnet_cfg.SAMPLE_RATE
+
+    @property
+    def segment_length(self) -> float:
+        """每个分析片段的长度（秒）"""
+        return birdnet_cfg.SIG_LENGTH
+
+    @property
+    def species(self) -> List[Tuple[str, str]]:
+        """默认模型的物种表 [(学名, 俗名), ...]，顺序与模型输出列一致"""
+        return model_registry.species()
+
+    def analyze_audio(
+        self,
+        input_path: str,
+        session_id: str,
+        file_name: str = "",
+        embeddings: bool = False,
+        model_id: Optional[str] = None
+    ) -> dict:
         """
-        调用 BirdNET-Analyzer 分析音频文件
+        调用 BirdNET 模型分析音频文件
 
         Args:
             input_path: 输入音频文件路径
-            session_id: 会话ID用于创建独立的输出目录
+            session_id: 会话ID（同时作为分析ID）
+            file_name: 原始文件名（记录在分数矩阵中）
+            embeddings: 是否同时提取片段嵌入向量
+            model_id: 模型ID（见 model_registry），None 表示默认模型
 
         Returns:
-            包含检测结果和分析时间的字典
+            包含分数矩阵（ScoreMatrix）、默认阈值下的列式检测结果（DetectionTable）和分析时间的字典；
+            embeddings=True 时还包含 "embeddings"（[片段数, D] float32）
         """
-        output_dir = config.OUTPUT_DIR / session_id
-        output_dir.mkdir(parents=True, exist_ok=True)
-
         logger.info(f"Starting BirdNET analysis for: {input_path}")
         start_time = time.time()
 
         try:
-            # 直接调用 BirdNET Python API（模型在进程内缓存，后续调用只需 0.5-1 秒）
-            logger.info(f"Calling BirdNET Python API directly (output: {output_dir})")
-            
-            birdnet_analyze(
-                input_path,
-                output=str(output_dir),
-                rtype="csv"
+            sig = self.load_audio(input_path)
+            duration = sig.shape[0] / self.sample_rate
+            chunks, starts = self.split_signal(sig)
+            if embeddings:
+                logits, segment_embeddings = self.predict_with_embeddings(chunks, model_id)
+            else:
+                logits, segment_embeddings = self.predict_logits(chunks, model_id), None
+
+            return self.assemble_result(
+                logits,
+                starts,
+                duration,
+                file_name or Path(input_path).name,
+                session_id,
+                time.time() - start_time,
+                segment_embeddings,
+                model_id
             )
 
-            # 列出输出目录中的所有文件
-            output_files = list(output_dir.glob("*"))
-            logger.info(f"Output directory contents: {[str(f.name) for f in output_files]}")
-
-            # 查找并解析 results.csv
-            results_file = self._find_results_file(output_dir)
-            detections = parse_results_csv(results_file)
-
-            analysis_time = time.time() - start_time
-            logger.info(f"Analysis completed in {analysis_time:.2f}s, found {len(detections)} detections")
-
-            return {
-                "detections": [d.model_dump() for d in detections],
-                "analysis_time": analysis_time,
-                "session_id": session_id
-            }
-
         except Exception as e:
             logger.error(f"BirdNET analysis error: {e}")
             raise Exception(f"Analysis failed: {str(e)}")
 
-    def _find_results_file(self, output_dir: Path) -> Path:
+    def assemble_result(
+        self,
+        logits: np.ndarray,
+        starts: np.ndarray,
+        duration: float,
+        file_name: str,
+        session_id: str,
+        analysis_time: float,
+        segment_embeddings: Optional[np.ndarray] = None,
+        model_id: Optional[str] = None
+    ) -> dict:
         """
-        查找 results.csv 文件
+        由推理输出组装分析结果
 
         Args:
-            output_dir: 输出目录路径
+            logits: 分数矩阵 [片段数, 物种数]
+            starts: 片段起始时间
+            duration: 音频时长（秒）
+            file_name: 原始文件名
+            session_id: 会话ID
+            analysis_time: 分析耗时（秒）
+            segment_embeddings: 片段嵌入（可选）
+            model_id: 模型ID，None 表示默认模型
 
         Returns:
-            results.csv 文件路径
+            与 analyze_audio 相同结构的字典
+        """
+        model_id = model_registry.resolve(model_id)
+        scores = ScoreMatrix(
+            logits,
+            starts,
+            np.minimum(starts + self.segment_length, duration),
+            model_registry.species(model_id),
+            duration,
+            file_name,
+            model_id,
+        )
+        table = scores.to_table(config.MIN_CONFIDENCE, config.SENSITIVITY)
+
+        logger.info(
+            f"Analysis completed in {analysis_time:.2f}s, "
+            f"{len(starts)} segments, found {len(table)} detections"
+        )
+
+        result = {
+            "scores": scores,
+            "table": table,
+            "analysis_time": analysis_time,
+            "session_id": session_id
+        }
+        if segment_embeddings is not None:
+            result["embeddings"] = segment_embeddings
+        return result
+
+    def load_audio(self, input_path: str) -> np.ndarray:
+        """读取音频并重采样为 48 kHz 单声道 float32"""
+        sig, _ = birdnet_audio.open_audio_file(input_path, sample_rate=self.sample_rate)
+        return np.asarray(sig, dtype=np.float32)
+
+    def split_signal(self, sig: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        将信号切分为 3 秒片段（规则与 BirdNET-Analyzer 一致）
+
+        - 不足 3 秒的尾部片段补零
+        - 尾部片段短于最小长度时丢弃（整段音频短于最小长度时没有片段）
 
-        Raises:
-            FileNotFoundError: 如果找不到 results.csv
+        Returns:
+            (片段数组 [n, 片段采样数], 片段起始时间数组 [n])
         """
-        # BirdNET 输出文件名格式: {输入文件名}.csv
-        # 例如: recording.wav.csv
-        csv_files = list(output_dir.glob("*.csv"))
+        rate = self.sample_rate
+        chunk_size = int(rate * birdnet_cfg.SIG_LENGTH)
+        step_size = int(rate * (birdnet_cfg.SIG_LENGTH - birdnet_cfg.SIG_OVERLAP))
+        min_size = int(rate * birdnet_cfg.SIG_MINLEN)
+
+        last_pos = max(-(-(sig.shape[0] - chunk_size) // step_size) * step_size, 0)
+        if sig.shape[0] - last_pos < min_size:
+            last_pos -= step_size
+        if last_pos < 0:
+            return np.empty((0, chunk_size), dtype=np.float32), np.empty(0, dtype=np.float32)
+
+        padded = np.concatenate((sig, np.zeros(chunk_size, dtype=sig.dtype)))
+        chunks = np.lib.stride_tricks.sliding_window_view(padded, chunk_size)[0:last_pos + 1:step_size]
+        starts = np.arange(chunks.shape[0], dtype=np.float32) * (step_size / rate)
+        return chunks, starts
+
+    def create_segmenter(self) -> Segmenter:
+        """创建流式切分器（逐块解码时使用，切分规则与 split_signal 一致）"""
+        return Segmenter(
+            self.sample_rate,
+            birdnet_cfg.SIG_LENGTH,
+            birdnet_cfg.SIG_OVERLAP,
+            birdnet_cfg.SIG_MINLEN
+        )
+
+    def predict_logits(self, chunks: np.ndarray, model_id: Optional[str] = None) -> np.ndarray:
+        """
+        批量推理
 
-        if not csv_files:
-            raise FileNotFoundError(f"No CSV files found in output directory: {output_dir}")
+        Args:
+            chunks: 片段数组 [n, 片段采样数]
+            model_id: 模型ID，None 表示默认模型
 
-        logger.info(f"Found CSV files: {[f.name for f in csv_files]}")
-        return csv_files[0]
+        Returns:
+            logits 数组 [n, 物种数]（float16）
+        """
+        batch_size = max(config.INFERENCE_BATCH_SIZE, 1)
+        logits = np.empty((chunks.shape[0], len(model_registry.species(model_id))), dtype=np.float16)
+        for i in range(0, chunks.shape[0], batch_size):
+            batch = np.ascontiguousarray(chunks[i:i + batch_size], dtype=np.float32)
+            logits[i:i + batch.shape[0]] = model_registry.predict(model_id, batch)
+        return logits
+
+    def extract_embeddings(self, chunks: np.ndarray, model_id: Optional[str] = None) -> np.ndarray:
+        """
+        批量提取片段嵌入向量（模型倒数第二层输出）
+
+        Args:
+            chunks: 片段数组 [n, 片段采样数]
+            model_id: 模型ID，None 表示默认模型
+
+        Returns:
+            嵌入数组 [n, D]（float32）
+        """
+        batch_size = max(config.INFERENCE_BATCH_SIZE, 1)
+        batches = []
+        for i in range(0, chunks.shape[0], batch_size):
+            batch = np.ascontiguousarray(chunks[i:i + batch_size], dtype=np.float32)
+            batches.append(np.asarray(model_registry.embeddings(model_id, batch), dtype=np.float32))
+        return np.concatenate(batches) if batches else np.empty((0, 0), dtype=np.float32)
+
+    def predict_with_embeddings(self, chunks: np.ndarray, model_id: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        批量推理并提取嵌入向量（每个批次只调用一次模型，两个输出张量同时读取）
+
+        Returns:
+            (logits [n, 物种数] float16, 嵌入 [n, D] float32)
+        """
+        batch_size = max(config.INFERENCE_BATCH_SIZE, 1)
+        logits = np.empty((chunks.shape[0], len(model_registry.species(model_id))), dtype=np.float16)
+        batches = []
+        for i in range(0, chunks.shape[0], batch_size):
+            batch = np.ascontiguousarray(chunks[i:i + batch_size], dtype=np.float32)
+            batch_logits, batch_embeddings = model_registry.predict_with_embeddings(model_id, batch)
+            logits[i:i + batch.shape[0]] = batch_logits
+            batches.append(np.asarray(batch_embeddings, dtype=np.float32))
+        segment_embeddings = np.concatenate(batches) if batches else np.empty((0, 0), dtype=np.float32)
+        return logits, segment_embeddings
 
 
 # 全局服务实例
@@ -0,0 +1,300 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+# 文件缓存清理过期条目的最小间隔（秒）
+_PURGE_INTERVAL = 600
+
+
+class CacheBackend:
+    """
+    键值缓存后端接口（值为 bytes，每个条目有独立的 TTL）
+
+    所有方法都是阻塞调用，协程中通过 run_in_threadpool 使用。
+    """
+
+    name = "base"
+
+    def get(self, key: str) -> Optional[bytes]:
+        """读取条目，不存在或已过期时返回 None"""
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: int):
+        """写入条目，ttl 秒后过期"""
+        raise NotImplementedError
+
+    def set_many(self, items: Dict[str, bytes], ttl: int):
+        """批量写入条目（默认逐个写入，支持批量命令的后端覆盖）"""
+        for key, value in items.items():
+            self.set(key, value, ttl)
+
+    def delete(self, key: str):
+        """删除条目（不存在时忽略）"""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+class MemoryCache(CacheBackend):
+    """
+    进程内 LRU 缓存，按总字节数上限淘汰
+
+    单进程部署和测试时可以直接作为后端；NearCache 也用它作为本地层。
+    """
+
+    name = "memory"
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self._bytes -= len(self._entries.pop(key)[1])
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: int):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key)[1])
+            self._entries[key] = (time.time() + ttl, value)
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def delete(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= len(entry[1])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": self.name,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class FileCache(CacheBackend):
+    """
+    文件缓存：每个条目一个文件，文件的修改时间即过期时间
+
+    写入先落到同目录的临时文件再原子 rename，读者不会看到写了一半的文件，
+    多个进程（durable=True 时包括挂载同一共享文件系统的多台主机）可以同时读写。
+    durable=True 时 rename 前先 fsync，避免 NFS 等文件系统上其他主机读到空文件。
+    """
+
+    def __init__(self, directory: Path, durable: bool = False):
+        self.directory = directory
+        self.durable = durable
+        self.name = "shared" if durable else "disk"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._last_purge = 0.0
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            if path.stat().st_mtime < time.time():
+                path.unlink(missing_ok=True)
+                return None
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, value: bytes, ttl: int):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+                if self.durable:
+                    f.flush()
+                    os.fsync(f.fileno())
+            expires_at = time.time() + ttl
+            os.utime(tmp_name, (expires_at, expires_at))
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        self._maybe_purge()
+
+    def delete(self, key: str):
+        self._path(key).unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "directory": str(self.directory)}
+
+    def _path(self, key: str) -> Path:
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return self.directory / digest[:2] / digest
+
+    def _maybe_purge(self):
+        """定期删除过期文件（以及异常退出留下的临时文件）"""
+        now = time.time()
+        if now - self._last_purge < _PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        for path in self.directory.glob("*/*"):
+            try:
+                stat = path.stat()
+                if path.name.startswith(".tmp-"):
+                    expired = now - stat.st_ctime > _PURGE_INTERVAL
+                else:
+                    expired = stat.st_mtime < now
+                if expired:
+                    path.unlink()
+            except OSError:
+                pass
+
+
+class RedisCache(CacheBackend):
+    """
+    Redis 协议缓存（Redis / Valkey / KeyDB / Dragonfly 等）
+
+    需要安装 redis 包；键统一加 CACHE_KEY_PREFIX 前缀，多个服务可以共用一个实例。
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requires the redis package (pip install redis)")
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, socket_timeout=2.0, socket_connect_timeout=2.0)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: int):
+        self._client.set(self.prefix + key, value, ex=max(int(ttl), 1))
+
+    def set_many(self, items: Dict[str, bytes], ttl: int):
+        # 一次往返写入所有条目
+        pipe = self._client.pipeline(transaction=False)
+        for key, value in items.items():
+            pipe.set(self.prefix + key, value, ex=max(int(ttl), 1))
+        pipe.execute()
+
+    def delete(self, key: str):
+        self._client.delete(self.prefix + key)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "prefix": self.prefix}
+
+
+class NearCache(CacheBackend):
+    """
+    共享后端前面的进程内近端缓存
+
+    读先查本地 LRU（条目最多保留 near_ttl 秒），未命中再查共享后端并回填；
+    写同时写入两层。共享后端出错时按未命中处理，缓存故障不影响请求。
+    其他副本更新同一个键后，本地层最多返回 near_ttl 秒的旧值。
+    以 skip_prefixes 开头的键（数量多、很少重复读取）只读写共享后端，不占用本地层。
+    """
+
+    def __init__(self, backend: CacheBackend, max_bytes: int, near_ttl: int, skip_prefixes: Tuple[str, ...] = ()):
+        self.backend = backend
+        self.near_ttl = near_ttl
+        self.skip_prefixes = tuple(skip_prefixes)
+        self.name = backend.name
+        self._local = MemoryCache(max_bytes)
+
+    def get(self, key: str) -> Optional[bytes]:
+        near = not key.startswith(self.skip_prefixes)
+        if near:
+            value = self._local.get(key)
+            if value is not None:
+                return value
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"Cache backend {self.backend.name} get failed: {e}")
+            return None
+        if value is not None and near:
+            self._local.set(key, value, self.near_ttl)
+        return value
+
+    def set(self, key: str, value: bytes, ttl: int):
+        if not key.startswith(self.skip_prefixes):
+            self._local.set(key, value, min(ttl, self.near_ttl))
+        try:
+            self.backend.set(key, value, ttl)
+        except Exception as e:
+            logger.warning(f"Cache backend {self.backend.name} set failed: {e}")
+
+    def set_many(self, items: Dict[str, bytes], ttl: int):
+        for key, value in items.items():
+            if not key.startswith(self.skip_prefixes):
+                self._local.set(key, value, min(ttl, self.near_ttl))
+        try:
+            self.backend.set_many(items, ttl)
+        except Exception as e:
+            logger.warning(f"Cache backend {self.backend.name} set_many failed: {e}")
+
+    def delete(self, key: str):
+        self._local.delete(key)
+        try:
+            self.backend.delete(key)
+        except Exception as e:
+            logger.warning(f"Cache backend {self.backend.name} delete failed: {e}")
+
+    def stats(self) -> dict:
+        return {**self.backend.stats(), "near": self._local.stats()}
+
+
+def create_cache(backend: str) -> CacheBackend:
+    """
+    按名称创建缓存后端
+
+    Args:
+        backend: memory / disk / shared / redis
+    """
+    if backend == "memory":
+        return MemoryCache(config.CACHE_MEMORY_MAX_BYTES)
+    if backend == "disk":
+        shared = FileCache(config.CACHE_DIR)
+    elif backend == "shared":
+        shared = FileCache(config.CACHE_SHARED_DIR, durable=True)
+    elif backend == "redis":
+        shared = RedisCache(config.CACHE_REDIS_URL, config.CACHE_KEY_PREFIX)
+    else:
+        raise ValueError(f"Unknown cache backend: {backend}")
+
+    # CACHE_NEAR_MAX_BYTES=0 时本地层不保存任何条目，只负责隔离后端故障
+    return NearCache(shared, config.CACHE_NEAR_MAX_BYTES, config.CACHE_NEAR_TTL, config.CACHE_NEAR_SKIP_PREFIXES)
+
+
+# 全局缓存实例（鸟类图片和分析结果共用）
+cache = create_cache(config.CACHE_BACKEND)
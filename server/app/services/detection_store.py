@@ -0,0 +1,354 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+from .. import config
+from ..utils.detection_table import DetectionTable
+
+logger = logging.getLogger(__name__)
+
+# 录音机常见的文件名时间戳，如 AudioMoth 的 20240501_053000.WAV
+_FILENAME_TIMESTAMP = re.compile(r"(\d{8})[_T-]?(\d{6})")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS species (
+    id INTEGER PRIMARY KEY,
+    scientific_name TEXT NOT NULL UNIQUE,
+    common_name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    analysis_id TEXT NOT NULL UNIQUE,
+    file_name TEXT NOT NULL,
+    client TEXT,
+    model TEXT,
+    recorded_at REAL NOT NULL,
+    duration REAL NOT NULL,
+    detections INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_recordings_recorded_at ON recordings (recorded_at);
+CREATE TABLE IF NOT EXISTS detections (
+    recording_id INTEGER NOT NULL,
+    species_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL,
+    confidence REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_detections_species_ts ON detections (species_id, ts);
+CREATE INDEX IF NOT EXISTS idx_detections_ts ON detections (ts);
+CREATE INDEX IF NOT EXISTS idx_detections_recording ON detections (recording_id);
+CREATE TABLE IF NOT EXISTS hourly_rollup (
+    hour INTEGER NOT NULL,
+    species_id INTEGER NOT NULL,
+    detections INTEGER NOT NULL,
+    confidence_sum REAL NOT NULL,
+    PRIMARY KEY (hour, species_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_hourly_rollup_species ON hourly_rollup (species_id, hour);
+"""
+
+
+def recording_time(file_name: str, default: Optional[float] = None) -> float:
+    """
+    推断录音开始时间（Unix 秒）
+
+    优先使用文件名中的时间戳（YYYYMMDD_HHMMSS，按 UTC 解释），否则使用 default（默认当前时间）
+    """
+    match = _FILENAME_TIMESTAMP.search(Path(file_name).stem)
+    if match:
+        try:
+            parsed = datetime.strptime(match.group(1) + match.group(2), "%Y%m%d%H%M%S")
+            return parsed.replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            pass
+    return time.time() if default is None else default
+
+
+def to_timestamp(value: Optional[datetime]) -> Optional[float]:
+    """datetime 转 Unix 秒（无时区时按 UTC）"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _hour_iso(hour: int) -> str:
+    return datetime.fromtimestamp(hour * 3600, tz=timezone.utc).isoformat()
+
+
+class DetectionStore:
+    """
+    持久化的检测结果存储（SQLite，WAL 模式）
+
+    - detections 按 (物种, 时间)、时间、录音建索引，可以按物种和时间段快速查询明细
+    - hourly_rollup 在写入时增量维护 (小时, 物种) 的检测数和置信度之和，
+      物种统计、排行和逐小时统计只扫描汇总表，明细达到千万行时仍是毫秒级
+    - 写入由单个后台线程串行执行，不阻塞请求；读取每个线程使用独立连接
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._local = threading.local()
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._species_ids: Dict[str, int] = {}
+        self._initialized = False
+
+    def add(
+        self,
+        analysis_id: str,
+        file_name: str,
+        table: DetectionTable,
+        duration: float,
+        recorded_at: Optional[float] = None,
+        model: str = "",
+        client: str = ""
+    ) -> int:
+        """
+        写入一次分析的检测结果（同一 analysis_id 再次写入时替换旧结果）
+
+        Args:
+            analysis_id: 分析ID
+            file_name: 原始文件名
+            table: 检测结果
+            duration: 录音时长（秒）
+            recorded_at: 录音开始时间（Unix 秒），None 时由文件名或当前时间推断
+            model: 模型ID
+            client: 客户端标识
+
+        Returns:
+            录音记录ID
+        """
+        recorded_at = recording_time(file_name) if recorded_at is None else recorded_at
+        conn = self._connection()
+        with conn:
+            existing = conn.execute("SELECT id FROM recordings WHERE analysis_id = ?", (analysis_id,)).fetchone()
+            if existing:
+                self._delete_recording(conn, existing[0])
+
+            new_species: Dict[str, int] = {}
+            species_ids = [self._species_id(conn, sci, common, new_species) for sci, common in table.species]
+            cursor = conn.execute(
+                "INSERT INTO recordings (analysis_id, file_name, client, model, recorded_at, duration, detections, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (analysis_id, file_name, client, model, recorded_at, float(duration), len(table), time.time())
+            )
+            recording_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO detections (recording_id, species_id, ts, start, end, confidence) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (recording_id, species_ids[idx], recorded_at + start, start, end, conf)
+                    for start, end, idx, conf in zip(
+                        table.start.tolist(),
+                        table.end.tolist(),
+                        table.species_index.tolist(),
+                        table.confidence.tolist(),
+                    )
+                )
+            )
+            conn.execute(
+                "INSERT INTO hourly_rollup (hour, species_id, detections, confidence_sum) "
+                "SELECT CAST(ts / 3600 AS INTEGER), species_id, COUNT(*), SUM(confidence) "
+                "FROM detections WHERE recording_id = ? GROUP BY 1, 2 "
+                "ON CONFLICT (hour, species_id) DO UPDATE SET "
+                "detections = detections + excluded.detections, "
+                "confidence_sum = confidence_sum + excluded.confidence_sum",
+                (recording_id,)
+            )
+        # 事务提交后才缓存新物种的ID
+        self._species_ids.update(new_species)
+        return recording_id
+
+    def add_async(self, *args, **kwargs) -> Future:
+        """在后台写入线程中执行 add（失败只记录日志）"""
+        with self._lock:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(1, thread_name_prefix="detection-store")
+        future = self._writer.submit(self.add, *args, **kwargs)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    def close(self):
+        """等待未完成的写入并关闭写入线程"""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.shutdown(wait=True)
+
+    def species_counts(self, start: Optional[float], end: Optional[float], limit: int) -> List[dict]:
+        """时间段内各物种的检测数（降序，按小时对齐）"""
+        hour_from, hour_to = self._hour_range(start, end)
+        rows = self._connection().execute(
+            "SELECT s.scientific_name, s.common_name, SUM(r.detections) AS n, SUM(r.confidence_sum) / SUM(r.detections) "
+            "FROM hourly_rollup r JOIN species s ON s.id = r.species_id "
+            "WHERE r.hour BETWEEN ? AND ? GROUP BY r.species_id ORDER BY n DESC LIMIT ?",
+            (hour_from, hour_to, limit)
+        ).fetchall()
+        return [
+            {"scientificName": sci, "commonName": common, "detections": n, "meanConfidence": round(mean, 4)}
+            for sci, common, n, mean in rows
+        ]
+
+    def hourly_counts(
+        self,
+        start: Optional[float],
+        end: Optional[float],
+        species: Optional[str] = None,
+        hour_of_day: bool = False,
+        utc_offset: int = 0
+    ) -> List[dict]:
+        """
+        逐小时检测数
+
+        Args:
+            hour_of_day: True 时按一天中的小时（0-23，按 utc_offset 小时换算为当地时间）汇总
+            species: 只统计该物种（学名）
+        """
+        hour_from, hour_to = self._hour_range(start, end)
+        conn = self._connection()
+        where, params = "r.hour BETWEEN ? AND ?", [hour_from, hour_to]
+        if species:
+            species_id = self._lookup_species(conn, species)
+            if species_id is None:
+                return []
+            where += " AND r.species_id = ?"
+            params.append(species_id)
+
+        if hour_of_day:
+            rows = conn.execute(
+                f"SELECT ((r.hour + ?) % 24 + 24) % 24 AS h, SUM(r.detections) FROM hourly_rollup r "
+                f"WHERE {where} GROUP BY h ORDER BY h",
+                [utc_offset] + params
+            ).fetchall()
+            return [{"hourOfDay": h, "detections": n} for h, n in rows]
+
+        rows = conn.execute(
+            f"SELECT r.hour, SUM(r.detections) FROM hourly_rollup r WHERE {where} GROUP BY r.hour ORDER BY r.hour",
+            params
+        ).fetchall()
+        return [{"hour": _hour_iso(h), "detections": n} for h, n in rows]
+
+    def detections(
+        self,
+        species: str,
+        start: Optional[float],
+        end: Optional[float],
+        min_conf: float,
+        limit: int
+    ) -> List[dict]:
+        """某物种在时间段内的检测明细（按时间倒序，使用 (物种, 时间) 索引）"""
+        conn = self._connection()
+        species_id = self._lookup_species(conn, species)
+        if species_id is None:
+            return []
+        rows = conn.execute(
+            "SELECT d.ts, d.start, d.end, d.confidence, r.analysis_id, r.file_name "
+            "FROM detections d JOIN recordings r ON r.id = d.recording_id "
+            "WHERE d.species_id = ? AND d.ts BETWEEN ? AND ? AND d.confidence >= ? "
+            "ORDER BY d.ts DESC LIMIT ?",
+            (species_id, start if start is not None else 0.0, end if end is not None else 1e12, min_conf, limit)
+        ).fetchall()
+        return [
+            {
+                "time": datetime.fromtimestamp(ts, tz=timezone.utc).isoformat(),
+                "start": round(s, 3),
+                "end": round(e, 3),
+                "confidence": round(conf, 4),
+                "analysisId": analysis_id,
+                "fileName": file_name,
+            }
+            for ts, s, e, conf, analysis_id, file_name in rows
+        ]
+
+    def summary(self) -> dict:
+        """总录音数、总时长、总检测数和物种数"""
+        conn = self._connection()
+        recordings, duration, first, last = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(duration), 0), MIN(recorded_at), MAX(recorded_at) FROM recordings"
+        ).fetchone()
+        detections, species = conn.execute(
+            "SELECT COALESCE(SUM(detections), 0), COUNT(DISTINCT species_id) FROM hourly_rollup WHERE detections > 0"
+        ).fetchone()
+        return {
+            "recordings": recordings,
+            "audioHours": round(duration / 3600, 2),
+            "detections": detections,
+            "species": species,
+            "firstRecording": datetime.fromtimestamp(first, tz=timezone.utc).isoformat() if first else None,
+            "lastRecording": datetime.fromtimestamp(last, tz=timezone.utc).isoformat() if last else None,
+        }
+
+    def _connection(self) -> sqlite3.Connection:
+        """当前线程的连接（首次使用时建表）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA cache_size=-65536")  # 64MB
+            conn.execute("PRAGMA mmap_size=268435456")  # 256MB
+            with self._lock:
+                if not self._initialized:
+                    conn.executescript(_SCHEMA)
+                    self._initialized = True
+                    logger.info(f"Detection store opened: {self.path}")
+            self._local.conn = conn
+        return conn
+
+    def _species_id(self, conn: sqlite3.Connection, scientific_name: str, common_name: str, new_species: Dict[str, int]) -> int:
+        species_id = self._species_ids.get(scientific_name) or new_species.get(scientific_name)
+        if species_id is None:
+            conn.execute(
+                "INSERT OR IGNORE INTO species (scientific_name, common_name) VALUES (?, ?)",
+                (scientific_name, common_name)
+            )
+            species_id = conn.execute(
+                "SELECT id FROM species WHERE scientific_name = ?", (scientific_name,)
+            ).fetchone()[0]
+            new_species[scientific_name] = species_id
+        return species_id
+
+    def _lookup_species(self, conn: sqlite3.Connection, scientific_name: str) -> Optional[int]:
+        row = conn.execute(
+            "SELECT id FROM species WHERE scientific_name = ? COLLATE NOCASE", (scientific_name.strip(),)
+        ).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _delete_recording(conn: sqlite3.Connection, recording_id: int):
+        """删除一条录音的检测结果，并从小时汇总中扣除"""
+        conn.execute(
+            "UPDATE hourly_rollup SET detections = hourly_rollup.detections - d.n, "
+            "confidence_sum = hourly_rollup.confidence_sum - d.c "
+            "FROM (SELECT CAST(ts / 3600 AS INTEGER) AS h, species_id, COUNT(*) AS n, SUM(confidence) AS c "
+            "      FROM detections WHERE recording_id = ? GROUP BY 1, 2) AS d "
+            "WHERE hourly_rollup.hour = d.h AND hourly_rollup.species_id = d.species_id",
+            (recording_id,)
+        )
+        conn.execute("DELETE FROM hourly_rollup WHERE detections <= 0")
+        conn.execute("DELETE FROM detections WHERE recording_id = ?", (recording_id,))
+        conn.execute("DELETE FROM recordings WHERE id = ?", (recording_id,))
+
+    @staticmethod
+    def _hour_range(start: Optional[float], end: Optional[float]):
+        hour_from = int(start // 3600) if start is not None else 0
+        hour_to = int(end // 3600) if end is not None else 2 ** 40
+        return hour_from, hour_to
+
+    @staticmethod
+    def _log_failure(future: Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Failed to store detections: {future.exception()}")
+
+
+# 全局检测结果存储实例
+detection_store = DetectionStore(config.DETECTION_STORE_PATH)
@@ -0,0 +1,141 @@
+import logging
+import mmap
+import struct
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+import numpy as np
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+# 文件格式（小端）：
+#   头部   magic(8) | version(u32) | count(u32) | index_offset(u64)
+#   数据区 各图片内容依次排列
+#   索引区 count 条记录，按 key 升序：key(16 字节，学名的 MD5) | offset(u64) | length(u32) | ext(u8) | 填充(3)
+MAGIC = b"BEIMGPK\0"
+VERSION = 1
+_HEADER = struct.Struct("<8sIIQ")
+INDEX_DTYPE = np.dtype([("key", "S16"), ("offset", "<u8"), ("length", "<u4"), ("ext", "u1"), ("pad", "V3")])
+EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".svg", ".gif")
+
+
+class ImagePack:
+    """
+    构建镜像时预先打包的物种图片（见 build_image_pack.py）
+
+    整个文件内存映射，索引是按 key 排序的定长记录，查找是一次二分查找，
+    图片内容直接从映射切片返回，由操作系统页缓存在进程间共享。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, count, index_offset = _HEADER.unpack_from(self._mmap, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not an image pack (version {VERSION})")
+            self._index = np.frombuffer(self._mmap, dtype=INDEX_DTYPE, count=count, offset=index_offset)
+        except BaseException:
+            self._mmap.close()
+            self._file.close()
+            raise
+        self._keys = self._index["key"]
+        logger.info(f"Image pack loaded: {path} ({count} images, {path.stat().st_size / 1024 / 1024:.1f} MB)")
+
+    def __len__(self) -> int:
+        return int(self._index.shape[0])
+
+    def find(self, key: str) -> Optional[Tuple[int, str]]:
+        """
+        查找图片
+
+        Args:
+            key: 学名的 MD5（十六进制）
+
+        Returns:
+            (记录位置, 文件扩展名)，不在包中时返回 None
+        """
+        try:
+            raw = bytes.fromhex(key)
+        except ValueError:
+            return None
+        i = int(np.searchsorted(self._keys, raw))
+        if i >= len(self) or self._keys[i] != raw:
+            return None
+        return i, EXTENSIONS[self._index["ext"][i]]
+
+    def ext(self, key: str) -> Optional[str]:
+        """图片的文件扩展名，不在包中时返回 None"""
+        found = self.find(key)
+        return found[1] if found is not None else None
+
+    def read(self, key: str) -> Optional[bytes]:
+        """读取图片内容，不在包中时返回 None"""
+        found = self.find(key)
+        if found is None:
+            return None
+        record = self._index[found[0]]
+        offset = int(record["offset"])
+        return self._mmap[offset:offset + int(record["length"])]
+
+    def close(self):
+        self._index = None
+        self._keys = None
+        self._mmap.close()
+        self._file.close()
+
+    @staticmethod
+    def open(path: Path) -> Optional["ImagePack"]:
+        """打开图片包，文件不存在或格式不对时返回 None"""
+        if not path.exists():
+            return None
+        try:
+            return ImagePack(path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"Failed to load image pack {path}: {e}")
+            return None
+
+
+def write_pack(path: Path, images: Iterable[Tuple[str, str, bytes]]):
+    """
+    写入图片包（先写临时文件再替换）
+
+    Args:
+        path: 输出路径
+        images: (学名 MD5, 文件扩展名, 图片内容)
+    """
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    records = []
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(b"\0" * _HEADER.size)
+            for key, ext, data in images:
+                ext = ext.lower()
+                records.append((bytes.fromhex(key), f.tell(), len(data), EXTENSIONS.index(ext) if ext in EXTENSIONS else 0))
+                f.write(data)
+
+            index = np.zeros(len(records), dtype=INDEX_DTYPE)
+            if records:
+                keys, offsets, lengths, exts = zip(*records)
+                index["key"] = keys
+                index["offset"] = offsets
+                index["length"] = lengths
+                index["ext"] = exts
+            index.sort(order="key")
+            if len(index) > 1 and (index["key"][1:] == index["key"][:-1]).any():
+                raise ValueError("Duplicate keys in image pack")
+
+            index_offset = f.tell()
+            f.write(index.tobytes())
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, VERSION, len(index), index_offset))
+    except BaseException:
+        # 写入失败时保留原有的图片包
+        tmp_path.unlink(missing_ok=True)
+        raise
+    tmp_path.replace(path)
+
+
+# 全局图片包实例（IMAGE_PACK_PATH 不存在时为 None）
+image_pack = ImagePack.open(config.IMAGE_PACK_PATH)
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+from typing import Iterable, List, Optional, Set
+from .. import config
+from .bird_image_service import bird_image_service
+
+logger = logging.getLogger(__name__)
+
+
+class ImagePrefetcher:
+    """
+    物种图片的后台预取
+
+    分析得到物种列表后立即把学名放入有界队列，由固定数量的协程调用图片服务写入缓存，
+    客户端拿到结果再请求 /api/bird-image 时通常已经命中缓存（仍在获取中的会共用同一次查询）。
+    队列满时直接丢弃，预取永远不会拖慢分析请求。
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._pending: Set[str] = set()
+        self._stats = {"enqueued": 0, "dropped": 0, "fetched": 0, "failed": 0}
+
+    def start(self):
+        """启动预取协程（需在事件循环中调用）"""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Image prefetcher started ({self.workers} workers, queue {self.queue_size})")
+
+    async def stop(self):
+        """停止预取协程，丢弃排队中的物种"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._pending.clear()
+        logger.info("Image prefetcher stopped")
+
+    def enqueue(self, scientific_names: Iterable[str]) -> int:
+        """
+        把物种加入预取队列（非阻塞，需在事件循环线程中调用）
+
+        Returns:
+            实际加入队列的物种数（已在队列中的不重复加入）
+        """
+        if self._queue is None:
+            return 0
+        added = 0
+        for name in scientific_names:
+            if name in self._pending:
+                continue
+            try:
+                self._queue.put_nowait(name)
+            except asyncio.QueueFull:
+                self._stats["dropped"] += 1
+                continue
+            self._pending.add(name)
+            added += 1
+        self._stats["enqueued"] += added
+        return added
+
+    def stats(self) -> dict:
+        return {
+            "running": self._queue is not None,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            **self._stats
+        }
+
+    async def _worker(self):
+        while True:
+            name = await self._queue.get()
+            try:
+                await bird_image_service.image_url(name)
+                self._stats["fetched"] += 1
+            except Exception as e:
+                self._stats["failed"] += 1
+                logger.warning(f"Image prefetch failed for {name}: {e}")
+            finally:
+                self._pending.discard(name)
+                self._queue.task_done()
+
+
+# 全局图片预取实例
+image_prefetcher = ImagePrefetcher(config.IMAGE_PREFETCH_WORKERS, config.IMAGE_PREFETCH_QUEUE_SIZE)
@@ -0,0 +1,386 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+import birdnet_analyzer
+from birdnet_analyzer import config as birdnet_cfg
+from .. import config
+
+try:
+    import tflite_runtime.interpreter as tflite
+except ModuleNotFoundError:
+    from tensorflow import lite as tflite
+
+logger = logging.getLogger(__name__)
+
+# 内置模型：(ID, 模型文件名, 说明)，与 BirdNET 官方模型放在同一目录
+_BUILTIN_VARIANTS = [
+    ("global-fp16", "BirdNET_GLOBAL_6K_V2.4_Model_FP16.tflite", "BirdNET V2.4 全球模型（FP16）"),
+    ("global-int8", "BirdNET_GLOBAL_6K_V2.4_Model_INT8.tflite", "BirdNET V2.4 全球模型（INT8）"),
+]
+
+
+def _package_path(path: str) -> Path:
+    """BirdNET 配置中的相对路径以 birdnet_analyzer 包目录为基准"""
+    resolved = Path(path)
+    if not resolved.is_absolute():
+        resolved = Path(birdnet_analyzer.__file__).parent / resolved
+    return resolved
+
+
+class ModelSpec:
+    """
+    可选模型的描述（不加载解释器）
+
+    - model_path / labels_path: TFLite 模型和 "学名_俗名" 标签文件
+    - embeddings: 是否可以提取与全球模型同一空间的嵌入向量（自定义分类器不支持）
+    """
+
+    def __init__(self, model_id: str, model_path: Path, labels_path: Path, description: str = "", embeddings: bool = True):
+        self.id = model_id
+        self.model_path = model_path
+        self.labels_path = labels_path
+        self.description = description
+        self.embeddings = embeddings
+        self._species: Optional[List[Tuple[str, str]]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def species(self) -> List[Tuple[str, str]]:
+        """物种表 [(学名, 俗名), ...]，顺序与模型输出列一致"""
+        if self._species is None:
+            with self._lock:
+                if self._species is None:
+                    self._species = self._load_species()
+        return self._species
+
+    def _load_species(self) -> List[Tuple[str, str]]:
+        species = []
+        for line in self.labels_path.read_text(encoding="utf-8").splitlines():
+            if not line.strip():
+                continue
+            scientific_name, _, common_name = line.strip().partition("_")
+            species.append((scientific_name, common_name or scientific_name))
+        logger.info(f"Loaded {len(species)} species labels for model {self.id} from {self.labels_path}")
+        return species
+
+
+class TFLiteInterpreter:
+    """单个 TFLite 解释器（同一时间只能被一个线程使用）"""
+
+    def __init__(self, model_path: Path, num_threads: Optional[int] = None):
+        self.interpreter = tflite.Interpreter(
+            model_path=str(model_path),
+            num_threads=num_threads or config.TFLITE_THREADS
+        )
+        self.interpreter.allocate_tensors()
+        self.input_index = self.interpreter.get_input_details()[0]["index"]
+        self.output_index = self.interpreter.get_output_details()[0]["index"]
+        # BirdNET 的嵌入是分类层之前一层的输出
+        self.embeddings_index = self.output_index - 1
+        self._batch_size = 1
+        self.nbytes = self._tensor_bytes()
+
+    def run(self, batch: np.ndarray, output_index: int) -> np.ndarray:
+        """推理一个批次，返回指定输出张量"""
+        self.invoke(batch)
+        return self.interpreter.get_tensor(output_index)
+
+    def invoke(self, batch: np.ndarray):
+        """推理一个批次（批大小变化时才重新分配张量），之后可用 get_tensor 读取任意输出"""
+        if batch.shape[0] != self._batch_size:
+            self.interpreter.resize_tensor_input(self.input_index, list(batch.shape))
+            self.interpreter.allocate_tensors()
+            self._batch_size = batch.shape[0]
+            self.nbytes = self._tensor_bytes()
+        self.interpreter.set_tensor(self.input_index, batch)
+        self.interpreter.invoke()
+
+    def _tensor_bytes(self) -> int:
+        """估算内存占用：全部张量（权重 + 激活）的字节数"""
+        total = 0
+        for detail in self.interpreter.get_tensor_details():
+            total += int(np.prod(detail["shape"])) * np.dtype(detail["dtype"]).itemsize
+        return total
+
+
+class LoadedModel:
+    """
+    已加载的模型：MODEL_INTERPRETERS 个解释器组成的池，
+    每个推理线程独占一个解释器，不再需要全局锁
+    """
+
+    def __init__(self, spec: ModelSpec):
+        self.spec = spec
+        self.in_use = 0
+        self.load_time = 0.0
+        self.warmup_time = 0.0
+        self.segments = 0
+        self.inference_time = 0.0
+        self.last_used = time.time()
+        self._pool: "queue.Queue[TFLiteInterpreter]" = queue.Queue()
+        self._interpreters: List[TFLiteInterpreter] = []
+        self._lock = threading.Lock()
+
+        start_time = time.time()
+        for _ in range(max(config.MODEL_INTERPRETERS, 1)):
+            self._interpreters.append(TFLiteInterpreter(spec.model_path))
+        self.load_time = time.time() - start_time
+
+        # 预热：首次 invoke 会做算子准备并按批大小分配张量，每个解释器都在加载时完成，
+        # 并发请求借到任何一个解释器都不会在首个批次上多等
+        start_time = time.time()
+        samples = int(birdnet_cfg.SAMPLE_RATE * birdnet_cfg.SIG_LENGTH)
+        batch = np.zeros((max(config.INFERENCE_BATCH_SIZE, 1), samples), dtype=np.float32)
+        for item in self._interpreters:
+            item.run(batch, item.output_index)
+            self._pool.put(item)
+        self.warmup_time = time.time() - start_time
+
+    @property
+    def memory_bytes(self) -> int:
+        """全部解释器的估算内存"""
+        return sum(item.nbytes for item in self._interpreters)
+
+    @contextmanager
+    def interpreter(self) -> Iterator[TFLiteInterpreter]:
+        """借用一个解释器，都在使用中时等待"""
+        item = self._pool.get()
+        try:
+            yield item
+        finally:
+            self._pool.put(item)
+
+    def run(self, batch: np.ndarray, embeddings: bool = False) -> np.ndarray:
+        """推理一个批次，返回 logits 或嵌入向量"""
+        start_time = time.time()
+        with self.interpreter() as item:
+            output = item.run(batch, item.embeddings_index if embeddings else item.output_index)
+        self._record(batch.shape[0] if not embeddings else 0, start_time)
+        return output
+
+    def run_with_embeddings(self, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """推理一个批次，一次 invoke 同时返回 logits 和嵌入向量"""
+        start_time = time.time()
+        with self.interpreter() as item:
+            item.invoke(batch)
+            logits = item.interpreter.get_tensor(item.output_index)
+            embeddings = item.interpreter.get_tensor(item.embeddings_index)
+        self._record(batch.shape[0], start_time)
+        return logits, embeddings
+
+    def _record(self, segments: int, start_time: float):
+        with self._lock:
+            self.inference_time += time.time() - start_time
+            self.segments += segments
+            self.last_used = time.time()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": True,
+                "loadTime": round(self.load_time, 3),
+                "warmupTime": round(self.warmup_time, 3),
+                "memoryBytes": self.memory_bytes,
+                "interpreters": len(self._interpreters),
+                "inUse": self.in_use,
+                "segments": self.segments,
+                "inferenceTime": round(self.inference_time, 3),
+                "lastUsed": self.last_used,
+            }
+
+
+class ModelRegistry:
+    """
+    模型注册表
+
+    - 内置 BirdNET 全球模型（global）及其精度变体，MODELS_DIR 中的自定义分类器按文件名注册
+    - 首次使用时才加载解释器并预热
+    - 已加载模型按最近使用排序，总内存超过 MODEL_CACHE_MAX_BYTES 时卸载最久未用且空闲的模型
+    """
+
+    def __init__(self, max_bytes: int, models_dir: Path, default_model: str):
+        self.max_bytes = max_bytes
+        self.models_dir = models_dir
+        self.default_model = default_model
+        self._specs: Optional[Dict[str, ModelSpec]] = None
+        self._loaded: "OrderedDict[str, LoadedModel]" = OrderedDict()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    @property
+    def specs(self) -> Dict[str, ModelSpec]:
+        """全部可选模型（首次访问时扫描）"""
+        if self._specs is None:
+            with self._lock:
+                if self._specs is None:
+                    self._specs = self._discover()
+        return self._specs
+
+    def resolve(self, model_id: Optional[str]) -> str:
+        """
+        解析模型ID，None 表示默认模型
+
+        Raises:
+            KeyError: 模型不存在
+        """
+        model_id = model_id or self.default_model
+        if model_id not in self.specs:
+            raise KeyError(model_id)
+        return model_id
+
+    def spec(self, model_id: Optional[str] = None) -> ModelSpec:
+        return self.specs[self.resolve(model_id)]
+
+    def species(self, model_id: Optional[str] = None) -> List[Tuple[str, str]]:
+        """模型的物种表（只读标签文件，不加载解释器）"""
+        return self.spec(model_id).species
+
+    def predict(self, model_id: Optional[str], batch: np.ndarray) -> np.ndarray:
+        """推理一个批次，返回 logits"""
+        with self._use(model_id) as model:
+            return model.run(batch)
+
+    def embeddings(self, model_id: Optional[str], batch: np.ndarray) -> np.ndarray:
+        """提取一个批次的嵌入向量"""
+        with self._use(model_id) as model:
+            return model.run(batch, embeddings=True)
+
+    def predict_with_embeddings(self, model_id: Optional[str], batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """推理一个批次，同时返回 logits 和嵌入向量（只 invoke 一次）"""
+        with self._use(model_id) as model:
+            return model.run_with_embeddings(batch)
+
+    def record_request(self, model_id: Optional[str]):
+        """记录一次使用该模型的分析请求"""
+        model_id = self.resolve(model_id)
+        with self._lock:
+            self._stats.setdefault(model_id, {"requests": 0, "loads": 0, "evictions": 0})["requests"] += 1
+
+    def preload(self, model_ids: Sequence[str]):
+        """加载并预热指定模型（启动时调用）"""
+        for model_id in model_ids:
+            try:
+                with self._use(model_id):
+                    pass
+            except Exception as e:
+                logger.warning(f"Model preload failed for {model_id}: {e}")
+
+    def stats(self) -> List[dict]:
+        """每个模型的描述、加载状态和使用统计"""
+        with self._lock:
+            loaded = dict(self._loaded)
+            counters = {k: dict(v) for k, v in self._stats.items()}
+        result = []
+        for model_id, spec in self.specs.items():
+            item = {
+                "id": model_id,
+                "description": spec.description,
+                "default": model_id == self.default_model,
+                "embeddings": spec.embeddings,
+                "fileBytes": spec.model_path.stat().st_size if spec.model_path.exists() else None,
+                **counters.get(model_id, {"requests": 0, "loads": 0, "evictions": 0}),
+            }
+            item.update(loaded[model_id].stats() if model_id in loaded else {"loaded": False})
+            result.append(item)
+        return result
+
+    @contextmanager
+    def _use(self, model_id: Optional[str]) -> Iterator[LoadedModel]:
+        """获取已加载的模型（必要时加载），使用期间不会被卸载"""
+        model_id = self.resolve(model_id)
+        model = self._acquire(model_id)
+        try:
+            yield model
+        finally:
+            with self._lock:
+                model.in_use -= 1
+            self._evict()
+
+    def _acquire(self, model_id: str) -> LoadedModel:
+        with self._lock:
+            model = self._loaded.get(model_id)
+            if model is not None:
+                model.in_use += 1
+                self._loaded.move_to_end(model_id)
+                return model
+            load_lock = self._load_locks.setdefault(model_id, threading.Lock())
+
+        # 同一模型只加载一次，其他线程等待
+        with load_lock:
+            with self._lock:
+                model = self._loaded.get(model_id)
+                if model is not None:
+                    model.in_use += 1
+                    self._loaded.move_to_end(model_id)
+                    return model
+
+            spec = self.specs[model_id]
+            logger.info(f"Loading model {model_id} from {spec.model_path}")
+            model = LoadedModel(spec)
+            logger.info(
+                f"Model {model_id} loaded in {model.load_time:.2f}s, warm-up {model.warmup_time:.2f}s, "
+                f"~{model.memory_bytes / 1024 / 1024:.1f}MB"
+            )
+            with self._lock:
+                model.in_use += 1
+                self._loaded[model_id] = model
+                self._stats.setdefault(model_id, {"requests": 0, "loads": 0, "evictions": 0})["loads"] += 1
+        self._evict()
+        return model
+
+    def _evict(self):
+        """卸载最久未用的空闲模型，直到总内存不超过上限（至少保留一个）"""
+        with self._lock:
+            total = sum(m.memory_bytes for m in self._loaded.values())
+            for model_id in list(self._loaded):
+                if total <= self.max_bytes or len(self._loaded) <= 1:
+                    break
+                model = self._loaded[model_id]
+                if model.in_use:
+                    continue
+                del self._loaded[model_id]
+                total -= model.memory_bytes
+                self._stats.setdefault(model_id, {"requests": 0, "loads": 0, "evictions": 0})["evictions"] += 1
+                logger.info(f"Evicted model {model_id} (~{model.memory_bytes / 1024 / 1024:.1f}MB)")
+
+    def _discover(self) -> Dict[str, ModelSpec]:
+        """注册内置模型和 MODELS_DIR 中的自定义分类器"""
+        model_path = _package_path(birdnet_cfg.MODEL_PATH)
+        labels_path = _package_path(birdnet_cfg.LABELS_FILE)
+        specs = {"global": ModelSpec("global", model_path, labels_path, "BirdNET V2.4 全球模型（FP32）")}
+        for model_id, file_name, description in _BUILTIN_VARIANTS:
+            variant = model_path.parent / file_name
+            if variant.exists():
+                specs[model_id] = ModelSpec(model_id, variant, labels_path, description)
+
+        # BirdNET-Analyzer 训练的自定义分类器：xxx.tflite + xxx_Labels.txt
+        for path in sorted(self.models_dir.glob("*.tflite")):
+            labels = path.with_name(f"{path.stem}_Labels.txt")
+            if not labels.exists():
+                logger.warning(f"Skipping custom model {path.name}: {labels.name} not found")
+                continue
+            if path.stem in specs:
+                logger.warning(f"Skipping custom model {path.name}: id already registered")
+                continue
+            specs[path.stem] = ModelSpec(path.stem, path, labels, f"自定义分类器 {path.name}", embeddings=False)
+
+        if self.default_model not in specs:
+            logger.warning(f"Default model {self.default_model} not found, falling back to global")
+            self.default_model = "global"
+        logger.info(f"Registered models: {', '.join(specs)}")
+        return specs
+
+
+# 全局模型注册表实例
+model_registry = ModelRegistry(
+    max_bytes=config.MODEL_CACHE_MAX_BYTES,
+    models_dir=config.MODELS_DIR,
+    default_model=config.DEFAULT_MODEL,
+)
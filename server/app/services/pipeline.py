@@ -0,0 +1,472 @@
+import asyncio
+import logging
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Callable, Deque, Iterable, List, Optional, Tuple
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+from .. import config
+from ..utils.audio_converter import probe_duration
+from ..utils.audio_stream import iter_audio_blocks, iter_pcm_blocks
+from ..utils.cancellation import CancelToken
+from ..utils.row_buffer import RowBuffer
+from ..utils.visual_summary import SPILL_COLUMNS, VisualSummary
+from .birdnet_service import birdnet_service
+from .model_registry import model_registry
+from .scheduler import CLASS_BATCH, CLASS_INTERACTIVE, scheduler
+
+logger = logging.getLogger(__name__)
+
+# 无法读取文件头时按 128 kbps 估算时长
+_FALLBACK_BYTES_PER_SECOND = 16000
+
+
+class SubmittedBlocks:
+    """
+    submit_blocks 的结果
+
+    - futures: 按顺序排列的推理 Future（结果为该批次的排队时延）
+    - starts / duration: 片段起始时间和音频时长
+    - logits / embeddings: 推理输出缓冲区（批次完成时按片段序号写入）
+    - visual: 由同一批解码块计算的波形峰值和频谱图（VISUAL_ENABLED=false 时为 None）
+    """
+
+    def __init__(self, model_id: str, embeddings: bool):
+        self.futures: List[Future] = []
+        self.starts = np.empty(0, dtype=np.float32)
+        self.duration = 0.0
+        self.logits = RowBuffer(
+            np.float16, config.PIPELINE_SPILL_SEGMENTS, config.OUTPUT_DIR, len(model_registry.species(model_id))
+        )
+        self.embeddings = RowBuffer(np.float32, config.PIPELINE_SPILL_SEGMENTS, config.OUTPUT_DIR) if embeddings else None
+        self.visual: Optional[VisualSummary] = None
+        if config.VISUAL_ENABLED:
+            self.visual = VisualSummary(
+                birdnet_service.sample_rate,
+                config.WAVEFORM_PEAKS_PER_SECOND,
+                config.SPECTROGRAM_FFT_SIZE,
+                config.SPECTROGRAM_BINS,
+                config.SPECTROGRAM_MAX_FREQ,
+                config.SPECTROGRAM_DB_RANGE,
+                SPILL_COLUMNS,
+                config.OUTPUT_DIR
+            )
+
+    def close(self):
+        """取消未完成的批次并丢弃输出"""
+        for future in self.futures:
+            future.cancel()
+        self.logits.close()
+        if self.embeddings is not None:
+            self.embeddings.close()
+        if self.visual is not None:
+            self.visual.close()
+
+
+class AnalysisPipeline:
+    """
+    分阶段并行的分析流水线
+
+    - 解码阶段（DECODE_WORKERS 个线程）：按 SCHEDULER_BATCH_SEGMENTS 个片段一块顺序解码并切分，
+      每块解码完立即提交推理，长录音的后续块在前面的块推理时就已在解码
+    - 推理阶段（调度器工作线程）：按成本和客户端公平调度各个批次，输出按片段序号写入
+      RowBuffer，超过 PIPELINE_SPILL_SEGMENTS 个片段后转存到临时文件
+    - 后处理阶段（POSTPROCESS_WORKERS 个线程）：组装分数矩阵、阈值筛选、事件合并和序列化
+
+    解码与推理之间是有界队列：每个请求最多 PIPELINE_QUEUE_SIZE 个已解码但未推理完的批次，
+    推理跟不上时该请求的解码暂停并让出线程，批次完成后重新提交到解码线程池继续，
+    长录音的解码结果不会堆满内存，也不会占满解码线程挡住其他请求。
+    解码、切分和推理输出都与录音时长无关，峰值内存不随录音变长而增长。
+    """
+
+    def __init__(self):
+        self._decode_executor: Optional[ThreadPoolExecutor] = None
+        self._postprocess_executor: Optional[ThreadPoolExecutor] = None
+        # libsndfile 不能打开的格式由 ffmpeg 管道流式解码，不需要先转换为 WAV 文件
+        self.ffmpeg_decode = config.FFMPEG_STREAM_DECODE and shutil.which("ffmpeg") is not None
+
+    def start(self):
+        """创建解码和后处理线程池"""
+        if self._decode_executor is not None:
+            return
+        self._decode_executor = ThreadPoolExecutor(config.DECODE_WORKERS, thread_name_prefix="decode")
+        self._postprocess_executor = ThreadPoolExecutor(config.POSTPROCESS_WORKERS, thread_name_prefix="postprocess")
+        logger.info(
+            f"Analysis pipeline started (decode: {config.DECODE_WORKERS}, "
+            f"postprocess: {config.POSTPROCESS_WORKERS})"
+        )
+
+    def stop(self):
+        """关闭线程池（未开始的任务会被取消）"""
+        for executor in (self._decode_executor, self._postprocess_executor):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        self._decode_executor = None
+        self._postprocess_executor = None
+        logger.info("Analysis pipeline stopped")
+
+    async def analyze(
+        self,
+        input_path: Path,
+        session_id: str,
+        file_name: str,
+        client: str,
+        embeddings: bool = False,
+        token: Optional[CancelToken] = None,
+        model_id: Optional[str] = None
+    ) -> dict:
+        """
+        分析音频文件
+
+        Args:
+            input_path: 待分析的音频文件
+            session_id: 会话ID
+            file_name: 原始文件名
+            client: 客户端标识（公平排队的键）
+            embeddings: 是否同时提取片段嵌入
+            token: 取消令牌；取消时停止解码并丢弃排队中的批次
+            model_id: 模型ID，None 表示默认模型
+
+        Returns:
+            与 BirdNetService.analyze_audio 相同结构的字典，另含 "queue_delay"（首个推理批次的排队时延，秒）
+            和 "visual"（波形峰值和频谱图，VISUAL_ENABLED=false 时没有）
+        """
+        estimated = await run_in_threadpool(probe_duration, input_path)
+        if estimated is None:
+            estimated = self.estimate_duration(input_path.stat().st_size)
+        blocks = partial(
+            iter_audio_blocks,
+            input_path,
+            birdnet_service.sample_rate,
+            max(config.SCHEDULER_BATCH_SEGMENTS, 1) * birdnet_service.segment_length,
+            birdnet_service.load_audio,
+            self.ffmpeg_decode
+        )
+        return await self._analyze_blocks(blocks, estimated, session_id, file_name, client, embeddings, token, model_id)
+
+    async def analyze_pcm(
+        self,
+        frames: np.ndarray,
+        sample_rate: int,
+        session_id: str,
+        file_name: str,
+        client: str,
+        embeddings: bool = False,
+        token: Optional[CancelToken] = None,
+        model_id: Optional[str] = None
+    ) -> dict:
+        """
+        分析已解码的 PCM（不经过容器解码、子进程或临时文件）
+
+        Args:
+            frames: [帧数, 声道数] 的 PCM 数组（见 utils.audio_stream.pcm_frames）
+            sample_rate: PCM 的采样率，与模型采样率不同时流式重采样
+
+        其他参数和返回值同 analyze
+        """
+        blocks = partial(
+            iter_pcm_blocks,
+            frames,
+            sample_rate,
+            birdnet_service.sample_rate,
+            max(config.SCHEDULER_BATCH_SEGMENTS, 1) * birdnet_service.segment_length
+        )
+        estimated = frames.shape[0] / sample_rate
+        return await self._analyze_blocks(blocks, estimated, session_id, file_name, client, embeddings, token, model_id)
+
+    async def _analyze_blocks(
+        self,
+        blocks: Callable[[], Iterable[np.ndarray]],
+        estimated: float,
+        session_id: str,
+        file_name: str,
+        client: str,
+        embeddings: bool,
+        token: Optional[CancelToken],
+        model_id: Optional[str]
+    ) -> dict:
+        """在解码线程中迭代 blocks() 并提交推理，然后等待并组装结果"""
+        start_time = time.time()
+        model_id = model_registry.resolve(model_id)
+        model_registry.record_request(model_id)
+        token = token or CancelToken()
+        token.add_callback(lambda: scheduler.discard(token))
+
+        priority = self.priority_for(estimated)
+        logger.info(
+            f"[{session_id}] Scheduling analysis for {client}: ~{estimated:.1f}s audio, "
+            f"{'interactive' if priority == CLASS_INTERACTIVE else 'batch'}, model {model_id}"
+        )
+
+        # 1. 解码阶段：边解码边提交推理批次（名额用完时让出解码线程，批次完成后再继续）
+        submitter = _BlockSubmitter(blocks(), client, priority, embeddings, token, model_id, self._decode_executor)
+        submitted = await asyncio.wrap_future(submitter.start())
+
+        # 2. 推理和后处理阶段
+        return await self.collect(submitted, session_id, file_name, model_id, start_time)
+
+    @staticmethod
+    def priority_for(estimated_duration: Optional[float]) -> int:
+        """按估算时长（秒）选择调度优先级，时长未知时按批量请求处理"""
+        if estimated_duration is not None and estimated_duration <= config.INTERACTIVE_MAX_DURATION:
+            return CLASS_INTERACTIVE
+        return CLASS_BATCH
+
+    @staticmethod
+    def estimate_duration(size: int) -> float:
+        """无法读取文件头时按文件大小估算时长（秒）"""
+        return size / _FALLBACK_BYTES_PER_SECOND
+
+    async def collect(
+        self,
+        submitted: SubmittedBlocks,
+        session_id: str,
+        file_name: str,
+        model_id: str,
+        start_time: float
+    ) -> dict:
+        """
+        等待全部推理批次并组装结果
+
+        Args:
+            submitted: submit_blocks 的返回值
+            start_time: 分析开始时间（time.time()），用于计算分析耗时
+
+        Returns:
+            与 analyze 相同结构的字典
+        """
+        try:
+            queue_delays = await asyncio.gather(*(asyncio.wrap_future(f) for f in submitted.futures))
+            total = submitted.starts.shape[0]
+            logits = submitted.logits.finish(total)
+            segment_embeddings = None
+            if submitted.embeddings is not None and total:
+                segment_embeddings = submitted.embeddings.finish(total)
+            visual = submitted.visual.finish() if submitted.visual is not None else None
+        except BaseException:
+            submitted.close()
+            raise
+        if isinstance(logits, np.memmap):
+            logger.info(f"[{session_id}] Score matrix spilled to disk ({total} segments)")
+
+        result = await self.postprocess(
+            birdnet_service.assemble_result,
+            logits,
+            submitted.starts,
+            submitted.duration,
+            file_name,
+            session_id,
+            time.time() - start_time,
+            segment_embeddings,
+            model_id
+        )
+        result["queue_delay"] = queue_delays[0] if queue_delays else 0.0
+        if visual is not None:
+            result["visual"] = visual
+        return result
+
+    async def postprocess(self, fn: Callable, *args):
+        """在后处理线程池中执行 fn(*args)（阈值筛选、事件合并、序列化等 CPU 密集操作）"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._postprocess_executor, partial(fn, *args))
+
+    def submit_blocks(
+        self,
+        blocks: Iterable[np.ndarray],
+        client: str,
+        priority: int,
+        embeddings: bool,
+        token: CancelToken,
+        model_id: str
+    ) -> SubmittedBlocks:
+        """
+        切分解码后的音频块并逐批提交推理（阻塞调用，在上传会话自己的解码线程中执行）
+
+        已提交未完成的批次达到上限时在当前线程等待；线程池中的分析改用可恢复的
+        _BlockSubmitter，不占着池线程等待。blocks 是生成器时结束后会被关闭
+        （ffmpeg 等解码子进程随之退出）。
+
+        Args:
+            blocks: 48 kHz 单声道 float32 音频块
+            client: 客户端标识
+            priority: 调度优先级
+            embeddings: 是否同时提取片段嵌入
+            token: 取消令牌
+            model_id: 模型ID
+
+        Returns:
+            SubmittedBlocks，由 collect 等待并组装结果
+        """
+        return _BlockSubmitter(blocks, client, priority, embeddings, token, model_id).run()
+
+    @staticmethod
+    def _infer(
+        chunks: np.ndarray,
+        offset: int,
+        submitted: SubmittedBlocks,
+        model_id: str,
+        submitted_at: float
+    ) -> float:
+        """推理一个片段批次（在调度器工作线程中执行），输出写入缓冲区，返回该批次的排队时延"""
+        queue_delay = time.monotonic() - submitted_at
+        if submitted.embeddings is not None:
+            logits, segment_embeddings = birdnet_service.predict_with_embeddings(chunks, model_id)
+            submitted.embeddings.write(offset, segment_embeddings)
+        else:
+            logits = birdnet_service.predict_logits(chunks, model_id)
+        submitted.logits.write(offset, logits)
+        return queue_delay
+
+
+class _BlockSubmitter:
+    """
+    切分解码后的音频块并逐批提交推理的可恢复任务
+
+    step() 解码下一块、切分并提交批次，直到已提交未完成的批次达到 PIPELINE_QUEUE_SIZE：
+    此时记下暂停并返回，某个批次完成释放名额时再恢复（有线程池时把 step() 重新提交到池中，
+    否则唤醒 run() 所在的线程）。在线程池中每解码一块也会重新排队一次，多个请求轮流解码，
+    推理比解码快时长录音同样不会独占解码线程。同一时刻只有一个线程执行 step()。
+    结束后 future 得到 SubmittedBlocks；blocks 是生成器时会被关闭。
+    """
+
+    def __init__(
+        self,
+        blocks: Iterable[np.ndarray],
+        client: str,
+        priority: int,
+        embeddings: bool,
+        token: CancelToken,
+        model_id: str,
+        executor: Optional[ThreadPoolExecutor] = None
+    ):
+        self.blocks = blocks
+        self.client = client
+        self.priority = priority
+        self.token = token
+        self.model_id = model_id
+        self.executor = executor
+        self.submitted = SubmittedBlocks(model_id, embeddings)
+        self.future: Future = Future()
+        self._iterator = iter(blocks)
+        self._segmenter = birdnet_service.create_segmenter()
+        self._batch_segments = max(config.SCHEDULER_BATCH_SEGMENTS, 1)
+        self._slots = max(config.PIPELINE_QUEUE_SIZE, 1)
+        self._pending: Deque[Tuple[np.ndarray, np.ndarray]] = deque()  # 已切分、等待名额的批次
+        self._starts: List[np.ndarray] = []
+        self._offset = 0
+        self._exhausted = False
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._paused = False
+        self._failed = False
+        self._wake = threading.Event()
+
+    def start(self) -> Future:
+        """在线程池中开始执行"""
+        self.executor.submit(self.step)
+        return self.future
+
+    def run(self) -> SubmittedBlocks:
+        """在当前线程中执行，名额用完时等待批次完成"""
+        while True:
+            self._wake.clear()
+            self.step()
+            if self.future.done():
+                return self.future.result()
+            self._wake.wait()
+
+    def step(self):
+        """推进到名额用完或全部提交"""
+        try:
+            while not self._failed:
+                self.token.raise_if_cancelled()
+                if self._pending:
+                    with self._lock:
+                        if self._in_flight >= self._slots:
+                            self._paused = True
+                            return
+                        self._in_flight += 1
+                    self._submit(*self._pending.popleft())
+                elif self._exhausted:
+                    break
+                else:
+                    self._decode_next()
+                    if self.executor is not None:
+                        self._resume()
+                        return
+        except BaseException as e:
+            self._close_blocks()
+            self.submitted.close()
+            self.future.set_exception(e)
+            return
+
+        self._close_blocks()
+        if self._starts:
+            self.submitted.starts = np.concatenate(self._starts)
+        self.submitted.duration = self._segmenter.duration
+        self.future.set_result(self.submitted)
+
+    def _decode_next(self):
+        """解码下一块并切分为待提交的批次，没有更多块时切分尾部"""
+        block = next(self._iterator, None)
+        if block is None:
+            self._exhausted = True
+            chunks, chunk_starts = self._segmenter.finish()
+        else:
+            if self.submitted.visual is not None:
+                self.submitted.visual.feed(block)
+            chunks, chunk_starts = self._segmenter.feed(block)
+        for i in range(0, chunks.shape[0], self._batch_segments):
+            self._pending.append((chunks[i:i + self._batch_segments], chunk_starts[i:i + self._batch_segments]))
+
+    def _submit(self, batch: np.ndarray, batch_starts: np.ndarray):
+        """提交一个批次（调用方已占用名额）"""
+        future = scheduler.submit(
+            self.client,
+            batch.shape[0] * birdnet_service.segment_length,
+            partial(AnalysisPipeline._infer, batch, self._offset, self.submitted, self.model_id, time.monotonic()),
+            self.priority,
+            self.token
+        )
+        future.add_done_callback(self._on_done)
+        self.submitted.futures.append(future)
+        self._starts.append(batch_starts)
+        self._offset += batch.shape[0]
+
+    def _on_done(self, future: Future):
+        """批次完成（或被取消）：释放名额，暂停中时恢复"""
+        with self._lock:
+            self._in_flight -= 1
+            if future.cancelled() or future.exception() is not None:
+                self._failed = True
+            resume = self._paused
+            self._paused = False
+        if resume:
+            self._resume()
+
+    def _resume(self):
+        """继续执行 step()"""
+        if self.executor is None:
+            self._wake.set()
+            return
+        try:
+            self.executor.submit(self.step)
+        except RuntimeError as e:
+            # 线程池已关闭（服务停止）
+            self._close_blocks()
+            self.submitted.close()
+            self.future.set_exception(e)
+
+    def _close_blocks(self):
+        close = getattr(self.blocks, "close", None)
+        if close is not None:
+            close()
+
+
+# 全局流水线实例
+analysis_pipeline = AnalysisPipeline()
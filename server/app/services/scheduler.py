@@ -0,0 +1,223 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+from .. import config
+from ..utils.cancellation import AnalysisCancelled, CancelToken
+
+logger = logging.getLogger(__name__)
+
+# 优先级类别
+CLASS_INTERACTIVE = 0  # 短录音（手机录音等），优先调度
+CLASS_BATCH = 1        # 长录音
+
+
+class _Task:
+    """一个调度单元（通常是一批片段的推理）"""
+
+    __slots__ = ("client", "cost", "fn", "future", "finish_tag", "start_tag", "submitted_at", "token")
+
+    def __init__(
+        self,
+        client: str,
+        cost: float,
+        fn: Callable,
+        start_tag: float,
+        finish_tag: float,
+        token: Optional[CancelToken]
+    ):
+        self.client = client
+        self.cost = cost
+        self.fn = fn
+        self.future: Future = Future()
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.submitted_at = time.monotonic()
+        self.token = token
+
+
+class AnalysisScheduler:
+    """
+    分析任务调度器
+
+    - 两个优先级类别：交互请求（短录音）优先于批量请求（长录音）；
+      交互请求积压时，每 SCHEDULER_BATCH_SHARE 次调度至少给批量请求 1 次，避免饿死
+    - 类别内按客户端（IP 或 API Key）做加权公平排队：
+      每个任务按成本（音频秒数）计算虚拟完成时间，调度虚拟完成时间最小的任务，
+      因此同一客户端的大量任务不会挡住其他客户端
+    - 长任务由调用方切分为多个片段批次分别提交，不同客户端的批次可以交替执行
+    """
+
+    def __init__(self, workers: int, batch_share: int):
+        self.workers = max(workers, 1)
+        self.batch_share = max(batch_share, 1)
+        self._queues: List[list] = [[], []]
+        self._virtual_time = [0.0, 0.0]
+        self._client_finish: List[Dict[str, float]] = [defaultdict(float), defaultdict(float)]
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._running = False
+        self._dispatched_interactive = 0
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "discarded": 0}
+        self._last_wait = [0.0, 0.0]
+
+    def start(self):
+        """启动工作线程"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"analysis-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Analysis scheduler started ({self.workers} workers)")
+
+    def stop(self):
+        """停止工作线程（未执行的任务会被取消）"""
+        with self._cond:
+            self._running = False
+            pending = [entry[-1] for queue in self._queues for entry in queue]
+            self._queues = [[], []]
+            self._cond.notify_all()
+        for task in pending:
+            task.future.cancel()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+        logger.info("Analysis scheduler stopped")
+
+    def submit(
+        self,
+        client: str,
+        cost: float,
+        fn: Callable,
+        priority: int = CLASS_BATCH,
+        token: Optional[CancelToken] = None
+    ) -> Future:
+        """
+        提交一个调度单元
+
+        Args:
+            client: 客户端标识（用于公平排队）
+            cost: 估算成本（音频秒数）
+            fn: 要执行的函数（在工作线程中调用）
+            priority: CLASS_INTERACTIVE 或 CLASS_BATCH
+            token: 取消令牌，取消后该任务不再执行（见 discard）
+
+        Returns:
+            concurrent.futures.Future
+        """
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("Analysis scheduler is not running")
+            start_tag = max(self._virtual_time[priority], self._client_finish[priority][client])
+            finish_tag = start_tag + max(cost, 1e-3)
+            self._client_finish[priority][client] = finish_tag
+
+            task = _Task(client, cost, fn, start_tag, finish_tag, token)
+            heapq.heappush(self._queues[priority], (finish_tag, next(self._seq), task))
+            self._stats["submitted"] += 1
+            self._cond.notify()
+        return task.future
+
+    def discard(self, token: CancelToken) -> int:
+        """
+        从队列中移除属于某个取消令牌的全部任务并取消其 Future
+
+        Returns:
+            移除的任务数
+        """
+        with self._cond:
+            removed = []
+            for priority, queue in enumerate(self._queues):
+                kept = [entry for entry in queue if entry[-1].token is not token]
+                if len(kept) != len(queue):
+                    removed.extend(entry[-1] for entry in queue if entry[-1].token is token)
+                    heapq.heapify(kept)
+                    self._queues[priority] = kept
+            self._stats["discarded"] += len(removed)
+        for task in removed:
+            task.future.cancel()
+        if removed:
+            logger.info(f"Discarded {len(removed)} queued tasks")
+        return len(removed)
+
+    def stats(self) -> dict:
+        """调度器状态"""
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "queuedInteractive": len(self._queues[CLASS_INTERACTIVE]),
+                "queuedBatch": len(self._queues[CLASS_BATCH]),
+                "lastWaitInteractive": round(self._last_wait[CLASS_INTERACTIVE], 3),
+                "lastWaitBatch": round(self._last_wait[CLASS_BATCH], 3),
+                **self._stats
+            }
+
+    def _pop(self) -> Optional[_Task]:
+        """选出下一个任务（调用方持有锁）"""
+        interactive, batch = self._queues
+        if interactive and (not batch or self._dispatched_interactive < self.batch_share - 1):
+            priority = CLASS_INTERACTIVE
+            self._dispatched_interactive += 1
+        elif batch:
+            priority = CLASS_BATCH
+            self._dispatched_interactive = 0
+        else:
+            return None
+
+        _, _, task = heapq.heappop(self._queues[priority])
+        self._virtual_time[priority] = task.start_tag
+        self._last_wait[priority] = time.monotonic() - task.submitted_at
+
+        # 队列清空后保留虚拟时间和仍领先于它的完成标签（刚调度走的大任务仍计入该客户端），
+        # 只删除已不超过虚拟时间的标签：提交时会被钳制到虚拟时间，效果相同，字典不会无限增长
+        if not self._queues[priority]:
+            vtime = self._virtual_time[priority]
+            finish = self._client_finish[priority]
+            for client in [client for client, tag in finish.items() if tag <= vtime]:
+                del finish[client]
+        return task
+
+    def _worker(self):
+        """工作线程循环"""
+        while True:
+            with self._cond:
+                while self._running and not any(self._queues):
+                    self._cond.wait()
+                if not self._running:
+                    return
+                task = self._pop()
+
+            if task is None or not task.future.set_running_or_notify_cancel():
+                continue
+            if task.token is not None and task.token.cancelled:
+                task.future.set_exception(AnalysisCancelled())
+                self._count("discarded")
+                continue
+            try:
+                result = task.fn()
+            except BaseException as e:
+                task.future.set_exception(e)
+                self._count("failed")
+                continue
+            task.future.set_result(result)
+            self._count("completed")
+
+    def _count(self, name: str):
+        """更新统计计数（多个工作线程并发更新，需持有锁）"""
+        with self._cond:
+            self._stats[name] += 1
+
+
+# 全局调度器实例
+scheduler = AnalysisScheduler(
+    workers=config.ANALYSIS_WORKERS,
+    batch_share=config.SCHEDULER_BATCH_SHARE,
+)
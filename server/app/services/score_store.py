@@ -0,0 +1,104 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+from .. import config
+from ..utils.score_matrix import ScoreMatrix
+
+logger = logging.getLogger(__name__)
+
+# 分析 ID 只允许 uuid 风格字符，防止拼接出任意路径
+_ANALYSIS_ID_PATTERN = re.compile(r"^[0-9a-fA-F-]{8,64}$")
+
+
+class ScoreStore:
+    """
+    分析分数矩阵的临时存储（带 TTL）
+
+    - memory: 进程内保存，按常驻内存字节数上限淘汰最旧的矩阵（已落盘的内存映射 logits 不计入）
+    - disk: 保存为压缩 .npz 文件，适合长录音或内存紧张的部署
+    """
+
+    def __init__(self, backend: str, ttl: int, max_bytes: int, directory: Path):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._entries: "OrderedDict[str, Tuple[float, ScoreMatrix]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, analysis_id: str, matrix: ScoreMatrix):
+        """保存一次分析的分数矩阵"""
+        if not _ANALYSIS_ID_PATTERN.match(analysis_id):
+            raise ValueError(f"Invalid analysis id: {analysis_id}")
+
+        if self.backend == "disk":
+            matrix.save(self._path(analysis_id))
+            self._purge_disk()
+            return
+
+        with self._lock:
+            self._purge_memory()
+            if analysis_id in self._entries:
+                self._bytes -= self._entries.pop(analysis_id)[1].resident_nbytes
+            self._entries[analysis_id] = (time.time() + self.ttl, matrix)
+            self._bytes += matrix.resident_nbytes
+
+            # 超出内存上限时淘汰最旧的矩阵
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                evicted_id, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted.resident_nbytes
+                logger.info(f"Evicted score matrix {evicted_id} ({evicted.resident_nbytes} bytes)")
+
+    def get(self, analysis_id: str) -> Optional[ScoreMatrix]:
+        """获取分数矩阵，不存在或已过期时返回 None"""
+        if not _ANALYSIS_ID_PATTERN.match(analysis_id):
+            return None
+
+        if self.backend == "disk":
+            path = self._path(analysis_id)
+            if not path.exists() or time.time() - path.stat().st_mtime > self.ttl:
+                return None
+            return ScoreMatrix.load(path)
+
+        with self._lock:
+            entry = self._entries.get(analysis_id)
+            if entry is None:
+                return None
+            expires_at, matrix = entry
+            if expires_at < time.time():
+                self._bytes -= self._entries.pop(analysis_id)[1].resident_nbytes
+                return None
+            return matrix
+
+    def _path(self, analysis_id: str) -> Path:
+        return self.directory / f"{analysis_id}.npz"
+
+    def _purge_memory(self):
+        """清理过期的内存条目（调用方持有锁）"""
+        now = time.time()
+        for analysis_id in [k for k, (expires_at, _) in self._entries.items() if expires_at < now]:
+            self._bytes -= self._entries.pop(analysis_id)[1].resident_nbytes
+
+    def _purge_disk(self):
+        """清理过期的磁盘文件"""
+        now = time.time()
+        for path in self.directory.glob("*.npz"):
+            try:
+                if now - path.stat().st_mtime > self.ttl:
+                    path.unlink()
+            except OSError as e:
+                logger.warning(f"Failed to remove expired score file {path}: {e}")
+
+
+# 全局存储实例
+score_store = ScoreStore(
+    backend=config.SCORE_STORE_BACKEND,
+    ttl=config.SCORE_STORE_TTL,
+    max_bytes=config.SCORE_STORE_MAX_BYTES,
+    directory=config.SCORE_STORE_DIR,
+)
@@ -0,0 +1,389 @@
+import json
+import logging
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+import numpy as np
+from .. import config
+from ..utils.audio_converter import estimate_duration_from_header
+from ..utils.audio_stream import iter_f32_stream
+from ..utils.cancellation import CancelToken
+from .birdnet_service import birdnet_service
+from .model_registry import model_registry
+from .pipeline import analysis_pipeline
+from .scheduler import CLASS_INTERACTIVE, scheduler
+
+logger = logging.getLogger(__name__)
+
+# 边传边解码时每次从 ffmpeg 读取的块大小（秒）
+_STREAM_BLOCK_SECONDS = 9.0
+# 把文件新写入的部分送入 ffmpeg 时每次读取的字节数
+_FEED_READ_SIZE = 1 << 20
+# MP4 系列容器（M4A/MOV/3GP）的索引（moov）常在文件末尾，ffmpeg 不能从管道顺序解码
+_UNSTREAMABLE_EXTENSIONS = {".mp4", ".m4a", ".m4b", ".mov", ".3gp"}
+
+
+class StreamingDecoder:
+    """
+    上传过程中的增量解码
+
+    feeder 线程把已写入上传文件的字节送入 ffmpeg 的标准输入，decoder 线程从标准输出
+    读取 48 kHz 单声道 float32 PCM 并交给流水线逐批提交推理，所以录音的前段在上传
+    结束之前就已经在推理。上传完成并关闭标准输入后，future 得到 submit_blocks 的返回值。
+
+    调度优先级在第一批数据送入 ffmpeg 之后按文件头估算的时长决定（WAV 按头中的字节率换算），
+    不能从管道解码的 MP4 系列容器在第一批数据中识别出来后放弃增量解码，finalize 时按文件分析。
+
+    ffmpeg 的重采样与文件分析时的 soxr 略有差异，分数可能有微小的数值差别。
+    """
+
+    def __init__(self, session: "UploadSession"):
+        self.session = session
+        self.token = CancelToken()
+        self.token.add_callback(lambda: scheduler.discard(self.token))
+        self.future: Future = Future()
+        self.started_at = time.time()
+        self._process: Optional[subprocess.Popen] = None
+        self._header_sent = threading.Event()  # 文件头已写入上传文件并送入 ffmpeg（或送入结束）
+        self.unstreamable = False  # 容器不能从管道解码，已放弃增量解码
+
+    def start(self):
+        """启动 ffmpeg 和两个工作线程"""
+        self._process = subprocess.Popen(
+            [
+                "ffmpeg", "-hide_banner", "-loglevel", "error",
+                "-i", "pipe:0",
+                "-f", "f32le", "-ac", "1", "-ar", str(birdnet_service.sample_rate),
+                "pipe:1",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        self.token.add_callback(self._kill)
+        threading.Thread(target=self._feed, daemon=True, name=f"upload-feed-{self.session.id[:8]}").start()
+        threading.Thread(target=self._decode, daemon=True, name=f"upload-decode-{self.session.id[:8]}").start()
+
+    def stop(self):
+        """停止解码并丢弃已提交的推理批次"""
+        self.token.cancel()
+        with self.session.condition:
+            self.session.condition.notify_all()
+        if self.future.done() and self.future.exception() is None:
+            self.future.result().close()
+
+    def _kill(self):
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+
+    def _feed(self):
+        """把上传文件中已到达的字节送入 ffmpeg，上传完成后关闭标准输入"""
+        session = self.session
+        stdin = self._process.stdin
+        try:
+            with open(session.path, "rb") as f:
+                position = 0
+                while True:
+                    with session.condition:
+                        while position >= session.offset and not session.complete and not self.token.cancelled:
+                            session.condition.wait(timeout=1.0)
+                        if self.token.cancelled:
+                            return
+                        available = session.offset - position
+                    if available <= 0:
+                        return
+                    data = f.read(min(available, _FEED_READ_SIZE))
+                    if not data:
+                        return
+                    if position == 0 and _is_iso_media(data):
+                        logger.info(f"[{session.id}] MP4-family container cannot be decoded from a pipe, streaming decode skipped")
+                        self.unstreamable = True
+                        self.token.cancel()
+                        return
+                    stdin.write(data)
+                    self._header_sent.set()
+                    position += len(data)
+        except (BrokenPipeError, OSError) as e:
+            if not self.token.cancelled:
+                logger.warning(f"[{session.id}] Streaming decode input closed: {e}")
+        finally:
+            self._header_sent.set()
+            try:
+                stdin.close()
+            except OSError:
+                pass
+
+    def _blocks(self) -> Iterator[np.ndarray]:
+        """从 ffmpeg 标准输出逐块读取 PCM"""
+        yield from iter_f32_stream(self._process.stdout, int(_STREAM_BLOCK_SECONDS * birdnet_service.sample_rate))
+        if self._process.wait() != 0 and not self.token.cancelled:
+            raise RuntimeError(f"ffmpeg exited with code {self._process.returncode}")
+
+    def _decode(self):
+        """把解码结果交给流水线（在 decoder 线程中执行）"""
+        session = self.session
+        try:
+            self._header_sent.wait()
+            self.token.raise_if_cancelled()
+            estimated = self._estimate_duration()
+            priority = analysis_pipeline.priority_for(estimated)
+            logger.info(
+                f"[{session.id}] Streaming decode scheduled: ~{estimated:.1f}s audio, "
+                f"{'interactive' if priority == CLASS_INTERACTIVE else 'batch'}"
+            )
+            result = analysis_pipeline.submit_blocks(
+                self._blocks(),
+                session.client,
+                priority,
+                session.embeddings,
+                self.token,
+                session.model_id
+            )
+        except BaseException as e:
+            self._kill()
+            self.future.set_exception(e)
+            if not self.token.cancelled:
+                logger.warning(f"[{session.id}] Streaming decode failed: {e}")
+            return
+        self._kill()  # 推理失败提前结束时 ffmpeg 可能仍在等待输入
+        self.future.set_result(result)
+
+    def _estimate_duration(self) -> float:
+        """按文件头估算完整录音的时长，无法从文件头得到时按上传总字节数估算"""
+        session = self.session
+        estimated = estimate_duration_from_header(session.path, session.length)
+        if estimated is None:
+            estimated = analysis_pipeline.estimate_duration(session.length)
+        return estimated
+
+
+class UploadSession:
+    """
+    一次断点续传上传
+
+    已接收的字节数就是上传文件的大小，元数据保存在 <id>.upload.json，
+    服务重启后仍可查询偏移量并继续上传。
+    """
+
+    def __init__(
+        self,
+        upload_id: str,
+        file_name: str,
+        length: int,
+        model_id: str,
+        embeddings: bool,
+        client: str,
+        created_at: Optional[float] = None
+    ):
+        self.id = upload_id
+        self.file_name = file_name
+        self.length = length
+        self.model_id = model_id
+        self.embeddings = embeddings
+        self.client = client
+        self.created_at = created_at or time.time()
+        self.path = config.UPLOAD_DIR / f"{upload_id}_{file_name}"
+        self.offset = self.path.stat().st_size if self.path.exists() else 0
+        self.complete = False
+        self.last_activity = time.time()
+        self.condition = threading.Condition()
+        self.stream: Optional[StreamingDecoder] = None
+        self.busy = False  # 正在写入分块或分析
+
+    @property
+    def metadata_path(self) -> Path:
+        return _metadata_path(self.id)
+
+    def save_metadata(self):
+        """写入会话元数据"""
+        self.metadata_path.write_text(json.dumps({
+            "id": self.id,
+            "fileName": self.file_name,
+            "length": self.length,
+            "model": self.model_id,
+            "embeddings": self.embeddings,
+            "client": self.client,
+            "createdAt": self.created_at,
+        }), encoding="utf-8")
+
+    def write(self, data: bytes):
+        """在当前偏移量追加数据（调用方负责校验偏移量）"""
+        with open(self.path, "ab") as f:
+            f.write(data)
+        with self.condition:
+            self.offset += len(data)
+            self.last_activity = time.time()
+            self.condition.notify_all()
+
+    def mark_complete(self):
+        """所有字节已到达，通知增量解码关闭 ffmpeg 的输入"""
+        with self.condition:
+            self.complete = True
+            self.last_activity = time.time()
+            self.condition.notify_all()
+
+
+class UploadManager:
+    """
+    断点续传上传会话的管理
+
+    - 最多 UPLOAD_MAX_STREAMS 个会话同时边传边解码，其余会话在 finalize 时按文件分析
+    - 超过 UPLOAD_STREAM_IDLE_TIMEOUT 没有新数据的会话停止增量解码，之后恢复上传时重新开始
+    - 超过 UPLOAD_SESSION_TTL 没有活动的会话连同已上传的数据一起删除
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, UploadSession] = {}
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self.stream_decode = config.UPLOAD_STREAM_DECODE and shutil.which("ffmpeg") is not None
+
+    def start(self):
+        """启动过期会话清理线程"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._reap_loop, daemon=True, name="upload-reaper")
+        self._thread.start()
+        logger.info(f"Upload manager started (streaming decode: {'on' if self.stream_decode else 'off'})")
+
+    def stop(self):
+        """停止清理线程和所有增量解码（已上传的数据保留，重启后可继续）"""
+        self._running = False
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            self.stop_stream(session)
+        logger.info("Upload manager stopped")
+
+    def create(self, file_name: str, length: int, model_id: str, embeddings: bool, client: str) -> UploadSession:
+        """创建上传会话"""
+        session = UploadSession(str(uuid.uuid4()), Path(file_name).name, length, model_id, embeddings, client)
+        session.path.touch()
+        session.save_metadata()
+        with self._lock:
+            self._sessions[session.id] = session
+        logger.info(f"[{session.id}] Upload created: {session.file_name} ({length} bytes, client {client})")
+        return session
+
+    def get(self, upload_id: str) -> Optional[UploadSession]:
+        """获取会话；不在内存中时从元数据恢复（服务重启后）"""
+        try:
+            upload_id = str(uuid.UUID(upload_id))
+        except ValueError:
+            return None
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            if session is not None:
+                return session
+            try:
+                meta = json.loads(_metadata_path(upload_id).read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                return None
+            session = UploadSession(
+                upload_id,
+                meta["fileName"],
+                meta["length"],
+                meta["model"],
+                meta["embeddings"],
+                meta["client"],
+                meta["createdAt"]
+            )
+            self._sessions[upload_id] = session
+        logger.info(f"[{upload_id}] Upload session restored at offset {session.offset}")
+        return session
+
+    def ensure_stream(self, session: UploadSession):
+        """有空闲名额时为会话启动增量解码"""
+        if not self.stream_decode or session.stream is not None or session.complete:
+            return
+        if Path(session.file_name).suffix.lower() in _UNSTREAMABLE_EXTENSIONS:
+            return
+        with self._lock:
+            active = sum(1 for s in self._sessions.values() if s.stream is not None)
+            if active >= config.UPLOAD_MAX_STREAMS:
+                return
+            stream = StreamingDecoder(session)
+            session.stream = stream
+        try:
+            model_registry.record_request(session.model_id)
+            stream.start()
+        except Exception as e:
+            session.stream = None
+            logger.warning(f"[{session.id}] Failed to start streaming decode: {e}")
+            return
+        logger.info(f"[{session.id}] Streaming decode started at offset {session.offset}")
+
+    def stop_stream(self, session: UploadSession):
+        """停止会话的增量解码"""
+        stream, session.stream = session.stream, None
+        if stream is not None:
+            stream.stop()
+
+    def remove(self, session: UploadSession, delete_file: bool = True):
+        """删除会话（delete_file=False 时由调用方清理上传文件）"""
+        self.stop_stream(session)
+        with self._lock:
+            self._sessions.pop(session.id, None)
+        session.metadata_path.unlink(missing_ok=True)
+        if delete_file:
+            session.path.unlink(missing_ok=True)
+
+    def _reap_loop(self):
+        while self._running:
+            try:
+                self._reap()
+            except Exception as e:
+                logger.error(f"Upload reaper error: {e}")
+            for _ in range(30):
+                if not self._running:
+                    break
+                time.sleep(1)
+
+    def _reap(self):
+        """停止空闲会话的增量解码，删除过期会话"""
+        now = time.time()
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            if session.busy:
+                continue
+            idle = now - session.last_activity
+            if idle > config.UPLOAD_SESSION_TTL:
+                logger.info(f"[{session.id}] Upload expired after {idle:.0f}s idle")
+                self.remove(session)
+            elif session.stream is not None and idle > config.UPLOAD_STREAM_IDLE_TIMEOUT:
+                logger.info(f"[{session.id}] Upload idle for {idle:.0f}s, streaming decode stopped")
+                self.stop_stream(session)
+
+        # 服务重启前留下、之后再也没有访问过的会话
+        for meta_path in config.UPLOAD_DIR.glob("*.upload.json"):
+            if now - meta_path.stat().st_mtime <= config.UPLOAD_SESSION_TTL:
+                continue
+            upload_id = meta_path.name[:-len(".upload.json")]
+            with self._lock:
+                if upload_id in self._sessions:
+                    continue
+            for path in config.UPLOAD_DIR.glob(f"{upload_id}_*"):
+                path.unlink(missing_ok=True)
+            meta_path.unlink(missing_ok=True)
+            logger.info(f"[{upload_id}] Removed expired upload")
+
+
+def _is_iso_media(head: bytes) -> bool:
+    """文件开头是否为 ISO 基础媒体文件格式（MP4/M4A/MOV/3GP 的 ftyp 盒）"""
+    return head[4:8] == b"ftyp"
+
+
+def _metadata_path(upload_id: str) -> Path:
+    return config.UPLOAD_DIR / f"{upload_id}.upload.json"
+
+
+# 全局上传会话管理器
+upload_manager = UploadManager()
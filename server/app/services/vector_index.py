@@ -0,0 +1,420 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+# 元数据记录：每个向量对应一个片段
+META_DTYPE = np.dtype([
+    ("analysis_id", "S36"),
+    ("segment", "<i4"),
+    ("start", "<f4"),
+    ("end", "<f4"),
+])
+
+
+class VectorIndex:
+    """
+    片段嵌入向量的磁盘索引（内存映射）
+
+    目录结构：
+    - index.json: 向量维度
+    - vectors.f16: L2 归一化后的 float16 向量 [N, D]，只追加
+    - meta.bin: 与向量一一对应的元数据记录（META_DTYPE）
+    - analyses.jsonl: 每次分析的向量起始位置、数量和文件名
+    - ivf_*.npy: 近似索引（倒排列表），向量数量达到阈值后自动构建
+
+    追加时先写 meta.bin 再写 vectors.f16；写到一半退出时，加载时两个文件截断到共同的完整行数。
+    相似度为余弦相似度（归一化向量的内积）。
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._dim: Optional[int] = None
+        self._count = 0
+        self._analyses: Dict[str, dict] = {}
+        self._vectors: Optional[np.memmap] = None
+        self._meta: Optional[np.memmap] = None
+        self._mapped_count = -1
+        self._ivf: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, int]] = None
+        self._ivf_building = False
+        self._loaded = False
+
+    @property
+    def count(self) -> int:
+        self._ensure_loaded()
+        return self._count
+
+    def add(self, analysis_id: str, file_name: str, embeddings: np.ndarray, start: np.ndarray, end: np.ndarray):
+        """
+        追加一次分析的片段嵌入（阻塞调用，协程中通过 run_in_threadpool 使用）
+
+        Args:
+            analysis_id: 分析ID
+            file_name: 原始文件名
+            embeddings: 嵌入向量 [n, D]
+            start / end: 片段起止时间（秒）
+        """
+        self._ensure_loaded()
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32)).astype("<f2")
+        if vectors.shape[0] == 0:
+            return
+
+        meta = np.zeros(vectors.shape[0], dtype=META_DTYPE)
+        meta["analysis_id"] = analysis_id.encode()
+        meta["segment"] = np.arange(vectors.shape[0])
+        meta["start"] = start
+        meta["end"] = end
+
+        with self._lock:
+            if self._dim is None:
+                self._dim = int(vectors.shape[1])
+                (self.directory / "index.json").write_text(json.dumps({"dim": self._dim}))
+            elif vectors.shape[1] != self._dim:
+                raise ValueError(f"Embedding dimension mismatch: {vectors.shape[1]} != {self._dim}")
+
+            with open(self.directory / "meta.bin", "ab") as f:
+                f.write(meta.tobytes())
+            with open(self.directory / "vectors.f16", "ab") as f:
+                f.write(vectors.tobytes())
+
+            record = {
+                "analysisId": analysis_id,
+                "fileName": file_name,
+                "offset": self._count,
+                "count": int(vectors.shape[0]),
+                "createdAt": datetime.now().isoformat()
+            }
+            with open(self.directory / "analyses.jsonl", "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+
+            self._analyses[analysis_id] = record
+            self._count += vectors.shape[0]
+
+        logger.info(f"[{analysis_id}] Indexed {vectors.shape[0]} segment embeddings (total: {self._count})")
+        self._maybe_build_ivf()
+
+    def alias(self, analysis_id: str, file_name: str, source_id: str) -> bool:
+        """
+        让 analysis_id 指向 source_id 已索引的向量（同一段录音的缓存命中，不重复追加向量）
+
+        搜索结果中的片段仍归属于 source_id。
+
+        Returns:
+            source_id 不在本索引中时返回 False（由调用方改为 add）
+        """
+        self._ensure_loaded()
+        with self._lock:
+            source = self._analyses.get(source_id)
+            if source is None:
+                return False
+            record = {
+                "analysisId": analysis_id,
+                "fileName": file_name,
+                "offset": source["offset"],
+                "count": source["count"],
+                "aliasOf": source_id,
+                "createdAt": datetime.now().isoformat()
+            }
+            with open(self.directory / "analyses.jsonl", "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+            self._analyses[analysis_id] = record
+        logger.info(f"[{analysis_id}] Reusing {record['count']} indexed segment embeddings of {source_id}")
+        return True
+
+    def get_vector(self, analysis_id: str, segment: int) -> Optional[Tuple[int, np.ndarray]]:
+        """获取某次分析某个片段的向量，返回 (向量ID, 向量)"""
+        self._ensure_loaded()
+        record = self._analyses.get(analysis_id)
+        if record is None or not 0 <= segment < record["count"]:
+            return None
+        vector_id = record["offset"] + segment
+        vectors, _ = self._mapped()
+        return vector_id, np.asarray(vectors[vector_id], dtype=np.float32)
+
+    def search(self, queries: np.ndarray, k: int = 10, exact: bool = False, exclude: Optional[List[int]] = None) -> List[List[dict]]:
+        """
+        批量最近邻搜索
+
+        Args:
+            queries: 查询向量 [m, D]
+            k: 每个查询返回的结果数
+            exact: 强制暴力搜索（忽略近似索引）
+            exclude: 每个查询需要排除的向量ID（通常是查询片段本身）
+
+        Returns:
+            每个查询的结果列表（按相似度降序）
+        """
+        self._ensure_loaded()
+        if self._count == 0:
+            return [[] for _ in range(len(queries))]
+
+        queries = _normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        vectors, meta = self._mapped()
+        count = vectors.shape[0]
+        # 多取一个以便排除查询片段本身
+        k_search = min(k + 1, count)
+
+        if self._ivf is not None and not exact:
+            ids, scores = self._search_ivf(vectors, queries, k_search)
+        else:
+            ids, scores = self._search_exact(vectors, queries, k_search)
+
+        results = []
+        for qi in range(queries.shape[0]):
+            excluded = exclude[qi] if exclude else None
+            hits = []
+            for vector_id, score in zip(ids[qi].tolist(), scores[qi].tolist()):
+                if vector_id < 0 or vector_id == excluded:
+                    continue
+                hits.append(self._describe(meta, vector_id, score))
+                if len(hits) == k:
+                    break
+            results.append(hits)
+        return results
+
+    def describe(self, vector_id: int, score: float = 0.0) -> dict:
+        """向量ID对应的片段信息"""
+        _, meta = self._mapped()
+        return self._describe(meta, vector_id, score)
+
+    def _describe(self, meta: np.ndarray, vector_id: int, score: float) -> dict:
+        record = meta[vector_id]
+        analysis_id = record["analysis_id"].decode()
+        return {
+            "analysisId": analysis_id,
+            "fileName": self._analyses.get(analysis_id, {}).get("fileName", ""),
+            "segment": int(record["segment"]),
+            "start": float(record["start"]),
+            "end": float(record["end"]),
+            "score": round(score, 4)
+        }
+
+    def build_ivf(self, nlist: Optional[int] = None, iterations: int = 10):
+        """
+        构建近似索引（球面 k-means 粗量化 + 倒排列表）
+
+        构建期间继续使用旧索引或暴力搜索；之后追加的向量作为尾部做暴力搜索，
+        直到下一次重建。
+        """
+        self._ensure_loaded()
+        vectors, _ = self._mapped()
+        count = vectors.shape[0]
+        if count == 0:
+            return
+        nlist = nlist or int(min(max(np.sqrt(count), 16), 4096))
+        nlist = min(nlist, count)
+        start_time = time.time()
+
+        rng = np.random.default_rng(0)
+        sample_size = min(count, max(nlist * 64, 65536), 262144)
+        sample = vectors[np.sort(rng.choice(count, size=sample_size, replace=False))].astype(np.float32)
+        centroids = sample[rng.choice(sample_size, size=nlist, replace=False)]
+
+        for _ in range(iterations):
+            assign = self._assign(sample, centroids)
+            order = np.argsort(assign, kind="stable")
+            sorted_assign = assign[order]
+            lists, first = np.unique(sorted_assign, return_index=True)
+            sums = np.add.reduceat(sample[order], first, axis=0)
+            centroids[lists] = _normalize(sums)  # 空簇保留原质心
+
+        assign = np.empty(count, dtype=np.int32)
+        for i in range(0, count, config.VECTOR_SEARCH_BLOCK_SIZE):
+            block = np.asarray(vectors[i:i + config.VECTOR_SEARCH_BLOCK_SIZE], dtype=np.float32)
+            assign[i:i + block.shape[0]] = self._assign(block, centroids)
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(assign[order], np.arange(nlist + 1)).astype(np.int64)
+
+        # 每个文件先写临时文件再替换：重启后加载的旧 ivf_order.npy 仍被内存映射，不能原地覆盖；
+        # ivf.json 最后替换，中途退出时加载到的仍是上一版完整的索引
+        self._write_atomic("ivf_centroids.npy", lambda f: np.save(f, centroids.astype(np.float32)))
+        self._write_atomic("ivf_order.npy", lambda f: np.save(f, order))
+        self._write_atomic("ivf_offsets.npy", lambda f: np.save(f, offsets))
+        self._write_atomic("ivf.json", lambda f: f.write(json.dumps({"count": count, "nlist": nlist}).encode()))
+        with self._lock:
+            self._ivf = (centroids.astype(np.float32), order, offsets, count)
+        logger.info(f"Built IVF index over {count} vectors ({nlist} lists) in {time.time() - start_time:.1f}s")
+
+    def _write_atomic(self, name: str, write: Callable):
+        """写入索引目录中的文件：先写 name.tmp，完成后替换"""
+        path = self.directory / name
+        tmp_path = self.directory / (name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    def stats(self) -> dict:
+        """索引状态"""
+        self._ensure_loaded()
+        return {
+            "vectors": self._count,
+            "analyses": len(self._analyses),
+            "dim": self._dim,
+            "approximate": self._ivf is not None,
+            "approximateCoverage": self._ivf[3] if self._ivf is not None else 0
+        }
+
+    def _search_exact(self, vectors: np.ndarray, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """分块暴力搜索：每块一次矩阵乘法，所有查询一起算"""
+        m = queries.shape[0]
+        best_ids = np.full((m, 0), -1, dtype=np.int64)
+        best_scores = np.full((m, 0), -np.inf, dtype=np.float32)
+        block_size = config.VECTOR_SEARCH_BLOCK_SIZE
+
+        for i in range(0, vectors.shape[0], block_size):
+            block = np.asarray(vectors[i:i + block_size], dtype=np.float32)
+            scores = queries @ block.T  # [m, b]
+            ids = np.broadcast_to(np.arange(i, i + block.shape[0]), scores.shape)
+            best_ids, best_scores = _merge_topk(best_ids, best_scores, ids, scores, k)
+
+        return best_ids, best_scores
+
+    def _search_ivf(self, vectors: np.ndarray, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """近似搜索：只扫描最近的 nprobe 个倒排列表，外加建索引后追加的尾部向量"""
+        centroids, order, offsets, indexed_count = self._ivf
+        nprobe = min(config.VECTOR_INDEX_IVF_NPROBE, centroids.shape[0])
+        probes = np.argsort(-(queries @ centroids.T), axis=1)[:, :nprobe]
+        tail = np.arange(indexed_count, vectors.shape[0], dtype=np.int64)
+
+        all_ids = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        all_scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+        for qi in range(queries.shape[0]):
+            candidates = np.sort(np.concatenate(
+                [order[offsets[l]:offsets[l + 1]] for l in probes[qi]] + [tail]
+            ))
+            if candidates.size == 0:
+                continue
+            scores = np.asarray(vectors[candidates], dtype=np.float32) @ queries[qi]
+            top = _topk_indices(scores, k)
+            all_ids[qi, :top.size] = candidates[top]
+            all_scores[qi, :top.size] = scores[top]
+        return all_ids, all_scores
+
+    @staticmethod
+    def _assign(block: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        return np.argmax(block @ centroids.T, axis=1).astype(np.int32)
+
+    def _maybe_build_ivf(self):
+        """向量数量达到阈值、且未建索引或尾部超过 10% 时，在后台线程重建近似索引"""
+        with self._lock:
+            if self._count < config.VECTOR_INDEX_IVF_MIN_VECTORS or self._ivf_building:
+                return
+            if self._ivf is not None and self._count - self._ivf[3] < self._ivf[3] * 0.1:
+                return
+            self._ivf_building = True
+
+        def build():
+            try:
+                self.build_ivf()
+            except Exception as e:
+                logger.error(f"Failed to build IVF index: {e}", exc_info=True)
+            finally:
+                with self._lock:
+                    self._ivf_building = False
+
+        threading.Thread(target=build, daemon=True).start()
+
+    def _mapped(self) -> Tuple[np.ndarray, np.ndarray]:
+        """返回当前向量数量对应的内存映射（数量变化时重新映射）"""
+        with self._lock:
+            if self._mapped_count != self._count:
+                self._vectors = np.memmap(
+                    self.directory / "vectors.f16", dtype="<f2", mode="r", shape=(self._count, self._dim)
+                )
+                self._meta = np.memmap(self.directory / "meta.bin", dtype=META_DTYPE, mode="r", shape=(self._count,))
+                self._mapped_count = self._count
+            return self._vectors, self._meta
+
+    def _ensure_loaded(self):
+        """首次使用时读取索引目录"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self.directory.mkdir(parents=True, exist_ok=True)
+            index_file = self.directory / "index.json"
+            if index_file.exists():
+                self._dim = json.loads(index_file.read_text())["dim"]
+                self._count = self._repair()
+
+            analyses_file = self.directory / "analyses.jsonl"
+            if analyses_file.exists():
+                with open(analyses_file, encoding="utf-8") as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            logger.warning(f"Skipping truncated record in {analyses_file}")
+                            continue
+                        # 记录之后的向量在异常退出时可能没有写完
+                        if record["offset"] + record["count"] <= self._count:
+                            self._analyses[record["analysisId"]] = record
+
+            ivf_file = self.directory / "ivf.json"
+            if ivf_file.exists():
+                self._ivf = (
+                    np.load(self.directory / "ivf_centroids.npy"),
+                    np.load(self.directory / "ivf_order.npy", mmap_mode="r"),
+                    np.load(self.directory / "ivf_offsets.npy"),
+                    json.loads(ivf_file.read_text())["count"]
+                )
+            self._loaded = True
+        logger.info(f"Vector index loaded: {self._count} vectors, {len(self._analyses)} analyses")
+
+    def _repair(self) -> int:
+        """向量和元数据文件截断到共同的完整行数（上次追加写到一半时），返回向量数量"""
+        vectors_file = self.directory / "vectors.f16"
+        meta_file = self.directory / "meta.bin"
+        row_bytes = self._dim * 2
+        vectors_size = vectors_file.stat().st_size if vectors_file.exists() else 0
+        meta_size = meta_file.stat().st_size if meta_file.exists() else 0
+        count = min(vectors_size // row_bytes, meta_size // META_DTYPE.itemsize)
+        for path, size, expected in (
+            (vectors_file, vectors_size, count * row_bytes),
+            (meta_file, meta_size, count * META_DTYPE.itemsize),
+        ):
+            if size != expected:
+                logger.warning(f"Truncating {path.name} from {size} to {expected} bytes (incomplete append)")
+                with open(path, "ab") as f:
+                    f.truncate(expected)
+        return count
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    """L2 归一化（按行）"""
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def _topk_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """一维分数的前 k 个下标（降序）"""
+    k = min(k, scores.size)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def _merge_topk(ids_a, scores_a, ids_b, scores_b, k):
+    """合并两组候选并保留每行前 k 个"""
+    ids = np.concatenate([ids_a, ids_b], axis=1)
+    scores = np.concatenate([scores_a, scores_b], axis=1)
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    return np.take_along_axis(ids, top, axis=1), np.take_along_axis(scores, top, axis=1)
+
+
+# 全局索引实例
+vector_index = VectorIndex(config.VECTOR_INDEX_DIR)
@@ -0,0 +1,104 @@
+import json
+import logging
+import math
+import time
+from typing import Optional
+from .. import config
+from ..utils.visual_summary import SPILL_COLUMNS, VisualSummary, iter_zoom_levels, reduce_peaks, reduce_spectrogram
+from .cache import cache
+
+logger = logging.getLogger(__name__)
+
+WAVEFORM = "waveform"
+SPECTROGRAM = "spectrogram"
+VISUAL_KINDS = (WAVEFORM, SPECTROGRAM)
+
+# 瓦片按批写入缓存后端（redis 一批一次往返），每批最多这么多字节
+_WRITE_BATCH_BYTES = 8 * 1024 * 1024
+
+
+class VisualStore:
+    """
+    波形峰值和频谱图瓦片（按分析 ID 保存在缓存后端，多副本部署时共享）
+
+    每种视图有若干缩放级别：级别 0 为基础分辨率，每升一级列数减半，最高级别的整个时间轴
+    放得进一个瓦片。每个瓦片 VISUAL_TILE_COLUMNS 列，按列优先存放原始字节：
+    - waveform: 每列 2 个 int8（最小值、最大值，±127 对应满幅）
+    - spectrogram: 每列 bins 个 uint8（低频在前，0 对应 -dbRange dB，255 对应 0 dBFS）
+
+    客户端先读取元数据，再只请求当前视口需要的瓦片。
+    """
+
+    def put(self, analysis_id: str, summary: VisualSummary, duration: float):
+        """保存一次分析的视图（阻塞调用）"""
+        start_time = time.time()
+        tiles = self._put_kind(analysis_id, WAVEFORM, summary.peaks, reduce_peaks, duration, {
+            "columnsPerSecond": summary.peaks_per_second,
+            "valuesPerColumn": 2,
+            "dtype": "int8",
+        })
+        tiles += self._put_kind(analysis_id, SPECTROGRAM, summary.spectrogram, reduce_spectrogram, duration, {
+            "columnsPerSecond": summary.columns_per_second,
+            "valuesPerColumn": summary.bins,
+            "dtype": "uint8",
+            "maxFrequency": summary.max_freq,
+            "dbRange": summary.db_range,
+        })
+        logger.info(f"[{analysis_id}] Stored {tiles} waveform/spectrogram tiles in {time.time() - start_time:.2f}s")
+
+    def meta(self, analysis_id: str, kind: str) -> Optional[dict]:
+        """视图元数据，不存在或已过期时返回 None"""
+        raw = cache.get(_meta_key(analysis_id, kind))
+        return json.loads(raw) if raw is not None else None
+
+    def tile(self, analysis_id: str, kind: str, zoom: int, index: int) -> Optional[bytes]:
+        """瓦片内容，不存在或已过期时返回 None"""
+        return cache.get(_tile_key(analysis_id, kind, zoom, index))
+
+    def _put_kind(self, analysis_id: str, kind: str, base, reduce, duration: float, meta: dict) -> int:
+        tile_columns = max(config.VISUAL_TILE_COLUMNS, 1)
+        levels = []
+        batch = {}
+        batch_bytes = 0
+        for zoom, level in iter_zoom_levels(base, reduce, tile_columns, SPILL_COLUMNS, config.OUTPUT_DIR):
+            tile_count = math.ceil(level.shape[0] / tile_columns)
+            for index in range(tile_count):
+                tile = level[index * tile_columns:(index + 1) * tile_columns].tobytes()
+                batch[_tile_key(analysis_id, kind, zoom, index)] = tile
+                batch_bytes += len(tile)
+                if batch_bytes >= _WRITE_BATCH_BYTES:
+                    cache.set_many(batch, config.VISUAL_TTL)
+                    batch = {}
+                    batch_bytes = 0
+            levels.append({
+                "zoom": zoom,
+                "columns": int(level.shape[0]),
+                "tiles": tile_count,
+                "columnsPerSecond": meta["columnsPerSecond"] / (2 ** zoom),
+            })
+
+        meta = {
+            **meta,
+            "kind": kind,
+            "analysisId": analysis_id,
+            "duration": duration,
+            "tileColumns": tile_columns,
+            "levels": levels,
+        }
+        if batch:
+            cache.set_many(batch, config.VISUAL_TTL)
+        # 元数据最后写入：读到元数据时所有瓦片都已存在
+        cache.set(_meta_key(analysis_id, kind), json.dumps(meta).encode(), config.VISUAL_TTL)
+        return sum(level["tiles"] for level in levels)
+
+
+def _meta_key(analysis_id: str, kind: str) -> str:
+    return f"visual:{kind}:{analysis_id}:meta"
+
+
+def _tile_key(analysis_id: str, kind: str, zoom: int, index: int) -> str:
+    return f"visual:{kind}:{analysis_id}:{zoom}:{index}"
+
+
+# 全局视图存储实例
+visual_store = VisualStore()
@@ -1,12 +1,15 @@
 import logging
 import subprocess
 from pathlib import Path
+from typing import Optional
+import soundfile
 from .. import config
+from .cancellation import AnalysisCancelled, CancelToken
 
 logger = logging.getLogger(__name__)
 
 
-def convert_to_wav(input_file: Path, output_file: Path) -> Path:
+def convert_to_wav(input_file: Path, output_file: Path, cancel_token: Optional[CancelToken] = None) -> Path:
     """
     使用 ffmpeg 将音频文件转换为 WAV 格式（优化版本）
 
@@ -22,12 +25,14 @@ def convert_to_wav(input_file: Path, output_file: Path) -> Path:
     Args:
         input_file: 输入音频文件路径
         output_file: 输出 WAV 文件路径
+        cancel_token: 取消令牌，取消时立即结束 ffmpeg 进程
 
     Returns:
         转换后的 WAV 文件路径
 
     Raises:
         RuntimeError: 如果 ffmpeg 不可用或转换失败
+        AnalysisCancelled: 如果转换被取消
     """
     # 检查 ffmpeg 是否可用
     try:
@@ -64,21 +69,101 @@ def convert_to_wav(input_file: Path, output_file: Path) -> Path:
 
     logger.info(f"Converting {input_file.name} to WAV (optimized, no silence removal)")
 
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=0.2)
+            break
+        except subprocess.TimeoutExpired:
+            # 定期检查取消令牌，客户端断开时不再等待转换完成
+            if cancel_token is not None and cancel_token.cancelled:
+                process.kill()
+                process.communicate()
+                logger.info(f"Conversion of {input_file.name} cancelled, ffmpeg killed")
+                raise AnalysisCancelled()
+
+    logger.info(f"ffmpeg stdout: {stdout}")
+    if process.returncode != 0:
+        logger.error(f"ffmpeg failed: {stderr}")
+        raise RuntimeError(f"Audio conversion failed: {stderr}")
+    if stderr:
+        logger.debug(f"ffmpeg stderr: {stderr}")
+
+    logger.info(f"Conversion complete: {output_file} ({output_file.stat().st_size} bytes)")
+
+    return output_file
+
+
+def probe_duration(input_file: Path) -> Optional[float]:
+    """
+    从文件头读取音频时长（不解码音频数据）
+
+    先尝试 libsndfile（WAV/FLAC/OGG/MP3），失败时使用 ffprobe（WebM 等容器）。
+
+    Args:
+        input_file: 音频文件路径
+
+    Returns:
+        时长（秒），无法读取时返回 None
+    """
+    try:
+        return float(soundfile.info(str(input_file)).duration)
+    except Exception:
+        pass
+
     try:
         result = subprocess.run(
-            cmd,
+            [
+                "ffprobe", "-v", "error",
+                "-show_entries", "format=duration",
+                "-of", "default=noprint_wrappers=1:nokey=1",
+                str(input_file),
+            ],
             capture_output=True,
             text=True,
             check=True,
+            timeout=10,
         )
-        logger.info(f"ffmpeg stdout: {result.stdout}")
-        if result.stderr:
-            logger.debug(f"ffmpeg stderr: {result.stderr}")
+        return float(result.stdout.strip())
+    except (subprocess.SubprocessError, FileNotFoundError, ValueError):
+        logger.warning(f"Failed to probe duration of {input_file.name}")
+        return None
 
-    except subprocess.CalledProcessError as e:
-        logger.error(f"ffmpeg failed: {e.stderr}")
-        raise RuntimeError(f"Audio conversion failed: {e.stderr}")
 
-    logger.info(f"Conversion complete: {output_file} ({output_file.stat().st_size} bytes)")
+# 未压缩 PCM 子类型（libsndfile）的每采样位数
+_PCM_SUBTYPE_BITS = {
+    "PCM_U8": 8, "PCM_S8": 8, "PCM_16": 16, "PCM_24": 24, "PCM_32": 32,
+    "FLOAT": 32, "DOUBLE": 64, "ULAW": 8, "ALAW": 8,
+}
 
-    return output_file
+
+def estimate_duration_from_header(input_file: Path, total_size: int) -> Optional[float]:
+    """
+    按文件头估算完整文件的时长（文件可能还没有上传完）
+
+    - 未压缩 PCM（WAV/AIFF 等）：按头中的采样率、声道数和位深把 total_size 换算为时长，
+      不使用 libsndfile 按已写入部分算出的帧数
+    - FLAC：STREAMINFO 中的总采样数
+
+    Args:
+        input_file: 已写入文件头的音频文件
+        total_size: 完整文件的字节数
+
+    Returns:
+        时长（秒），其他格式或无法读取文件头时返回 None
+    """
+    try:
+        info = soundfile.info(str(input_file))
+    except Exception:
+        return None
+    bits = _PCM_SUBTYPE_BITS.get(info.subtype)
+    if bits is not None and info.samplerate > 0 and info.channels > 0:
+        return total_size / (info.samplerate * info.channels * bits / 8)
+    if info.format == "FLAC" and info.frames > 0:
+        return float(info.duration)
+    return None
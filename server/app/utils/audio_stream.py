@@ -0,0 +1,249 @@
+import logging
+import subprocess
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, Tuple
+import numpy as np
+import soundfile
+import soxr
+
+logger = logging.getLogger(__name__)
+
+
+def iter_audio_blocks(
+    input_path: Path,
+    sample_rate: int,
+    block_seconds: float,
+    fallback_loader: Callable[[str], np.ndarray],
+    ffmpeg: bool = False,
+) -> Iterator[np.ndarray]:
+    """
+    按块顺序解码音频，输出目标采样率的单声道 float32 数据
+
+    libsndfile 能打开的格式（WAV/FLAC/OGG/MP3）逐块读取并用流式重采样器转换采样率，
+    块边界处没有重采样伪影；其他格式（WebM/M4A 等）ffmpeg 可用时由 ffmpeg 管道流式解码，
+    否则退回整体解码后再分块。
+
+    Args:
+        input_path: 音频文件路径
+        sample_rate: 目标采样率
+        block_seconds: 每块的时长（秒，按源采样率计）
+        fallback_loader: 整体解码函数（路径 -> 目标采样率的单声道信号）
+        ffmpeg: libsndfile 无法打开时是否用 ffmpeg 流式解码
+
+    Yields:
+        音频块
+    """
+    try:
+        f = soundfile.SoundFile(str(input_path))
+    except Exception as e:
+        if ffmpeg:
+            logger.info(f"libsndfile cannot open {input_path.name} ({e}), streaming through ffmpeg")
+            yield from iter_ffmpeg_blocks(input_path, sample_rate, block_seconds)
+            return
+        logger.info(f"libsndfile cannot open {input_path.name} ({e}), decoding in one pass")
+        sig = fallback_loader(str(input_path))
+        block_size = max(int(block_seconds * sample_rate), 1)
+        for i in range(0, sig.shape[0], block_size):
+            yield sig[i:i + block_size]
+        return
+
+    with f:
+        resampler = None
+        if f.samplerate != sample_rate:
+            resampler = soxr.ResampleStream(f.samplerate, sample_rate, 1, dtype="float32")
+        block_frames = max(int(block_seconds * f.samplerate), 1)
+
+        while True:
+            data = f.read(block_frames, dtype="float32", always_2d=True)
+            last = data.shape[0] < block_frames
+            mono = data.mean(axis=1) if data.shape[1] > 1 else data[:, 0]
+            if resampler is not None:
+                mono = resampler.resample_chunk(mono, last=last)
+            if mono.size:
+                yield np.ascontiguousarray(mono, dtype=np.float32)
+            if last:
+                break
+
+
+def iter_ffmpeg_blocks(input_path: Path, sample_rate: int, block_seconds: float) -> Iterator[np.ndarray]:
+    """
+    用 ffmpeg 把任意格式解码为目标采样率的单声道 float32，经管道逐块读取
+
+    不落地中间 WAV 文件，内存占用与块大小成正比；生成器关闭时结束 ffmpeg 进程。
+
+    Raises:
+        RuntimeError: ffmpeg 解码失败
+    """
+    process = subprocess.Popen(
+        [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin",
+            "-i", str(input_path),
+            "-f", "f32le", "-ac", "1", "-ar", str(sample_rate),
+            "pipe:1",
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        yield from iter_f32_stream(process.stdout, max(int(block_seconds * sample_rate), 1))
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to decode {input_path.name} (exit code {process.returncode})")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+
+
+def iter_f32_stream(stream: BinaryIO, block_samples: int) -> Iterator[np.ndarray]:
+    """
+    从字节流（ffmpeg 标准输出等）逐块读取小端 float32 单声道 PCM
+
+    每块都是新分配的数组：切分出的片段可能直接引用块的内存，不能复用读缓冲区。
+    """
+    block_bytes = block_samples * 4
+    while True:
+        data = stream.read(block_bytes)
+        if not data:
+            return
+        usable = len(data) - len(data) % 4
+        if usable:
+            yield np.frombuffer(data, dtype="<f4", count=usable // 4)
+
+
+# 支持的原始 PCM 编码（小端）
+PCM_ENCODINGS = {
+    "pcm_s16le": "<i2",
+    "pcm_f32le": "<f4",
+}
+
+
+def pcm_frames(data, encoding: str, channels: int) -> np.ndarray:
+    """
+    把原始 PCM 字节解释为 [帧数, 声道数] 数组（直接引用原缓冲区，不复制）
+
+    Args:
+        data: bytes / bytearray / memoryview
+        encoding: PCM_ENCODINGS 中的编码
+        channels: 声道数（多声道为交错排列）
+
+    Raises:
+        ValueError: 编码不支持、声道数无效或数据长度不是整帧
+    """
+    if encoding not in PCM_ENCODINGS:
+        raise ValueError(f"Unsupported PCM encoding: {encoding}")
+    if channels < 1:
+        raise ValueError(f"Invalid channel count: {channels}")
+    dtype = np.dtype(PCM_ENCODINGS[encoding])
+    frame_bytes = dtype.itemsize * channels
+    if len(data) % frame_bytes:
+        raise ValueError(f"PCM data length {len(data)} is not a multiple of the frame size {frame_bytes}")
+    return np.frombuffer(data, dtype=dtype).reshape(-1, channels)
+
+
+def iter_pcm_blocks(
+    frames: np.ndarray,
+    sample_rate: int,
+    target_rate: int,
+    block_seconds: float,
+) -> Iterator[np.ndarray]:
+    """
+    按块把 PCM 帧转换为目标采样率的单声道 float32
+
+    单声道 float32 且采样率一致时输出的块是原缓冲区的视图；其他情况逐块混音、
+    转换并用流式重采样器转换采样率，内存占用与块大小成正比。
+
+    Args:
+        frames: pcm_frames 返回的 [帧数, 声道数] 数组
+        sample_rate: PCM 的采样率
+        target_rate: 目标采样率
+        block_seconds: 每块的时长（秒）
+
+    Yields:
+        音频块
+    """
+    resampler = None
+    if sample_rate != target_rate:
+        resampler = soxr.ResampleStream(sample_rate, target_rate, 1, dtype="float32")
+    scale = 1.0 / 32768 if frames.dtype.kind == "i" else None
+    block_frames = max(int(block_seconds * sample_rate), 1)
+    total = frames.shape[0]
+
+    for i in range(0, total, block_frames):
+        block = frames[i:i + block_frames]
+        if block.shape[1] == 1:
+            mono = block[:, 0]
+        else:
+            mono = block.mean(axis=1, dtype=np.float32)
+        if scale is not None:
+            mono = mono.astype(np.float32) * np.float32(scale)
+        elif mono.dtype != np.float32:
+            mono = mono.astype(np.float32)
+        if resampler is not None:
+            mono = resampler.resample_chunk(mono, last=i + block_frames >= total)
+        if mono.size:
+            yield mono
+
+
+class Segmenter:
+    """
+    把连续到达的音频块切成固定长度（可重叠）的分析片段
+
+    切分规则与 BirdNetService.split_signal 一致：不足一个片段的尾部补零，
+    尾部短于最小长度时丢弃。
+    """
+
+    def __init__(self, sample_rate: int, seconds: float, overlap: float, min_seconds: float):
+        self.sample_rate = sample_rate
+        self.chunk_size = int(sample_rate * seconds)
+        self.step_size = int(sample_rate * (seconds - overlap))
+        self.min_size = int(sample_rate * min_seconds)
+        self.total_samples = 0
+        self._emitted = 0
+        self._buffer = np.empty(0, dtype=np.float32)
+
+    @property
+    def duration(self) -> float:
+        """已接收音频的时长（秒）"""
+        return self.total_samples / self.sample_rate
+
+    def feed(self, block: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        追加一个音频块，返回其中已完整的片段
+
+        Returns:
+            (片段数组 [n, 片段采样数], 片段起始时间 [n])
+        """
+        self.total_samples += block.shape[0]
+        buffer = np.concatenate((self._buffer, block)) if self._buffer.size else block
+
+        if buffer.shape[0] < self.chunk_size:
+            self._buffer = buffer
+            return np.empty((0, self.chunk_size), dtype=np.float32), np.empty(0, dtype=np.float32)
+
+        count = (buffer.shape[0] - self.chunk_size) // self.step_size + 1
+        chunks = np.lib.stride_tricks.sliding_window_view(buffer, self.chunk_size)[0:count * self.step_size:self.step_size]
+        starts = (self._emitted + np.arange(count, dtype=np.float32)) * (self.step_size / self.sample_rate)
+
+        self._emitted += count
+        self._buffer = buffer[count * self.step_size:]
+        return chunks, starts
+
+    def finish(self) -> Tuple[np.ndarray, np.ndarray]:
+        """输入结束，返回尾部的不完整片段（补零）"""
+        base = self._emitted * self.step_size
+        last_pos = max(-(-(self.total_samples - self.chunk_size) // self.step_size) * self.step_size, 0)
+        if self.total_samples - last_pos < self.min_size:
+            last_pos -= self.step_size
+        if last_pos < base:
+            return np.empty((0, self.chunk_size), dtype=np.float32), np.empty(0, dtype=np.float32)
+
+        padded = np.concatenate((self._buffer, np.zeros(self.chunk_size, dtype=np.float32)))
+        positions = np.arange(0, last_pos - base + 1, self.step_size)
+        chunks = np.lib.stride_tricks.sliding_window_view(padded, self.chunk_size)[positions]
+        starts = (base + positions).astype(np.float32) / self.sample_rate
+
+        self._emitted += positions.size
+        self._buffer = np.empty(0, dtype=np.float32)
+        return chunks, starts
@@ -0,0 +1,83 @@
+import asyncio
+import contextlib
+import logging
+import threading
+from typing import Callable, List
+from fastapi import Request
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisCancelled(Exception):
+    """分析已被取消（客户端断开连接）"""
+
+
+class CancelToken:
+    """
+    跨线程的取消令牌
+
+    协程侧通过取消请求任务中止等待；工作线程、ffmpeg 子进程和调度器队列
+    通过该令牌得知取消并尽快停止。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """触发取消并执行已注册的回调"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Cancel callback failed: {e}")
+
+    def add_callback(self, callback: Callable[[], None]):
+        """注册取消回调；已经取消时立即执行"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def raise_if_cancelled(self):
+        """已取消时抛出 AnalysisCancelled"""
+        if self._event.is_set():
+            raise AnalysisCancelled()
+
+
+@contextlib.asynccontextmanager
+async def cancel_on_disconnect(request: Request, token: CancelToken, interval: float = 0.5):
+    """
+    在代码块执行期间监视客户端连接，断开时触发令牌并取消当前请求任务
+
+    注意：只能在请求体读取完之后使用，否则检测连接时会消费请求体。
+
+    Args:
+        request: 请求对象
+        token: 取消令牌
+        interval: 检查间隔（秒）
+    """
+    task = asyncio.current_task()
+
+    async def watch():
+        while not await request.is_disconnected():
+            await asyncio.sleep(interval)
+        token.cancel()
+        task.cancel()
+
+    watcher = asyncio.create_task(watch())
+    try:
+        yield
+    finally:
+        watcher.cancel()
@@ -0,0 +1,39 @@
+import hashlib
+import hmac
+from fastapi import Request
+from .. import config
+
+
+def client_key(request: Request) -> str:
+    """
+    请求方标识（用于公平排队）
+
+    X-API-Key 在 API_KEYS 中时使用该密钥（只保留哈希前缀），否则使用客户端 IP。
+    两个请求头都由调用方控制：未登记的密钥一律忽略，X-Forwarded-For 只采信
+    TRUSTED_PROXIES 层可信代理追加的部分（从右往左数），调用方无法通过轮换请求头
+    伪装成多个客户端绕过公平排队。
+
+    Args:
+        request: 请求对象
+
+    Returns:
+        形如 "key:1a2b3c4d5e6f" 或 "ip:1.2.3.4" 的字符串
+    """
+    api_key = request.headers.get("x-api-key")
+    if api_key and _valid_api_key(api_key):
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+    peer = request.client.host if request.client else "unknown"
+    if config.TRUSTED_PROXIES <= 0:
+        return "ip:" + peer
+
+    # 每层代理把它看到的对端追加到末尾：倒数第 TRUSTED_PROXIES 个是最外层可信代理看到的客户端
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    if not hops:
+        return "ip:" + peer
+    return "ip:" + hops[max(len(hops) - config.TRUSTED_PROXIES, 0)]
+
+
+def _valid_api_key(api_key: str) -> bool:
+    """密钥是否在 API_KEYS 中（逐个常量时间比较）"""
+    return any(hmac.compare_digest(api_key.encode(), key.encode()) for key in config.API_KEYS)
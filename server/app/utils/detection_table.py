@@ -0,0 +1,99 @@
+import logging
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from ..models import Detection
+
+logger = logging.getLogger(__name__)
+
+
+class DetectionTable:
+    """
+    列式存储的检测结果
+
+    - start / end: 片段起止时间（秒，float32）
+    - species_index: 指向物种表的整数索引（int32）
+    - confidence: 置信度（float32）
+    - species: 物种表 [(学名, 俗名), ...]，每个物种只保存一次
+    """
+
+    def __init__(
+        self,
+        start: Sequence[float],
+        end: Sequence[float],
+        species_index: Sequence[int],
+        confidence: Sequence[float],
+        species: Sequence[Tuple[str, str]],
+    ):
+        self.start = np.asarray(start, dtype=np.float32)
+        self.end = np.asarray(end, dtype=np.float32)
+        self.species_index = np.asarray(species_index, dtype=np.int32)
+        self.confidence = np.asarray(confidence, dtype=np.float32)
+        self.species = list(species)
+
+    def __len__(self) -> int:
+        return int(self.start.shape[0])
+
+    @property
+    def species_count(self) -> int:
+        """检测到的不同物种数量"""
+        return int(np.unique(self.species_index).size)
+
+    def species_columns(self) -> Dict[str, List[str]]:
+        """物种表（列式）"""
+        return {
+            "scientificName": [s[0] for s in self.species],
+            "commonName": [s[1] for s in self.species],
+        }
+
+    def to_columns(self) -> Dict[str, np.ndarray]:
+        """检测结果（列式，numpy 数组）"""
+        return {
+            "start": self.start,
+            "end": self.end,
+            "species": self.species_index,
+            "confidence": self.confidence,
+        }
+
+    def to_detections(self) -> List[Detection]:
+        """
+        展开为逐行的 Detection 列表（兼容旧版响应格式）
+
+        Returns:
+            Detection 列表，每行只做一次校验
+        """
+        detections = []
+        for start, end, idx, conf in zip(
+            self.start.tolist(),
+            self.end.tolist(),
+            self.species_index.tolist(),
+            self.confidence.tolist(),
+        ):
+            scientific_name, common_name = self.species[idx]
+            detections.append(Detection(
+                startTime=format_seconds(start),
+                endTime=format_seconds(end),
+                scientificName=scientific_name,
+                commonName=common_name,
+                confidence=round(conf, 4),
+                label=f"{common_name} ({scientific_name})"
+            ))
+        return detections
+
+    @classmethod
+    def empty(cls) -> "DetectionTable":
+        """空结果"""
+        return cls([], [], [], [], [])
+
+
+def format_seconds(seconds: float) -> str:
+    """
+    将秒数格式化为 M:SS
+
+    Args:
+        seconds: 秒数
+
+    Returns:
+        格式化后的时间字符串，例如 75.0 -> "1:15"
+    """
+    secs = max(float(seconds), 0.0)
+    return f"{int(secs // 60)}:{int(secs % 60):02d}"
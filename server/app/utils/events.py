@@ -0,0 +1,129 @@
+import logging
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from ..models import Event
+from .detection_table import DetectionTable, format_seconds
+
+logger = logging.getLogger(__name__)
+
+# 浮点误差容限（秒）：片段首尾相接时 start 与上一段 end 可能差一点点
+_TIME_EPSILON = 1e-3
+
+
+class EventTable:
+    """
+    列式存储的鸟鸣事件（同一物种相邻或重叠的片段合并而成）
+
+    - start / end: 事件起止时间（秒）
+    - species_index: 指向物种表的整数索引
+    - max_confidence / mean_confidence: 事件内片段置信度的最大值 / 平均值
+    - segments: 事件包含的片段数
+    """
+
+    def __init__(
+        self,
+        start: np.ndarray,
+        end: np.ndarray,
+        species_index: np.ndarray,
+        max_confidence: np.ndarray,
+        mean_confidence: np.ndarray,
+        segments: np.ndarray,
+        species: Sequence[Tuple[str, str]],
+    ):
+        self.start = np.asarray(start, dtype=np.float32)
+        self.end = np.asarray(end, dtype=np.float32)
+        self.species_index = np.asarray(species_index, dtype=np.int32)
+        self.max_confidence = np.asarray(max_confidence, dtype=np.float32)
+        self.mean_confidence = np.asarray(mean_confidence, dtype=np.float32)
+        self.segments = np.asarray(segments, dtype=np.int32)
+        self.species = list(species)
+
+    def __len__(self) -> int:
+        return int(self.start.shape[0])
+
+    def to_columns(self) -> Dict[str, np.ndarray]:
+        """事件（列式，numpy 数组）"""
+        return {
+            "start": self.start,
+            "end": self.end,
+            "species": self.species_index,
+            "maxConfidence": self.max_confidence,
+            "meanConfidence": self.mean_confidence,
+            "segments": self.segments,
+        }
+
+    def to_events(self) -> List[Event]:
+        """展开为逐行的 Event 列表"""
+        events = []
+        for start, end, idx, max_conf, mean_conf, segments in zip(
+            self.start.tolist(),
+            self.end.tolist(),
+            self.species_index.tolist(),
+            self.max_confidence.tolist(),
+            self.mean_confidence.tolist(),
+            self.segments.tolist(),
+        ):
+            scientific_name, common_name = self.species[idx]
+            events.append(Event(
+                startTime=format_seconds(start),
+                endTime=format_seconds(end),
+                start=round(start, 3),
+                end=round(end, 3),
+                scientificName=scientific_name,
+                commonName=common_name,
+                maxConfidence=round(max_conf, 4),
+                meanConfidence=round(mean_conf, 4),
+                segmentCount=segments
+            ))
+        return events
+
+
+def merge_events(table: DetectionTable, gap: float = 0.0) -> EventTable:
+    """
+    将同一物种相邻或重叠的检测片段合并为事件（全程向量化）
+
+    Args:
+        table: 片段级检测结果
+        gap: 允许的最大间隔（秒），间隔不超过该值的同种片段也会合并
+
+    Returns:
+        按开始时间排序的 EventTable
+    """
+    n = len(table)
+    if n == 0:
+        return EventTable([], [], [], [], [], [], table.species)
+
+    # 按 (物种, 开始时间) 排序
+    order = np.lexsort((table.start, table.species_index))
+    species = table.species_index[order]
+    start = table.start[order].astype(np.float64)
+    end = table.end[order].astype(np.float64)
+    confidence = table.confidence[order]
+
+    # 同一物种内到当前片段为止的最大结束时间；
+    # 给每个物种加递增偏移，使 maximum.accumulate 不会跨物种传递
+    offset = species.astype(np.float64) * (end.max() + gap + 1.0)
+    running_end = np.maximum.accumulate(end + offset) - offset
+
+    new_event = np.ones(n, dtype=bool)
+    new_event[1:] = (species[1:] != species[:-1]) | (start[1:] > running_end[:-1] + gap + _TIME_EPSILON)
+    first = np.flatnonzero(new_event)
+    counts = np.diff(np.append(first, n))
+
+    event_start = start[first]
+    event_end = np.maximum.reduceat(end, first)
+    event_species = species[first]
+    event_max = np.maximum.reduceat(confidence, first)
+    event_mean = np.add.reduceat(confidence.astype(np.float64), first) / counts
+
+    by_time = np.lexsort((event_species, event_start))
+    logger.debug(f"Merged {n} segments into {first.size} events")
+    return EventTable(
+        event_start[by_time],
+        event_end[by_time],
+        event_species[by_time],
+        event_max[by_time],
+        event_mean[by_time],
+        counts[by_time],
+        table.species,
+    )
@@ -0,0 +1,38 @@
+import logging
+from typing import Optional, Tuple
+from .. import config
+from ..models import Summary
+from .detection_table import DetectionTable, format_seconds
+from .events import EventTable, merge_events
+
+logger = logging.getLogger(__name__)
+
+# 响应粒度
+DETAIL_SEGMENTS = "segments"  # 逐片段检测结果（默认，兼容旧版）
+DETAIL_EVENTS = "events"      # 合并后的事件
+
+SUPPORTED_DETAILS = (DETAIL_SEGMENTS, DETAIL_EVENTS)
+
+
+def postprocess(table: DetectionTable, duration: float, detail: str) -> Tuple[Summary, Optional[EventTable]]:
+    """
+    分析结果后处理：按需合并事件并生成汇总信息
+
+    Args:
+        table: 片段级检测结果
+        duration: 解码后音频的真实时长（秒）
+        detail: DETAIL_SEGMENTS 或 DETAIL_EVENTS
+
+    Returns:
+        (汇总信息, 事件表；detail 为 segments 时为 None)
+    """
+    events = merge_events(table, config.EVENT_MERGE_GAP) if detail == DETAIL_EVENTS else None
+
+    summary = Summary(
+        totalDetections=len(table),
+        speciesCount=table.species_count,
+        audioDuration=format_seconds(duration),
+        audioDurationSeconds=round(duration, 3),
+        totalEvents=len(events) if events is not None else None
+    )
+    return summary, events
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+import numpy as np
+
+
+class RowBuffer:
+    """
+    按行号收集推理输出（logits / 嵌入），超过 spill_rows 行后转存到临时文件
+
+    各批次在调度器工作线程中乱序完成，按片段序号写入对应的行，不需要把所有批次的
+    输出留在内存里等最后拼接。转存后 finish() 返回只读的内存映射数组，
+    长录音的分数矩阵不占用进程内存，临时文件在数组释放后由系统删除。
+    """
+
+    def __init__(self, dtype, spill_rows: int, directory: Path, columns: Optional[int] = None):
+        self.dtype = np.dtype(dtype)
+        self.spill_rows = spill_rows
+        self.directory = directory
+        self.columns = columns
+        self._pieces: Dict[int, np.ndarray] = {}
+        self._held_rows = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    def write(self, offset: int, rows: np.ndarray):
+        """写入从第 offset 行开始的若干行（线程安全）"""
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        with self._lock:
+            if self.columns is None:
+                self.columns = rows.shape[1]
+            if self._file is not None:
+                self._write_file(offset, rows)
+                return
+            self._pieces[offset] = rows
+            self._held_rows += rows.shape[0]
+            if self._held_rows > self.spill_rows:
+                self._spill()
+
+    def finish(self, total: int) -> np.ndarray:
+        """
+        所有行写入后返回 [total, columns] 数组（转存过时为内存映射）
+
+        Raises:
+            ValueError: 写入的行与 total 不一致
+        """
+        with self._lock:
+            columns = self.columns or 0
+            if self._file is None:
+                result = np.empty((total, columns), dtype=self.dtype)
+                written = 0
+                for offset, rows in self._pieces.items():
+                    result[offset:offset + rows.shape[0]] = rows
+                    written += rows.shape[0]
+                self._pieces.clear()
+                self._held_rows = 0
+                if written != total:
+                    raise ValueError(f"Expected {total} rows, got {written}")
+                return result
+
+            size = total * columns * self.dtype.itemsize
+            if os.fstat(self._file.fileno()).st_size != size:
+                raise ValueError(f"Expected {total} rows in spill file, got {os.fstat(self._file.fileno()).st_size} bytes")
+            if size == 0:
+                self.close()
+                return np.empty((total, columns), dtype=self.dtype)
+            # 映射保持打开的文件描述符，关闭文件对象后数组仍然有效
+            result = np.memmap(self._file, dtype=self.dtype, mode="r", shape=(total, columns))
+            self._file.close()
+            self._file = None
+            return result
+
+    def close(self):
+        """丢弃已写入的数据（取消或失败时调用）"""
+        with self._lock:
+            self._pieces.clear()
+            self._held_rows = 0
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _spill(self):
+        """把内存中的行写入临时文件（调用方持有锁）"""
+        self._file = tempfile.TemporaryFile(dir=self.directory, prefix="rows-")
+        for offset, rows in self._pieces.items():
+            self._write_file(offset, rows)
+        self._pieces.clear()
+        self._held_rows = 0
+
+    def _write_file(self, offset: int, rows: np.ndarray):
+        position = offset * self.columns * self.dtype.itemsize
+        data = memoryview(rows).cast("B")
+        while data:
+            written = os.pwrite(self._file.fileno(), data, position)
+            data = data[written:]
+            position += written
@@ -0,0 +1,183 @@
+import io
+import logging
+import math
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+import numpy as np
+from .detection_table import DetectionTable
+
+logger = logging.getLogger(__name__)
+
+# to_table 每次比较的片段行数（长录音的比较结果不整体生成）
+_TABLE_ROWS = 4096
+
+
+def flat_sigmoid(logits: np.ndarray, sensitivity: float = 1.0) -> np.ndarray:
+    """
+    BirdNET 的 sigmoid 激活（灵敏度作为 logit 偏移，与 BirdNET-Analyzer 一致）
+
+    Args:
+        logits: 模型输出的 logits
+        sensitivity: 检测灵敏度，1.0 为默认值，越大越灵敏
+
+    Returns:
+        置信度（0-1）
+    """
+    bias = (sensitivity - 1.0) * 10.0
+    return 1.0 / (1.0 + np.exp(-np.clip(logits + bias, -20, 20)))
+
+
+def _logit_threshold(min_conf: float, sensitivity: float) -> float:
+    """置信度阈值对应的 logit 阈值（sigmoid 单调，可以直接在 logit 上比较）"""
+    min_conf = min(max(min_conf, 1e-6), 1 - 1e-6)
+    return math.log(min_conf / (1.0 - min_conf)) - (sensitivity - 1.0) * 10.0
+
+
+class ScoreMatrix:
+    """
+    一次分析的完整 片段×物种 分数矩阵
+
+    logits 以 float16 保存（6K 物种 × 1 小时录音约 15MB），
+    可以在不重新推理的情况下按任意阈值 / 灵敏度 / 物种重新筛选。
+    长录音的 logits 可以是磁盘上的内存映射数组（见 RowBuffer），筛选时按行分块读取。
+    """
+
+    def __init__(
+        self,
+        logits: np.ndarray,
+        start: np.ndarray,
+        end: np.ndarray,
+        species: Sequence[Tuple[str, str]],
+        duration: float,
+        file_name: str = "",
+        model: str = "",
+    ):
+        self.logits = logits if isinstance(logits, np.memmap) else np.asarray(logits, dtype=np.float16)
+        self.start = np.asarray(start, dtype=np.float32)
+        self.end = np.asarray(end, dtype=np.float32)
+        self.species = species
+        self.duration = float(duration)
+        self.file_name = file_name
+        self.model = model
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.logits.nbytes + self.start.nbytes + self.end.nbytes)
+
+    @property
+    def resident_nbytes(self) -> int:
+        """占用的内存字节数（内存映射的 logits 在磁盘上，不计入）"""
+        logits = 0 if isinstance(self.logits, np.memmap) else self.logits.nbytes
+        return int(logits + self.start.nbytes + self.end.nbytes)
+
+    def to_table(
+        self,
+        min_conf: float,
+        sensitivity: float = 1.0,
+        species_filter: Optional[np.ndarray] = None,
+    ) -> DetectionTable:
+        """
+        按阈值重新计算检测结果（全程向量化）
+
+        Args:
+            min_conf: 最小置信度
+            sensitivity: 检测灵敏度
+            species_filter: 只保留的物种列索引，None 表示全部
+
+        Returns:
+            DetectionTable，按片段顺序、片段内按置信度降序排列
+        """
+        # 先在 float16 上粗筛（阈值向下取一个 ulp），再对少量候选做精确比较
+        threshold = np.nextafter(np.float16(_logit_threshold(min_conf, sensitivity)), np.float16(-np.inf))
+        seg_parts, col_parts = [], []
+        for row in range(0, self.logits.shape[0], _TABLE_ROWS):
+            logits = self.logits[row:row + _TABLE_ROWS]
+            if species_filter is not None:
+                logits = logits[:, species_filter]
+            rows, cols = np.nonzero(logits >= threshold)
+            seg_parts.append(rows + row)
+            col_parts.append(cols)
+        seg = np.concatenate(seg_parts) if seg_parts else np.empty(0, dtype=np.intp)
+        col = np.concatenate(col_parts) if col_parts else np.empty(0, dtype=np.intp)
+        if species_filter is not None:
+            col = np.asarray(species_filter)[col]
+
+        conf = flat_sigmoid(self.logits[seg, col].astype(np.float32), sensitivity)
+        keep = conf >= min_conf
+        seg, col, conf = seg[keep], col[keep], conf[keep]
+
+        order = np.lexsort((-conf, seg))
+        seg, col, conf = seg[order], col[order], conf[order]
+
+        # 只把出现过的物种放进物种表
+        used, species_index = np.unique(col, return_inverse=True)
+        species = [self.species[i] for i in used.tolist()]
+
+        return DetectionTable(self.start[seg], self.end[seg], species_index, conf, species)
+
+    def species_indices(self, scientific_names: Sequence[str]) -> np.ndarray:
+        """
+        将学名列表映射为分数矩阵的列索引
+
+        Raises:
+            KeyError: 如果某个学名不在该模型的物种表中
+        """
+        lookup = {name.lower(): i for i, (name, _) in enumerate(self.species)}
+        missing = [n for n in scientific_names if n.strip().lower() not in lookup]
+        if missing:
+            raise KeyError(", ".join(missing))
+        return np.array(sorted({lookup[n.strip().lower()] for n in scientific_names}), dtype=np.int64)
+
+    def to_npz(self, sensitivity: Optional[float] = None) -> bytes:
+        """
+        导出为 .npz（供下游分析流程使用）
+
+        Args:
+            sensitivity: 一并写入的检测灵敏度（None 时不写入）
+        """
+        buffer = io.BytesIO()
+        self._write_npz(buffer, compressed=True, sensitivity=sensitivity)
+        return buffer.getvalue()
+
+    def save(self, path: Path):
+        """保存到磁盘（压缩 .npz）"""
+        with open(path, "wb") as f:
+            self._write_npz(f, compressed=True)
+
+    @classmethod
+    def from_npz(cls, data: bytes) -> "ScoreMatrix":
+        """从 to_npz 导出的字节加载"""
+        return cls.load(io.BytesIO(data))
+
+    @classmethod
+    def load(cls, path) -> "ScoreMatrix":
+        """从 .npz 文件（路径或文件对象）加载"""
+        with np.load(path, allow_pickle=False) as data:
+            species = list(zip(data["scientific_names"].tolist(), data["common_names"].tolist()))
+            return cls(
+                data["logits"],
+                data["start"],
+                data["end"],
+                species,
+                float(data["duration"]),
+                str(data["file_name"]),
+                str(data["model"]) if "model" in data.files else "",
+            )
+
+    def _write_npz(self, f, compressed: bool, sensitivity: Optional[float] = None):
+        save = np.savez_compressed if compressed else np.savez
+        extra = {}
+        if sensitivity is not None:
+            extra["sensitivity"] = np.float64(sensitivity)
+        save(
+            f,
+            logits=self.logits,
+            start=self.start,
+            end=self.end,
+            scientific_names=np.array([s[0] for s in self.species]),
+            common_names=np.array([s[1] for s in self.species]),
+            duration=np.float64(self.duration),
+            file_name=np.array(self.file_name),
+            model=np.array(self.model),
+            **extra,
+        )
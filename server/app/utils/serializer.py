@@ -0,0 +1,169 @@
+import logging
+from typing import Any, Dict, Optional, Union
+import msgpack
+import numpy as np
+import orjson
+from fastapi.responses import Response
+from ..models import AnalysisData, AnalysisResponse, Summary
+from .detection_table import DetectionTable
+from .events import EventTable
+from .postprocess import DETAIL_EVENTS, DETAIL_SEGMENTS
+
+logger = logging.getLogger(__name__)
+
+# 响应格式
+FORMAT_ROWS = "rows"          # 兼容旧版：逐行 Detection 列表
+FORMAT_COLUMNAR = "columnar"  # 列式 JSON（orjson）
+FORMAT_MSGPACK = "msgpack"    # 列式 MessagePack
+
+JSON_MEDIA_TYPE = "application/json"
+COLUMNAR_JSON_MEDIA_TYPE = "application/vnd.bird-echo.columnar+json"
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+# Accept 头中的媒体类型 -> 响应格式
+_MEDIA_TYPE_FORMATS = {
+    COLUMNAR_JSON_MEDIA_TYPE: FORMAT_COLUMNAR,
+    MSGPACK_MEDIA_TYPE: FORMAT_MSGPACK,
+    "application/msgpack": FORMAT_MSGPACK,
+    "application/vnd.msgpack": FORMAT_MSGPACK,
+    JSON_MEDIA_TYPE: FORMAT_ROWS,
+    "*/*": FORMAT_ROWS,
+}
+
+SUPPORTED_FORMATS = (FORMAT_ROWS, FORMAT_COLUMNAR, FORMAT_MSGPACK)
+
+
+def negotiate_format(accept: Optional[str], requested: Optional[str] = None) -> str:
+    """
+    根据查询参数或 Accept 头选择响应格式
+
+    Args:
+        accept: 请求的 Accept 头
+        requested: 显式指定的格式（查询参数 format），优先于 Accept 头
+
+    Returns:
+        FORMAT_ROWS / FORMAT_COLUMNAR / FORMAT_MSGPACK 之一
+
+    Raises:
+        ValueError: 如果显式指定了不支持的格式
+    """
+    if requested:
+        requested = requested.lower()
+        if requested not in SUPPORTED_FORMATS:
+            raise ValueError(f"Unsupported format: {requested}")
+        return requested
+
+    if not accept:
+        return FORMAT_ROWS
+
+    # 按 q 值从高到低匹配第一个支持的媒体类型
+    candidates = []
+    for position, item in enumerate(accept.split(",")):
+        parts = [p.strip() for p in item.split(";")]
+        quality = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        candidates.append((-quality, position, parts[0].lower()))
+
+    for neg_quality, _, media_type in sorted(candidates):
+        if neg_quality < 0 and media_type in _MEDIA_TYPE_FORMATS:
+            return _MEDIA_TYPE_FORMATS[media_type]
+
+    return FORMAT_ROWS
+
+
+def render_analysis(
+    fmt: str,
+    analysis_id: str,
+    file_name: str,
+    analysis_time: float,
+    table: DetectionTable,
+    summary: Summary,
+    events: Optional[EventTable] = None,
+    images: Optional[Dict[str, Optional[str]]] = None
+) -> Response:
+    """
+    按协商的格式序列化分析结果
+
+    直接返回已序列化的 Response，避免 FastAPI 按 response_model 再校验一遍。
+    传入 events 时只返回事件，不再返回逐片段结果；传入 images 时附带各物种的图片 URL。
+    """
+    detail = DETAIL_EVENTS if events is not None else DETAIL_SEGMENTS
+
+    if fmt == FORMAT_ROWS:
+        response = AnalysisResponse(
+            success=True,
+            data=AnalysisData(
+                analysisId=analysis_id,
+                fileName=file_name,
+                analysisTime=analysis_time,
+                detail=detail,
+                detections=table.to_detections() if events is None else [],
+                events=events.to_events() if events is not None else None,
+                summary=summary,
+                images=images
+            )
+        )
+        return render_json(response.model_dump_json())
+
+    data = {
+        "analysisId": analysis_id,
+        "fileName": file_name,
+        "analysisTime": analysis_time,
+        "format": FORMAT_COLUMNAR,
+        "detail": detail,
+        "species": table.species_columns(),
+        "summary": summary.model_dump()
+    }
+    if events is None:
+        data["detections"] = table.to_columns()
+    else:
+        data["events"] = events.to_columns()
+    if images is not None:
+        data["images"] = images
+    return render({"success": True, "data": data}, fmt)
+
+
+def render(payload: Dict[str, Any], fmt: str) -> Response:
+    """
+    序列化列式响应
+
+    Args:
+        payload: 响应内容，可以包含 numpy 数组
+        fmt: FORMAT_COLUMNAR 或 FORMAT_MSGPACK
+
+    Returns:
+        已序列化的 Response（不再经过 response_model 二次校验）
+    """
+    if fmt == FORMAT_MSGPACK:
+        content = msgpack.packb(payload, default=_msgpack_default, use_bin_type=True)
+        media_type = MSGPACK_MEDIA_TYPE
+    else:
+        content = orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+        media_type = COLUMNAR_JSON_MEDIA_TYPE
+
+    return Response(content=content, media_type=media_type, headers={"Vary": "Accept"})
+
+
+def render_json(content: Union[str, bytes]) -> Response:
+    """返回已序列化的 JSON 内容"""
+    return Response(content=content, media_type=JSON_MEDIA_TYPE, headers={"Vary": "Accept"})
+
+
+def _msgpack_default(obj: Any) -> Any:
+    """
+    MessagePack 不认识 numpy 类型：数组编码为小端字节串并附带 dtype，
+    客户端可直接用 Float32Array / Int32Array 读取
+    """
+    if isinstance(obj, np.ndarray):
+        arr = np.ascontiguousarray(obj)
+        if arr.dtype.byteorder == ">":
+            arr = arr.astype(arr.dtype.newbyteorder("<"))
+        return {"dtype": arr.dtype.str, "shape": list(arr.shape), "data": arr.tobytes()}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not MessagePack serializable")
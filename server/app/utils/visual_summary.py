@@ -0,0 +1,200 @@
+import io
+from pathlib import Path
+from typing import Callable, Iterator, List, Tuple
+import numpy as np
+from .row_buffer import RowBuffer
+
+# 频谱图和各缩放级别超过该列数后转存到临时文件（128 个频带约 8MB）
+SPILL_COLUMNS = 1 << 16
+
+
+class VisualSummary:
+    """
+    分析过程中顺带计算的波形峰值和频谱图（供结果页时间轴绘制）
+
+    直接使用流水线已解码的 48 kHz 单声道块，每块处理完只保留不足一列的尾部采样：
+    - 波形：每 samples_per_peak 个采样一对 (最小值, 最大值)，int8
+    - 频谱图：不重叠的 Hann 窗 STFT，0 ~ max_freq 按频带平均为 bins 个频带，
+      dB 值映射到 uint8（0 对应 -db_range dB，255 对应 0 dBFS）
+
+    频谱图写入 RowBuffer，长录音超过 spill_rows 列后转存到临时文件。
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        peaks_per_second: int,
+        fft_size: int,
+        bins: int,
+        max_freq: float,
+        db_range: float,
+        spill_rows: int,
+        spill_dir: Path
+    ):
+        self.sample_rate = sample_rate
+        self.samples_per_peak = max(sample_rate // max(peaks_per_second, 1), 1)
+        self.fft_size = fft_size
+        self.db_range = db_range
+        # 只保留 max_freq 以下、能被 bins 整除的 FFT 频点
+        usable = min(int(max_freq * fft_size / sample_rate), fft_size // 2)
+        self.band_size = max(usable // bins, 1)
+        self.bins = min(bins, usable)
+        self.max_freq = self.bins * self.band_size * sample_rate / fft_size
+        self._window = np.hanning(fft_size).astype(np.float32)
+        self._power_scale = np.float32(1.0 / float(self._window.sum()) ** 2)
+        self._peaks: List[np.ndarray] = []
+        self._peak_tail = np.empty(0, dtype=np.float32)
+        self._spectrogram = RowBuffer(np.uint8, spill_rows, spill_dir, self.bins)
+        self._spectrogram_rows = 0
+        self._fft_tail = np.empty(0, dtype=np.float32)
+        self.peaks = np.empty((0, 2), dtype=np.int8)
+        self.spectrogram = np.empty((0, self.bins), dtype=np.uint8)
+
+    @property
+    def peaks_per_second(self) -> float:
+        return self.sample_rate / self.samples_per_peak
+
+    @property
+    def columns_per_second(self) -> float:
+        """频谱图每秒的列数"""
+        return self.sample_rate / self.fft_size
+
+    def feed(self, block: np.ndarray):
+        """追加一个音频块"""
+        self._peak_tail = _consume(self._peak_tail, block, self.samples_per_peak, self._add_peaks)
+        self._fft_tail = _consume(self._fft_tail, block, self.fft_size, self._add_columns)
+
+    def finish(self) -> "VisualSummary":
+        """输入结束：尾部不足一列的采样补齐后计入，之后 peaks / spectrogram 可用"""
+        if self._peak_tail.size:
+            self._add_peaks(np.pad(self._peak_tail, (0, self.samples_per_peak - self._peak_tail.size), mode="edge"))
+        if self._fft_tail.size:
+            self._add_columns(np.pad(self._fft_tail, (0, self.fft_size - self._fft_tail.size)))
+        self._peak_tail = self._fft_tail = np.empty(0, dtype=np.float32)
+        if self._peaks:
+            self.peaks = np.concatenate(self._peaks)
+        self._peaks = []
+        self.spectrogram = self._spectrogram.finish(self._spectrogram_rows)
+        return self
+
+    def to_npz(self) -> bytes:
+        """导出 finish() 之后的峰值和频谱图（供分析结果缓存使用）"""
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            peaks=self.peaks,
+            spectrogram=self.spectrogram,
+            params=np.array(
+                [self.sample_rate, self.samples_per_peak, self.fft_size, self.max_freq, self.db_range],
+                dtype=np.float64
+            ),
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_npz(cls, data: bytes) -> "VisualSummary":
+        """从 to_npz 导出的字节恢复已完成的视图（之后不能再 feed）"""
+        with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+            sample_rate, samples_per_peak, fft_size, max_freq, db_range = npz["params"].tolist()
+            peaks = npz["peaks"]
+            spectrogram = npz["spectrogram"]
+        summary = cls.__new__(cls)
+        summary.sample_rate = int(sample_rate)
+        summary.samples_per_peak = int(samples_per_peak)
+        summary.fft_size = int(fft_size)
+        summary.bins = spectrogram.shape[1]
+        summary.max_freq = max_freq
+        summary.db_range = db_range
+        summary._peaks = []
+        summary._spectrogram = RowBuffer(np.uint8, SPILL_COLUMNS, Path(), summary.bins)
+        summary.peaks = peaks
+        summary.spectrogram = spectrogram
+        return summary
+
+    def close(self):
+        """丢弃已计算的数据（取消或失败时调用）"""
+        self._peaks = []
+        self._spectrogram.close()
+
+    def _add_peaks(self, samples: np.ndarray):
+        """计算峰值对（samples 长度是 samples_per_peak 的整数倍）"""
+        frames = samples.reshape(-1, self.samples_per_peak)
+        pairs = np.stack((frames.min(axis=1), frames.max(axis=1)), axis=1)
+        self._peaks.append(np.clip(np.round(pairs * 127), -127, 127).astype(np.int8))
+
+    def _add_columns(self, samples: np.ndarray):
+        """计算频谱列（samples 长度是 fft_size 的整数倍）"""
+        frames = samples.reshape(-1, self.fft_size) * self._window
+        count = frames.shape[0]
+        spectrum = np.fft.rfft(frames, axis=1)[:, :self.bins * self.band_size]
+        power = (spectrum.real ** 2 + spectrum.imag ** 2) * self._power_scale
+        bands = power.reshape(count, self.bins, self.band_size).mean(axis=2)
+        db = 10.0 * np.log10(np.maximum(bands, 1e-20))
+        scaled = np.clip((db + self.db_range) * (255.0 / self.db_range), 0, 255)
+        self._spectrogram.write(self._spectrogram_rows, scaled.astype(np.uint8))
+        self._spectrogram_rows += count
+
+
+def _consume(tail: np.ndarray, block: np.ndarray, frame: int, process: Callable[[np.ndarray], None]) -> np.ndarray:
+    """
+    把上一块剩下的采样和新块拼成整帧交给 process，返回新的剩余采样
+
+    只拼接补齐一帧所需的部分，不复制整个块；剩余采样复制出来，不引用块的内存。
+    """
+    if tail.size:
+        need = frame - tail.size
+        if block.size < need:
+            return np.concatenate((tail, block))
+        process(np.concatenate((tail, block[:need])))
+        block = block[need:]
+    count = block.size // frame
+    if count:
+        process(block[:count * frame])
+    return block[count * frame:].copy()
+
+
+def reduce_peaks(rows: np.ndarray) -> np.ndarray:
+    """相邻两列峰值合并（最小值取小、最大值取大）"""
+    pairs = _pairs(rows)
+    return np.stack((pairs[:, :, 0].min(axis=1), pairs[:, :, 1].max(axis=1)), axis=1)
+
+
+def reduce_spectrogram(rows: np.ndarray) -> np.ndarray:
+    """相邻两列频谱合并（取最大值，缩小后短促的鸣声仍然可见）"""
+    return _pairs(rows).max(axis=1)
+
+
+def iter_zoom_levels(
+    base: np.ndarray,
+    reduce: Callable[[np.ndarray], np.ndarray],
+    tile_columns: int,
+    spill_rows: int,
+    spill_dir: Path
+) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    从基础分辨率开始逐级减半列数，直到整个时间轴放得进一个瓦片
+
+    每级按块从上一级计算，长录音的各级同样可以转存到临时文件。
+
+    Yields:
+        (缩放级别, 该级别的 [列数, 每列值数] 数组)，级别 0 为基础分辨率
+    """
+    level = base
+    zoom = 0
+    chunk = max(tile_columns, 1) * 2
+    while True:
+        yield zoom, level
+        if level.shape[0] <= tile_columns:
+            return
+        reduced = RowBuffer(level.dtype, spill_rows, spill_dir, level.shape[1])
+        for i in range(0, level.shape[0], chunk):
+            reduced.write(i // 2, reduce(np.asarray(level[i:i + chunk])))
+        level = reduced.finish((level.shape[0] + 1) // 2)
+        zoom += 1
+
+
+def _pairs(rows: np.ndarray) -> np.ndarray:
+    """[n, k] -> [ceil(n/2), 2, k]，奇数行时重复最后一行"""
+    if rows.shape[0] % 2:
+        rows = np.concatenate((rows, rows[-1:]))
+    return rows.reshape(rows.shape[0] // 2, 2, *rows.shape[1:])
@@ -0,0 +1,124 @@
+"""
+Build the offline species image pack served by /api/bird-image.
+
+Resolves the Wikipedia thumbnail for every label of the installed BirdNET
+model, downloads them with bounded concurrency and writes a single indexed
+pack file (see app/services/image_pack.py). At runtime the server memory-maps
+the pack and only falls back to live Wikipedia requests for species that are
+missing from it.
+
+Usage:
+    python build_image_pack.py [--output image_pack.bin] [--concurrency 16]
+    python build_image_pack.py --labels labels.txt --api-base http://127.0.0.1:8000/summary/
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+from app import config
+from app.services.bird_image_service import USER_AGENT, BirdImageService, fetch_thumbnail_url, image_extension
+from app.services.image_pack import EXTENSIONS, write_pack
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RetryableError(Exception):
+    pass
+
+
+def load_labels(labels_path, model_id):
+    """Scientific names from a "Scientific_Common" labels file, or from the installed model."""
+    if labels_path:
+        lines = Path(labels_path).read_text(encoding="utf-8").splitlines()
+        names = [line.strip().partition("_")[0] for line in lines if line.strip()]
+    else:
+        from app.services.model_registry import model_registry
+        names = [scientific_name for scientific_name, _ in model_registry.species(model_id)]
+    return list(dict.fromkeys(names))
+
+
+async def fetch_image(client, semaphore, name, retries):
+    """Returns (extension, bytes), or None if the species has no usable thumbnail."""
+    async with semaphore:
+        for attempt in range(retries + 1):
+            try:
+                status_code, image_url = await fetch_thumbnail_url(client, name)
+                if status_code in RETRY_STATUS:
+                    raise RetryableError(f"summary returned {status_code}")
+                if image_url is None:
+                    return None
+                ext = image_extension(image_url)
+                if ext not in EXTENSIONS:
+                    logging.warning(f"Skipping {name}: unsupported image type {ext}")
+                    return None
+                response = await client.get(image_url, follow_redirects=True)
+                if response.status_code in RETRY_STATUS:
+                    raise RetryableError(f"image returned {response.status_code}")
+                if response.status_code != 200:
+                    return None
+                return ext, response.content
+            except (httpx.HTTPError, RetryableError, ValueError) as e:
+                if attempt == retries:
+                    logging.warning(f"Giving up on {name}: {e}")
+                    return None
+                await asyncio.sleep(2 ** attempt)
+
+
+async def build(names, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, headers={"User-Agent": USER_AGENT}, limits=limits) as client:
+        tasks = [asyncio.ensure_future(fetch_image(client, semaphore, name, args.retries)) for name in names]
+        images = []
+        done = 0
+        for name, task in zip(names, tasks):
+            result = await task
+            done += 1
+            if result is not None:
+                ext, data = result
+                images.append((BirdImageService.cache_key(name), ext, data))
+            if done % 100 == 0 or done == len(names):
+                print(f"\rResolved {done}/{len(names)} species, {len(images)} images", end="", flush=True)
+        print()
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline species image pack")
+    parser.add_argument("--output", default=str(config.IMAGE_PACK_PATH), help="pack file to write")
+    parser.add_argument("--labels", help="labels file (default: labels of the installed model)")
+    parser.add_argument("--model", default=None, help="model id whose labels are used (default: DEFAULT_MODEL)")
+    parser.add_argument("--api-base", default=config.WIKIPEDIA_SUMMARY_URL, help="Wikipedia page summary endpoint")
+    parser.add_argument("--concurrency", type=int, default=16, help="parallel requests")
+    parser.add_argument("--retries", type=int, default=3, help="retries per species on 429/5xx/network errors")
+    parser.add_argument("--timeout", type=float, default=20.0, help="HTTP timeout in seconds")
+    parser.add_argument("--limit", type=int, default=0, help="only the first N species (for testing)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    config.WIKIPEDIA_SUMMARY_URL = args.api_base
+
+    names = load_labels(args.labels, args.model)
+    if args.limit > 0:
+        names = names[:args.limit]
+    if not names:
+        print("Error: no labels found.")
+        sys.exit(1)
+
+    print(f"Fetching images for {len(names)} species (concurrency {args.concurrency})...")
+    start_time = time.time()
+    images = asyncio.run(build(names, args))
+
+    output = Path(args.output)
+    write_pack(output, images)
+    size_mb = output.stat().st_size / 1024 / 1024
+    print(f"Wrote {len(images)} images ({size_mb:.1f} MB) to {output} in {time.time() - start_time:.0f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+DEFAULT_EXTENSIONS = ".wav,.wave,.flac,.mp3,.ogg,.opus"
+
+
+# ---------------------------------------------------------------------------
+# 工作进程（spawn 方式启动）
+# ---------------------------------------------------------------------------
+
+def init_worker(log_level):
+    logging.basicConfig(level=log_level, format="%(asctime)s - %(processName)s - %(levelname)s - %(message)s")
+
+
+def analyze_file(path, min_conf, sensitivity, model_id):
+    """
+    逐块解码一个文件、推理并按阈值筛选分数
+
+    内存占用只有一个解码块加 float16 分数矩阵，数小时的归档录音也没有问题。
+    """
+    import numpy as np
+    from app import config
+    from app.services.birdnet_service import birdnet_service
+    from app.services.model_registry import model_registry
+    from app.utils.audio_stream import iter_audio_blocks
+    from app.utils.score_matrix import ScoreMatrix
+
+    start_time = time.time()
+    segment_length = birdnet_service.segment_length
+    batch_segments = max(config.SCHEDULER_BATCH_SEGMENTS, 1)
+    segmenter = birdnet_service.create_segmenter()
+    logits, starts = [], []
+
+    def infer(chunks, chunk_starts):
+        if chunks.shape[0]:
+            logits.append(birdnet_service.predict_logits(chunks, model_id))
+            starts.append(chunk_starts)
+
+    blocks = iter_audio_blocks(
+        Path(path),
+        birdnet_service.sample_rate,
+        batch_segments * segment_length,
+        birdnet_service.load_audio
+    )
+    for block in blocks:
+        infer(*segmenter.feed(block))
+    infer(*segmenter.finish())
+
+    species = model_registry.species(model_id)
+    all_starts = np.concatenate(starts) if starts else np.empty(0, dtype=np.float32)
+    scores = ScoreMatrix(
+        np.concatenate(logits) if logits else np.empty((0, len(species)), dtype=np.float16),
+        all_starts,
+        np.minimum(all_starts + segment_length, segmenter.duration),
+        species,
+        segmenter.duration,
+        Path(path).name,
+        model_registry.resolve(model_id),
+    )
+    table = scores.to_table(min_conf, sensitivity)
+    return {
+        "duration": segmenter.duration,
+        "segments": int(all_starts.shape[0]),
+        "start": table.start,
+        "end": table.end,
+        "species_index": table.species_index,
+        "confidence": table.confidence,
+        "species": table.species,
+        "elapsed": time.time() - start_time,
+    }
+
+
+# ---------------------------------------------------------------------------
+# 进度清单和输出存储（主进程）
+# ---------------------------------------------------------------------------
+
+class Manifest:
+    """已完成文件的追加式 JSONL 记录，按路径 + 大小 + mtime 识别文件"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 崩溃时写了一半的最后一行
+                    self.entries[entry["file"]] = entry
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def is_done(self, rel_path, stat, retry_failed):
+        entry = self.entries.get(rel_path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime"] != int(stat.st_mtime):
+            return False
+        return entry["status"] == "done" or not retry_failed
+
+    def record(self, entries):
+        for entry in entries:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.entries[entry["file"]] = entry
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class SqliteWriter:
+    """SQLite 数据库中的检测结果表，每次写入一个事务"""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS detections ("
+            "file TEXT NOT NULL, start REAL NOT NULL, end REAL NOT NULL, "
+            "scientific_name TEXT NOT NULL, common_name TEXT NOT NULL, "
+            "confidence REAL NOT NULL, model TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_detections_file ON detections (file)")
+        self.conn.commit()
+
+    def write(self, results, model_id):
+        with self.conn:
+            for rel_path, result in results:
+                # 重新分析的文件（例如写入清单之前崩溃）替换旧的行
+                self.conn.execute("DELETE FROM detections WHERE file = ?", (rel_path,))
+                self.conn.executemany(
+                    "INSERT INTO detections VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    iter_rows(rel_path, result, model_id)
+                )
+
+    def close(self):
+        self.conn.close()
+
+
+class ParquetWriter:
+    """每次写入一个 Parquet 分片文件，清单中没有引用的分片已过期，启动时删除"""
+
+    def __init__(self, directory, manifest):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            sys.exit("Error: Parquet output requires pyarrow. Please run 'pip install pyarrow' first.")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        referenced = {e.get("part") for e in manifest.entries.values()}
+        for part in self.directory.glob("part-*.parquet"):
+            if part.name not in referenced:
+                part.unlink()
+        self._next = 1 + max((int(p.stem.split("-")[1]) for p in self.directory.glob("part-*.parquet")), default=0)
+
+    def write(self, results, model_id):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        rows = [row for rel_path, result in results for row in iter_rows(rel_path, result, model_id)]
+        columns = list(zip(*rows)) if rows else [[] for _ in range(7)]
+        table = pa.table({
+            "file": pa.array(columns[0], pa.string()),
+            "start": pa.array(columns[1], pa.float32()),
+            "end": pa.array(columns[2], pa.float32()),
+            "scientific_name": pa.array(columns[3], pa.string()),
+            "common_name": pa.array(columns[4], pa.string()),
+            "confidence": pa.array(columns[5], pa.float32()),
+            "model": pa.array(columns[6], pa.string()),
+        })
+        name = f"part-{self._next:05d}.parquet"
+        tmp_path = self.directory / (name + ".tmp")
+        pq.write_table(table, tmp_path, compression="zstd")
+        tmp_path.replace(self.directory / name)
+        self._next += 1
+        return name
+
+    def close(self):
+        pass
+
+
+def iter_rows(rel_path, result, model_id):
+    species = result["species"]
+    for start, end, idx, conf in zip(
+        result["start"].tolist(),
+        result["end"].tolist(),
+        result["species_index"].tolist(),
+        result["confidence"].tolist(),
+    ):
+        yield rel_path, round(start, 3), round(end, 3), species[idx][0], species[idx][1], round(conf, 4), model_id
+
+
+def write_to_store(store, root, results, model_id):
+    """把结果写入检测结果存储，录音时间取自文件名或 mtime"""
+    from app.services.detection_store import recording_time
+    from app.utils.detection_table import DetectionTable
+
+    for rel_path, result in results:
+        table = DetectionTable(
+            result["start"], result["end"], result["species_index"], result["confidence"], result["species"]
+        )
+        path = Path(root) / rel_path
+        # mtime 通常是录音机关闭文件的时间，即录音结束时间
+        recorded_at = recording_time(path.name, path.stat().st_mtime - result["duration"])
+        store.add(f"bulk:{rel_path}", rel_path, table, result["duration"], recorded_at, model_id, "bulk")
+
+
+# ---------------------------------------------------------------------------
+# 主流程
+# ---------------------------------------------------------------------------
+
+def find_files(root, extensions):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if Path(name).suffix.lower() in extensions:
+                yield Path(dirpath) / name
+
+
+def format_duration(seconds):
+    hours, rem = divmod(int(seconds), 3600)
+    return f"{hours}:{rem // 60:02d}:{rem % 60:02d}"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Analyze a directory tree of recordings with BirdNET. Interrupted runs resume where they stopped."
+    )
+    parser.add_argument("input", type=Path, help="Root directory of the recording archive")
+    parser.add_argument("--output", type=Path, default=Path("bulk_results.sqlite"),
+                        help="SQLite file, or directory for --format parquet (default: bulk_results.sqlite)")
+    parser.add_argument("--format", choices=["sqlite", "parquet"], default="sqlite", help="Output store")
+    parser.add_argument("--manifest", type=Path, help="Progress manifest (default: next to the output)")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: CPUs / --threads)")
+    parser.add_argument("--threads", type=int, help="TFLite threads per worker (default: TFLITE_THREADS)")
+    parser.add_argument("--model", help="Model id (default: DEFAULT_MODEL)")
+    parser.add_argument("--min-conf", type=float, help="Minimum confidence (default: MIN_CONFIDENCE)")
+    parser.add_argument("--sensitivity", type=float, help="Detection sensitivity (default: SENSITIVITY)")
+    parser.add_argument("--extensions", default=DEFAULT_EXTENSIONS, help=f"File extensions (default: {DEFAULT_EXTENSIONS})")
+    parser.add_argument("--batch-files", type=int, default=50, help="Files per output batch (default: 50)")
+    parser.add_argument("--store", action="store_true",
+                        help="Also write detections into the server's detection store (DETECTION_STORE_PATH) for /api/stats")
+    parser.add_argument("--retry-failed", action="store_true", help="Retry files that failed in a previous run")
+    parser.add_argument("--verbose", action="store_true", help="Log worker output")
+    args = parser.parse_args()
+
+    if not args.input.is_dir():
+        sys.exit(f"Error: {args.input} is not a directory")
+
+    from app import config
+
+    threads = args.threads or config.TFLITE_THREADS
+    workers = args.workers or max((os.cpu_count() or 1) // threads, 1)
+    model_id = args.model or config.DEFAULT_MODEL
+    min_conf = config.MIN_CONFIDENCE if args.min_conf is None else args.min_conf
+    sensitivity = config.SENSITIVITY if args.sensitivity is None else args.sensitivity
+    extensions = {e.strip().lower() if e.strip().startswith(".") else "." + e.strip().lower()
+                  for e in args.extensions.split(",") if e.strip()}
+
+    # 工作进程导入 app.config 时读取这些环境变量
+    os.environ["TFLITE_THREADS"] = str(threads)
+    os.environ["MODEL_INTERPRETERS"] = "1"
+    os.environ["MODEL_PRELOAD"] = ""
+
+    if args.manifest:
+        manifest_path = args.manifest
+    elif args.format == "parquet":
+        args.output.mkdir(parents=True, exist_ok=True)
+        manifest_path = args.output / "manifest.jsonl"
+    else:
+        manifest_path = args.output.with_name(args.output.name + ".manifest.jsonl")
+    manifest = Manifest(manifest_path)
+    writer = ParquetWriter(args.output, manifest) if args.format == "parquet" else SqliteWriter(args.output)
+    store = None
+    if args.store:
+        from app.services.detection_store import detection_store as store
+        print(f"Also writing to detection store: {config.DETECTION_STORE_PATH}")
+
+    print(f"Scanning {args.input} ...")
+    pending = []
+    skipped = 0
+    for path in find_files(args.input, extensions):
+        rel_path = path.relative_to(args.input).as_posix()
+        stat = path.stat()
+        if manifest.is_done(rel_path, stat, args.retry_failed):
+            skipped += 1
+        else:
+            pending.append((path, rel_path, stat))
+    print(f"{len(pending)} files to analyze, {skipped} already done (manifest: {manifest_path})")
+    print(f"Workers: {workers} x {threads} TFLite threads, model: {model_id}, min_conf: {min_conf}")
+    if not pending:
+        return 0
+
+    start_time = time.time()
+    audio_seconds = 0.0
+    done = failed = detections = 0
+    batch_results, batch_entries = [], []
+
+    def flush():
+        nonlocal batch_results, batch_entries
+        if not batch_entries:
+            return
+        part = writer.write(batch_results, model_id) if batch_results else None
+        if store is not None:
+            write_to_store(store, args.input, batch_results, model_id)
+        for entry in batch_entries:
+            if part and entry["status"] == "done":
+                entry["part"] = part
+        manifest.record(batch_entries)
+        batch_results, batch_entries = [], []
+
+    log_level = logging.INFO if args.verbose else logging.WARNING
+    context = multiprocessing.get_context("spawn")
+    queue = iter(pending)
+    in_flight = {}
+    try:
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker, initargs=(log_level,)) as pool:
+            while True:
+                # 限制同时提交的文件数，超大归档不会一次排入上百万个任务
+                while len(in_flight) < workers * 2:
+                    item = next(queue, None)
+                    if item is None:
+                        break
+                    future = pool.submit(analyze_file, str(item[0]), min_conf, sensitivity, model_id)
+                    in_flight[future] = item
+                if not in_flight:
+                    break
+
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path, rel_path, stat = in_flight.pop(future)
+                    entry = {"file": rel_path, "size": stat.st_size, "mtime": int(stat.st_mtime)}
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        failed += 1
+                        entry.update(status="failed", error=str(e))
+                        print(f"FAILED {rel_path}: {e}")
+                    else:
+                        done += 1
+                        audio_seconds += result["duration"]
+                        detections += len(result["start"])
+                        entry.update(
+                            status="done",
+                            duration=round(result["duration"], 3),
+                            segments=result["segments"],
+                            detections=len(result["start"]),
+                        )
+                        batch_results.append((rel_path, result))
+
+                    batch_entries.append(entry)
+                    elapsed = time.time() - start_time
+                    print(
+                        f"[{done + failed}/{len(pending)}] {rel_path} | "
+                        f"{format_duration(audio_seconds)} audio in {format_duration(elapsed)} | "
+                        f"{audio_seconds / max(elapsed, 1e-9):.1f} audio h/h"
+                    )
+
+                if len(batch_entries) >= args.batch_files:
+                    flush()
+    except KeyboardInterrupt:
+        print("\nInterrupted, saving finished files ...")
+    finally:
+        flush()
+        writer.close()
+        manifest.close()
+
+    elapsed = time.time() - start_time
+    print(
+        f"\nDone: {done} files, {failed} failed, {detections} detections. "
+        f"{audio_seconds / 3600:.2f} audio hours in {elapsed / 3600:.2f} wall-clock hours "
+        f"({audio_seconds / max(elapsed, 1e-9):.1f} audio hours per hour)"
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
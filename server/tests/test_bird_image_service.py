@@ -0,0 +1,76 @@
+import asyncio
+from app.services.bird_image_service import BirdImageService
+
+
+def _service(release: asyncio.Event, calls: list) -> BirdImageService:
+    service = BirdImageService()
+
+    async def resolve(decoded_name, key):
+        calls.append(decoded_name)
+        await release.wait()
+        return f"/api/bird-image-file/{key}.jpg"
+
+    service._resolve = resolve
+    return service
+
+
+def test_image_urls_timeout_keeps_shared_lookup():
+    async def run():
+        release = asyncio.Event()
+        calls = []
+        service = _service(release, calls)
+
+        # 先有一个等待中的请求（例如后台预取）
+        waiter = asyncio.ensure_future(service.image_url("Parus major"))
+        await asyncio.sleep(0)
+
+        result = await service.image_urls(["Parus major", "Parus major"], timeout=0.01)
+        assert result == {}
+        key = service.cache_key("Parus major")
+        task = service._inflight[key]
+        assert not task.cancelled()
+
+        release.set()
+        assert await waiter == f"/api/bird-image-file/{key}.jpg"
+        assert task.result() == f"/api/bird-image-file/{key}.jpg"
+        assert calls == ["Parus major"]
+        assert key not in service._inflight
+
+    asyncio.run(run())
+
+
+def test_image_urls_cancelled_caller_keeps_shared_lookup():
+    async def run():
+        release = asyncio.Event()
+        calls = []
+        service = _service(release, calls)
+
+        caller = asyncio.ensure_future(service.image_urls(["Parus major"], timeout=10))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.gather(caller, return_exceptions=True)
+        await asyncio.sleep(0)
+
+        # 调用方的等待已全部结束，共享的查询仍在进行
+        key = service.cache_key("Parus major")
+        waiters = [t for t in asyncio.all_tasks() if t is not asyncio.current_task() and t is not service._inflight[key]]
+        assert waiters == []
+        assert not service._inflight[key].done()
+
+        release.set()
+        assert await service.image_url("Parus major") is not None
+        assert calls == ["Parus major"]
+
+    asyncio.run(run())
+
+
+def test_image_urls_returns_finished_lookups():
+    async def run():
+        release = asyncio.Event()
+        release.set()
+        service = _service(release, [])
+        result = await service.image_urls(["Parus major", "Turdus merula"], timeout=1)
+        assert set(result) == {"Parus major", "Turdus merula"}
+        assert await service.image_urls([], timeout=1) == {}
+
+    asyncio.run(run())
@@ -0,0 +1,97 @@
+import os
+import time
+import pytest
+from app.services.cache import CacheBackend, FileCache, MemoryCache, NearCache
+
+
+class FailingCache(CacheBackend):
+    """每次调用都抛出异常的后端（模拟 redis 连接断开）"""
+
+    name = "failing"
+
+    def get(self, key):
+        raise ConnectionError("backend down")
+
+    def set(self, key, value, ttl):
+        raise ConnectionError("backend down")
+
+    def delete(self, key):
+        raise ConnectionError("backend down")
+
+
+def test_near_cache_treats_backend_errors_as_misses():
+    near = NearCache(FailingCache(), max_bytes=1024, near_ttl=60)
+    assert near.get("a") is None
+    near.set("a", b"1", 3600)
+    near.set_many({"b": b"2"}, 3600)
+    near.delete("c")
+    # 写入失败时本地层仍然可用
+    assert near.get("a") == b"1"
+    assert near.get("b") == b"2"
+
+
+def test_near_cache_local_entries_expire_after_near_ttl(monkeypatch):
+    backend = MemoryCache(1024)
+    near = NearCache(backend, max_bytes=1024, near_ttl=10)
+    near.set("a", b"1", 3600)
+    backend.set("a", b"2", 3600)  # 其他副本更新了同一个键
+    assert near.get("a") == b"1"
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert near.get("a") == b"2"
+
+
+def test_near_cache_local_entries_respect_shorter_ttl(monkeypatch):
+    near = NearCache(MemoryCache(1024), max_bytes=1024, near_ttl=60)
+    near.set("a", b"1", 5)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 6)
+    assert near.get("a") is None
+
+
+def test_near_cache_skip_prefixes_bypass_local_layer():
+    backend = MemoryCache(1024)
+    near = NearCache(backend, max_bytes=1024, near_ttl=60, skip_prefixes=("visual:",))
+    near.set_many({"visual:a": b"1", "other": b"2"}, 3600)
+    near.get("visual:a")
+    assert near.stats()["near"]["entries"] == 1
+    assert backend.get("visual:a") == b"1"
+
+
+def test_file_cache_expires_by_mtime(tmp_path):
+    cache = FileCache(tmp_path)
+    cache.set("a", b"1", 3600)
+    path = cache._path("a")
+    assert cache.get("a") == b"1"
+    assert path.stat().st_mtime > time.time()
+
+    past = time.time() - 1
+    os.utime(path, (past, past))
+    assert cache.get("a") is None
+    assert not path.exists()
+
+
+def test_file_cache_purges_expired_files(tmp_path):
+    cache = FileCache(tmp_path)
+    cache.set("a", b"1", 3600)
+    cache.set("b", b"2", 3600)
+    past = time.time() - 1
+    os.utime(cache._path("a"), (past, past))
+
+    cache._last_purge = 0.0
+    cache._maybe_purge()
+    assert not cache._path("a").exists()
+    assert cache.get("b") == b"2"
+
+
+@pytest.mark.parametrize("durable", [False, True])
+def test_file_cache_overwrite_and_delete(tmp_path, durable):
+    cache = FileCache(tmp_path, durable=durable)
+    cache.set("a", b"1", 3600)
+    cache.set("a", b"22", 3600)
+    assert cache.get("a") == b"22"
+    cache.delete("a")
+    cache.delete("a")
+    assert cache.get("a") is None
+    assert not list(tmp_path.glob("*/.tmp-*"))
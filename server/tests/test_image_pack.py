@@ -0,0 +1,78 @@
+import hashlib
+import pytest
+from app.services.image_pack import ImagePack, write_pack
+
+
+def _key(name: str) -> str:
+    return hashlib.md5(name.encode()).hexdigest()
+
+
+IMAGES = [
+    (_key("Parus major"), ".jpg", b"parus"),
+    (_key("Turdus merula"), ".PNG", b"turdus-merula"),
+    (_key("Erithacus rubecula"), ".svg", b"<svg/>"),
+    (_key("Sturnus vulgaris"), ".bmp", b"sturnus"),
+]
+
+
+@pytest.fixture
+def pack(tmp_path):
+    path = tmp_path / "images.pack"
+    write_pack(path, IMAGES)
+    pack = ImagePack.open(path)
+    yield pack
+    pack.close()
+
+
+def test_round_trip(pack):
+    assert len(pack) == len(IMAGES)
+    for key, ext, data in IMAGES:
+        assert pack.read(key) == data
+    assert pack.ext(_key("Parus major")) == ".jpg"
+    assert pack.ext(_key("Turdus merula")) == ".png"
+    assert pack.ext(_key("Erithacus rubecula")) == ".svg"
+    # 不支持的扩展名按 .jpg 处理
+    assert pack.ext(_key("Sturnus vulgaris")) == ".jpg"
+
+
+def test_index_is_sorted_for_binary_search(pack):
+    keys = list(pack._keys)
+    assert keys == sorted(keys)
+    for key, _, _ in IMAGES:
+        position, _ = pack.find(key)
+        assert keys[position] == bytes.fromhex(key)
+
+
+def test_missing_keys(pack):
+    assert pack.find(_key("Corvus corax")) is None
+    assert pack.read(_key("Corvus corax")) is None
+    assert pack.ext("ffffffffffffffffffffffffffffffff") is None
+    assert pack.find("00000000000000000000000000000000") is None
+    assert pack.find("not-a-key") is None
+
+
+def test_empty_pack(tmp_path):
+    path = tmp_path / "empty.pack"
+    write_pack(path, [])
+    pack = ImagePack.open(path)
+    assert len(pack) == 0
+    assert pack.find(_key("Parus major")) is None
+    pack.close()
+
+
+def test_duplicate_keys_rejected_and_existing_pack_kept(tmp_path):
+    path = tmp_path / "images.pack"
+    write_pack(path, IMAGES[:1])
+    with pytest.raises(ValueError):
+        write_pack(path, [IMAGES[0], (IMAGES[0][0], ".png", b"other")])
+    assert not path.with_suffix(".pack.tmp").exists()
+    pack = ImagePack.open(path)
+    assert pack.read(IMAGES[0][0]) == b"parus"
+    pack.close()
+
+
+def test_open_rejects_missing_and_invalid_files(tmp_path):
+    assert ImagePack.open(tmp_path / "missing.pack") is None
+    path = tmp_path / "bad.pack"
+    path.write_bytes(b"x" * 64)
+    assert ImagePack.open(path) is None
@@ -0,0 +1,49 @@
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+
+def parse_layouts(value):
+    """把 "1x4,2x2,4x1" 解析为 [(线程数, 工作线程数), ...]"""
+    layouts = []
+    for item in value.split(","):
+        threads, _, workers = item.strip().lower().partition("x")
+        layouts.append((int(threads), int(workers)))
+    return layouts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark TFLite threads-per-interpreter x inference workers and save the best layout."
+    )
+    parser.add_argument("--clip", type=Path, help="Reference recording (default: 60 s of synthetic noise)")
+    parser.add_argument("--model", help="Model id to benchmark (default: DEFAULT_MODEL)")
+    parser.add_argument("--layouts", type=parse_layouts, help='Layouts to try, e.g. "1x4,2x2,4x1" (default: full grid)')
+    parser.add_argument("--output", type=Path, help="Tuning file to write (default: TUNING_FILE)")
+    parser.add_argument("--dry-run", action="store_true", help="Print results without saving")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    from app import config
+    from app.services import autotune
+
+    tuning = autotune.calibrate(args.model, args.clip, args.layouts)
+
+    print(f"\n{'threads':>8} {'workers':>8} {'seg/s':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for r in sorted(tuning["results"], key=lambda r: -r["segmentsPerSecond"]):
+        print(
+            f"{r['tfliteThreads']:>8} {r['analysisWorkers']:>8} {r['segmentsPerSecond']:>10.1f} "
+            f"{r['latencyP50'] * 1000:>8.0f} {r['latencyP95'] * 1000:>8.0f}"
+        )
+    print(f"\nBest: {tuning['tfliteThreads']} threads x {tuning['analysisWorkers']} workers")
+
+    if not args.dry_run:
+        output = args.output or config.TUNING_FILE
+        autotune.save(tuning, output)
+        print(f"Saved to {output}; the server picks it up on next start.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())